@@ -0,0 +1,160 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+# cache de respostas em memória para as rotas de leitura
+# os dados só mudam quando o 4_loader.py roda, então guardamos a resposta pronta (LRU + TTL)
+# e invalidamos tudo quando o loader grava uma nova "versão dos dados" (tabela etl_versao)
+CACHE_ENABLED = os.getenv("ANS_CACHE_ENABLED", "1") == "1"
+CACHE_TTL = int(os.getenv("ANS_CACHE_TTL", "300")) # segundos
+CACHE_MAX_ENTRIES = int(os.getenv("ANS_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_AGE = int(os.getenv("ANS_CACHE_MAX_AGE", "60")) # Cache-Control pro navegador
+VERSION_CHECK_INTERVAL = int(os.getenv("ANS_CACHE_VERSION_CHECK", "5")) # segundos entre consultas da versão
+
+
+class TTLCache:
+    """LRU com expiração por entrada; thread-safe (as rotas sync rodam no threadpool)"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < self._clock():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DataVersion:
+    """
+    versão dos dados gravada pelo loader; consultada no banco no máximo a cada 'interval' segundos
+    quando muda, o cache inteiro é descartado
+    """
+
+    def __init__(self, read, interval=VERSION_CHECK_INTERVAL, clock=time.monotonic):
+        self._read = read # função síncrona que devolve a versão atual (database.read_data_version)
+        self.interval = interval
+        self._clock = clock
+        self._checked_at = None
+        self.value = None
+
+    async def current(self):
+        now = self._clock()
+        if self._checked_at is None or now - self._checked_at >= self.interval:
+            self.value = await run_in_threadpool(self._read)
+            self._checked_at = now
+        return self.value
+
+
+def make_etag(version, body):
+    digest = hashlib.sha1(body).hexdigest()[:16]
+    return f'"{version or "0"}-{digest}"'
+
+
+class ResponseCacheMiddleware:
+    """
+    middleware ASGI: para GETs nas rotas de 'paths' (regex compiladas), serve a resposta
+    do cache quando possível, sempre com ETag/Cache-Control, e responde 304 se o cliente
+    mandar If-None-Match com a ETag atual
+    """
+
+    def __init__(self, app, paths, read_version, cache=None, version=None):
+        self.app = app
+        self.paths = paths
+        self.cache = cache or TTLCache()
+        self.version = version or DataVersion(read_version)
+        self._seen_version = None
+
+    def _cacheable(self, scope):
+        return (
+            CACHE_ENABLED and scope['type'] == 'http' and scope['method'] == 'GET'
+            and any(p.fullmatch(scope['path']) for p in self.paths)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if not self._cacheable(scope):
+            await self.app(scope, receive, send)
+            return
+
+        version = await self.version.current()
+        if version != self._seen_version:
+            self.cache.clear()
+            self._seen_version = version
+
+        # chave = rota + query params (ordenados, pra ?a=1&b=2 e ?b=2&a=1 caírem na mesma entrada)
+        query = '&'.join(sorted(scope.get('query_string', b'').decode().split('&')))
+        key = f"{scope['path']}?{query}"
+        headers = dict(scope.get('headers') or [])
+        if_none_match = headers.get(b'if-none-match', b'').decode()
+
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = await self._capture(scope, receive)
+            if entry['status'] == 200:
+                entry['etag'] = make_etag(version, entry['body'])
+                self.cache.set(key, entry)
+            else:
+                await self._send(send, entry, extra_headers=[])
+                return
+
+        cache_headers = [
+            (b'etag', entry['etag'].encode()),
+            (b'cache-control', f"public, max-age={CACHE_MAX_AGE}".encode()),
+        ]
+        if if_none_match and entry['etag'] in [t.strip() for t in if_none_match.split(',')]:
+            await send({'type': 'http.response.start', 'status': 304, 'headers': cache_headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await self._send(send, entry, cache_headers)
+
+    async def _capture(self, scope, receive):
+        """roda a rota e guarda status/headers/corpo em vez de mandar pro cliente"""
+        entry = {'status': 500, 'headers': [], 'body': b''}
+        chunks = []
+
+        async def capture_send(message):
+            if message['type'] == 'http.response.start':
+                entry['status'] = message['status']
+                entry['headers'] = [
+                    (k, v) for k, v in message.get('headers', [])
+                    if k.lower() not in (b'content-length', b'etag', b'cache-control')
+                ]
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.app(scope, receive, capture_send)
+        entry['body'] = b''.join(chunks)
+        return entry
+
+    async def _send(self, send, entry, extra_headers):
+        headers = entry['headers'] + extra_headers + [(b'content-length', str(len(entry['body'])).encode())]
+        await send({'type': 'http.response.start', 'status': entry['status'], 'headers': headers})
+        await send({'type': 'http.response.body', 'body': entry['body']})
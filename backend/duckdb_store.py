@@ -0,0 +1,183 @@
+"""
+backend embarcado (ANS_DB_BACKEND=duckdb): a API consulta direto os arquivos que o ETL grava
+em data/processed, sem Postgres e sem etapa de carga
+
+as tabelas que as rotas usam viram views do DuckDB em cima do consolidado (parquet particionado
+ou csv) e do agregado, com os mesmos nomes/colunas do sql/init.sql; o SQL das rotas é o mesmo
+nos dois backends. subir é instantâneo: nada é lido até a primeira consulta. a dim_operadoras é
+a exceção: vira tabela (um GROUP BY no histórico inteiro), montada na primeira consulta e refeita
+quando a versão dos arquivos muda
+"""
+import os
+import re
+import time
+import threading
+from pathlib import Path
+
+PROCESSED_DIR = Path(os.getenv("ANS_PROCESSED_DIR", "data/processed"))
+# segundos entre conferências da versão dos arquivos (mesma variável do cache de respostas)
+VERSION_CHECK_INTERVAL = int(os.getenv("ANS_CACHE_VERSION_CHECK", "5"))
+
+# mesmos nomes de arquivo do etl/storage.py
+CONSOLIDADO_DATASET = "consolidado_despesas"
+CONSOLIDADO_CSV = "consolidado_despesas.csv"
+AGREGADO_PARQUET = "despesas_agregadas.parquet"
+AGREGADO_CSV = "despesas_agregadas.csv"
+
+# :nome (SQLAlchemy) -> $nome (DuckDB); não mexe em '::' de cast
+_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+
+
+def _sql_path(path):
+    return str(path).replace("'", "''")
+
+
+def consolidado_source(base=None):
+    """expressão de leitura do consolidado: dataset parquet (preferido) ou o csv"""
+    base = Path(base or PROCESSED_DIR)
+    dataset = base / CONSOLIDADO_DATASET
+    if dataset.is_dir():
+        return f"read_parquet('{_sql_path(dataset)}/**/*.parquet', hive_partitioning = true)"
+    types = "{'REG_ANS': 'VARCHAR', 'CNPJ': 'VARCHAR', 'CONTA': 'VARCHAR', 'Trimestre': 'VARCHAR'}"
+    return f"read_csv('{_sql_path(base / CONSOLIDADO_CSV)}', header = true, types = {types})"
+
+
+def agregado_source(base=None):
+    base = Path(base or PROCESSED_DIR)
+    if (base / AGREGADO_PARQUET).exists():
+        return f"read_parquet('{_sql_path(base / AGREGADO_PARQUET)}')"
+    return f"read_csv('{_sql_path(base / AGREGADO_CSV)}', header = true)"
+
+
+def build_dim_operadoras(conn, base=None):
+    """
+    dim_operadoras como tabela: a listagem, o detalhe e o lookup em lote não refazem o
+    GROUP BY no consolidado inteiro a cada consulta
+    o loader faz upsert trimestre a trimestre (o cadastro mais recente vence); aqui max_by pelo período
+    """
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE dim_operadoras AS
+        SELECT CAST(REG_ANS AS VARCHAR) AS registro_ans,
+               max_by(CAST(CNPJ AS VARCHAR), periodo) AS cnpj,
+               max_by(RazaoSocial, periodo) AS razao_social,
+               max_by(UF, periodo) AS uf,
+               max_by(Modalidade, periodo) AS modalidade
+        FROM (SELECT *, CAST(Ano AS INTEGER) * 10 + TRY_CAST(left(CAST(Trimestre AS VARCHAR), 1) AS INTEGER) AS periodo FROM {consolidado_source(base)})
+        WHERE REG_ANS IS NOT NULL
+        GROUP BY REG_ANS
+    """)
+
+
+def create_views(conn, base=None):
+    consolidado = consolidado_source(base)
+    conn.execute(f"""
+        CREATE OR REPLACE VIEW fato_despesas AS
+        SELECT CAST(REG_ANS AS VARCHAR) AS registro_ans, CAST(Ano AS INTEGER) AS ano,
+               CAST(Trimestre AS VARCHAR) AS trimestre, CAST(CONTA AS VARCHAR) AS conta,
+               CAST(VALOR AS DOUBLE) AS valor
+        FROM {consolidado}
+    """)
+    build_dim_operadoras(conn, base)
+    # mesma regra do refresh_serie_trimestral do 4_loader.py (sem negativos; conta sem conta-mãe informada no trimestre)
+    conn.execute("""
+        CREATE OR REPLACE VIEW serie_trimestral AS
+        WITH contas AS (
+            SELECT registro_ans, ano, trimestre, conta, SUM(valor) AS valor, COUNT(*) AS lancamentos
+            FROM fato_despesas
+            WHERE registro_ans IS NOT NULL AND conta IS NOT NULL AND valor >= 0
+            GROUP BY registro_ans, ano, trimestre, conta
+        ),
+        prefixos AS (
+            SELECT registro_ans, ano, trimestre, conta, left(conta, nivel) AS mae
+            FROM contas, generate_series(1, length(conta) - 1) AS g(nivel)
+        ),
+        descendentes AS (
+            SELECT DISTINCT p.registro_ans, p.ano, p.trimestre, p.conta
+            FROM prefixos p
+            JOIN contas m ON m.registro_ans = p.registro_ans AND m.ano = p.ano
+                         AND m.trimestre = p.trimestre AND m.conta = p.mae
+        )
+        SELECT registro_ans, ano, trimestre,
+               SUM(valor) FILTER (WHERE NOT tem_mae) AS total,
+               SUM(lancamentos) AS qtd_lancamentos,
+               COALESCE(map_from_entries(list({'k': conta, 'v': valor}) FILTER (WHERE length(conta) = 2)), MAP {}) AS grupos
+        FROM (
+            SELECT c.*, d.conta IS NOT NULL AS tem_mae
+            FROM contas c
+            LEFT JOIN descendentes d USING (registro_ans, ano, trimestre, conta)
+        )
+        GROUP BY registro_ans, ano, trimestre
+    """)
+    conn.execute(f"""
+        CREATE OR REPLACE VIEW analise_agregada AS
+        SELECT RazaoSocial AS razao_social, UF AS uf, Valor_Total AS valor_total,
+               Media_Trimestral AS media_trimestral, Desvio_Padrao AS desvio_padrao,
+               Qtd_Trimestres AS qtd_trimestres
+        FROM {agregado_source(base)}
+    """)
+
+
+class DuckDBStore:
+    """
+    conexão única em memória com as views; cada requisição usa um cursor próprio
+    (cursores do DuckDB podem ser usados em threads diferentes)
+    """
+
+    def __init__(self, base=None, interval=VERSION_CHECK_INTERVAL, clock=time.monotonic):
+        self.base = Path(base or PROCESSED_DIR)
+        self.interval = interval
+        self._clock = clock
+        self._conn = None
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def connection(self):
+        # views criadas na primeira consulta (startup não lê nada do disco); a dim_operadoras
+        # é refeita quando o ETL grava arquivos novos (conferido no máximo a cada 'interval' segundos)
+        with self._lock:
+            now = self._clock()
+            if self._conn is None:
+                import duckdb
+                conn = duckdb.connect(":memory:")
+                self._version = self.data_version()
+                create_views(conn, self.base)
+                self._conn, self._checked_at = conn, now
+            elif now - self._checked_at >= self.interval:
+                self._checked_at = now
+                version = self.data_version()
+                if version != self._version:
+                    # refaz a dim_operadoras e as views (o consolidado pode ter trocado de csv pra parquet)
+                    create_views(self._conn, self.base)
+                    self._version = version
+            return self._conn
+
+    def cursor(self):
+        return self.connection().cursor()
+
+    def data_version(self):
+        """a 'versão dos dados' aqui é a data de modificação mais recente dos arquivos processados"""
+        files = list(self.base.glob(f"{CONSOLIDADO_DATASET}/**/*.parquet"))
+        files += [self.base / name for name in (CONSOLIDADO_CSV, AGREGADO_PARQUET, AGREGADO_CSV)]
+        mtimes = [f.stat().st_mtime_ns for f in files if f.exists()]
+        return str(max(mtimes)) if mtimes else None
+
+
+def execute(cursor, sql, params=None):
+    """roda o SQL das rotas (parâmetros :nome) e devolve as linhas como dicts"""
+    sql = _PARAM.sub(r"$\1", sql)
+    cursor.execute(sql, params or {})
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def iter_batches(cursor, sql, params=None, batch_rows=5000):
+    """lotes de linhas (dicts) direto do resultado, sem materializar tudo"""
+    sql = _PARAM.sub(r"$\1", sql)
+    cursor.execute(sql, params or {})
+    columns = [d[0] for d in cursor.description]
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            break
+        yield [dict(zip(columns, row)) for row in rows]
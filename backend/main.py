@@ -1,10 +1,16 @@
+import io
+import re
+import csv
+import json
+import base64
+from decimal import Decimal
 from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List, Optional
-from pydantic import BaseModel, ConfigDict
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Literal, Dict
+from pydantic import BaseModel, ConfigDict, Field
 from backend import database
+from backend.cache import ResponseCacheMiddleware
 
 app = FastAPI(
     title="API Intuitive Care - Teste Técnico",
@@ -21,12 +27,23 @@ origins = [
     "http://localhost:8000",
 ]
 
+# cache de respostas das rotas de leitura (os dados só mudam quando o loader roda)
+# registrado antes do CORS para ficar por dentro dele: os headers de CORS dependem da origem e não vão pro cache
+CACHED_ROUTES = [
+    re.compile(r"/api/estatisticas"),
+    re.compile(r"/api/operadoras/[^/]+"),
+    re.compile(r"/api/operadoras/[^/]+/despesas"),
+    re.compile(r"/api/operadoras/[^/]+/serie"),
+]
+app.add_middleware(ResponseCacheMiddleware, paths=CACHED_ROUTES, read_version=database.read_data_version)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"], 
+    expose_headers=["ETag"], # o frontend revalida com If-None-Match
 )
 
 # --- schemas (Modelos de Resposta pydantic) ---
@@ -47,6 +64,12 @@ class DespesaDTO(BaseModel):
     conta: str
     valor: float
 
+class SerieTrimestralDTO(BaseModel):
+    ano: int
+    trimestre: str
+    total: Optional[float]
+    grupos: Optional[Dict[str, float]] = None # subtotais por conta de 2 dígitos (só com ?grupos=true)
+
 class EstatisticaDTO(BaseModel):
     razao_social: str
     uf: str
@@ -57,67 +80,180 @@ class EstatisticaDTO(BaseModel):
 
 class PaginatedResponse(BaseModel):
     data: List[OperadoraDTO]
-    total: int
+    total: Optional[int]
     page: int
     limit: int
+    next_cursor: Optional[str] = None # cursor da próxima página (paginação keyset)
+    total_estimado: bool = False # True quando 'total' veio da estimativa do planner
+
+# limite de identificadores por chamada do lote (protege o banco e o tamanho da resposta)
+BATCH_MAX_IDS = 1000
+
+class BatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_IDS, description="Registros ANS e/ou CNPJs, misturados")
+    incluir_ultimo_trimestre: bool = False
+
+class OperadoraLoteDTO(OperadoraDTO):
+    # só com incluir_ultimo_trimestre=true (vem da serie_trimestral)
+    ultimo_ano: Optional[int] = None
+    ultimo_trimestre: Optional[str] = None
+    total_ultimo_trimestre: Optional[float] = None
+
+class BatchResponse(BaseModel):
+    operadoras: Dict[str, Optional[OperadoraLoteDTO]] # chave = identificador enviado; null = não encontrado
+    nao_encontrados: List[str]
+
+# --- helpers da paginação keyset ---
+# o cursor é opaco pro cliente: (razao_social, registro_ans) da última linha em base64
+
+def encode_cursor(row):
+    raw = json.dumps([row['razao_social'], row['registro_ans']]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    try:
+        razao, reg = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return razao, str(reg)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+async def estimate_count(db, sql_query, params):
+    """
+    contagem estimada pelo planner (EXPLAIN), sem varrer a tabela
+    serve pra buscas muito amplas onde o COUNT(*) exato custaria um scan inteiro
+    """
+    if database.DUCKDB:
+        # no DuckDB (colunar, em processo) o COUNT direto já é barato
+        return await database.fetch_scalar(db, f"SELECT COUNT(*) FROM ({sql_query}) as total", params)
+    plan = await database.fetch_scalar(db, f"EXPLAIN (FORMAT JSON) {sql_query}", params)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+async def keyset_page(db, sql_query, params, cursor, limit):
+    """
+    até limit + 1 linhas depois do cursor, na ordem (razao_social, registro_ans) com NULLs no fim
+    a comparação de linha fica sozinha no WHERE pra virar Index Cond (custo constante em qualquer
+    profundidade); as razao_social NULL saem numa segunda consulta, só quando as outras acabaram
+    """
+    c_razao, c_reg = cursor
+    rows = []
+    if c_razao is not None:
+        page_sql = sql_query + " AND (razao_social, registro_ans) > (:c_razao, :c_reg) ORDER BY razao_social, registro_ans LIMIT :limit"
+        rows = list(await database.fetch_all(db, page_sql, {**params, 'c_razao': c_razao, 'c_reg': c_reg, 'limit': limit + 1}))
+    if len(rows) <= limit:
+        tail_sql = sql_query + " AND razao_social IS NULL"
+        tail_params = {**params, 'limit': limit + 1 - len(rows)}
+        if c_razao is None:
+            tail_sql += " AND registro_ans > :c_reg"
+            tail_params['c_reg'] = c_reg
+        rows += await database.fetch_all(db, tail_sql + " ORDER BY razao_social, registro_ans LIMIT :limit", tail_params)
+    return rows
 
 # --- rotas ---
 
 @app.get("/api/operadoras", response_model=PaginatedResponse)
-def listar_operadoras(
+async def listar_operadoras(
     page: int = Query(1, ge=1, description="Número da página"),
     limit: int = Query(10, ge=1, le=100, description="Itens por página"),
     search: Optional[str] = Query(None, description="Busca por Razão Social ou CNPJ"),
-    db: Session = Depends(database.get_db)
+    cursor: Optional[str] = Query(None, description="Cursor da página seguinte (next_cursor); substitui 'page'"),
+    count: Literal['exact', 'estimated', 'none'] = Query('exact', description="Modo de contagem do total"),
+    db=Depends(database.get_db)
 ):
     """
     lista todas as operadoras com paginaçao e busca (SQL LIKE)
+    - page: LIMIT/OFFSET (contrato original do frontend)
+    - cursor: paginação keyset por (razao_social, registro_ans), custo constante em qualquer profundidade
+    - count: 'exact' (COUNT), 'estimated' (estimativa do planner) ou 'none' (sem total)
     """
-    offset = (page - 1) * limit
-    
     # query Base
     sql_query = "SELECT * FROM dim_operadoras WHERE 1=1"
     params = {}
     
-    # filtro de busca (case insensitive no PostgreSQL usa ILIKE)
+    # filtro de busca (case insensitive no PostgreSQL usa ILIKE, acelerado pelos índices trigram)
     if search:
         sql_query += " AND (razao_social ILIKE :search OR cnpj LIKE :search)"
         params['search'] = f"%{search}%"
     
     #contagem Total (para a paginaçao funcionar no front)
-    count_sql = f"SELECT COUNT(*) FROM ({sql_query}) as total"
-    total = db.execute(text(count_sql), params).scalar()
-    
-    #busca Paginada
-    sql_query += " ORDER BY razao_social LIMIT :limit OFFSET :offset"
-    params['limit'] = limit
-    params['offset'] = offset
+    total = None
+    if count == 'exact':
+        count_sql = f"SELECT COUNT(*) FROM ({sql_query}) as total"
+        total = await database.fetch_scalar(db, count_sql, params)
+    elif count == 'estimated':
+        total = await estimate_count(db, sql_query, params)
     
-    result = db.execute(text(sql_query), params).mappings().all()
+    if cursor:
+        rows = await keyset_page(db, sql_query, params, decode_cursor(cursor), limit)
+    else:
+        #busca Paginada
+        page_sql = sql_query + " ORDER BY razao_social, registro_ans LIMIT :limit OFFSET :offset"
+        # uma linha a mais só pra saber se existe próxima página
+        rows = await database.fetch_all(db, page_sql, {**params, 'limit': limit + 1, 'offset': (page - 1) * limit})
+    result = rows[:limit]
+    next_cursor = encode_cursor(result[-1]) if len(rows) > limit else None
     
     return {
         "data": result,
         "total": total,
         "page": page,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor,
+        "total_estimado": count == 'estimated'
     }
 
 @app.get("/api/operadoras/{identificador}")
-def detalhes_operadora(identificador: str, db: Session = Depends(database.get_db)):
+async def detalhes_operadora(identificador: str, db=Depends(database.get_db)):
     """
     busca operadora por Registro ANS ou CNPJ
     """
     #tenta buscar por Registro ANS
     sql = "SELECT * FROM dim_operadoras WHERE registro_ans = :id OR cnpj = :id"
-    result = db.execute(text(sql), {'id': identificador}).mappings().first()
+    result = await database.fetch_one(db, sql, {'id': identificador})
     
     if not result:
         raise HTTPException(status_code=404, detail="Operadora não encontrada")
     
     return result
 
+@app.post("/api/operadoras/batch", response_model=BatchResponse)
+async def operadoras_em_lote(body: BatchRequest, db=Depends(database.get_db)):
+    """
+    resolve vários Registros ANS/CNPJs numa consulta só (= ANY), em vez de uma requisição por operadora
+    cada identificador enviado aparece no mapa; os que não existem vêm como null e em 'nao_encontrados'
+    """
+    ids = list(dict.fromkeys(i.strip() for i in body.ids)) # sem repetidos, na ordem enviada
+    if body.incluir_ultimo_trimestre:
+        # último trimestre de cada operadora pelo índice da serie_trimestral (LIMIT 1 por operadora)
+        sql = """
+            SELECT o.*, s.ano AS ultimo_ano, s.trimestre AS ultimo_trimestre, s.total AS total_ultimo_trimestre
+            FROM dim_operadoras o
+            LEFT JOIN LATERAL (
+                SELECT ano, trimestre, total FROM serie_trimestral s
+                WHERE s.registro_ans = o.registro_ans
+                ORDER BY ano DESC, trimestre DESC LIMIT 1
+            ) s ON true
+            WHERE o.registro_ans = ANY(CAST(:ids AS VARCHAR[])) OR o.cnpj = ANY(CAST(:ids AS VARCHAR[]))
+        """
+    else:
+        sql = "SELECT * FROM dim_operadoras WHERE registro_ans = ANY(CAST(:ids AS VARCHAR[])) OR cnpj = ANY(CAST(:ids AS VARCHAR[]))"
+    rows = await database.fetch_all(db, sql, {'ids': ids})
+
+    encontrados = {}
+    for row in rows:
+        for chave in (row['registro_ans'], row['cnpj']):
+            if chave is not None:
+                encontrados.setdefault(chave, row)
+
+    operadoras = {i: encontrados.get(i) for i in ids}
+    return {
+        "operadoras": operadoras,
+        "nao_encontrados": [i for i, row in operadoras.items() if row is None],
+    }
+
 @app.get("/api/operadoras/{registro_ans}/despesas", response_model=List[DespesaDTO])
-def historico_despesas(registro_ans: str, db: Session = Depends(database.get_db)):
+async def historico_despesas(registro_ans: str, db=Depends(database.get_db)):
     """
     retorna o histórico de despesas de uma operadora
     """
@@ -128,17 +264,95 @@ def historico_despesas(registro_ans: str, db: Session = Depends(database.get_db)
         WHERE registro_ans = :reg 
         ORDER BY ano DESC, trimestre DESC
     """
-    result = db.execute(text(sql), {'reg': registro_ans}).mappings().all()
+    result = await database.fetch_all(db, sql, {'reg': registro_ans})
     
     return result
 
+@app.get("/api/operadoras/{registro_ans}/serie", response_model=List[SerieTrimestralDTO])
+async def serie_trimestral(registro_ans: str, grupos: bool = False, db=Depends(database.get_db)):
+    """
+    total de despesas da operadora por trimestre (uma linha por trimestre, pronto pro gráfico)
+    lê a serie_trimestral montada pelo ETL em vez de somar as contas da fato a cada requisição
+    """
+    colunas = "ano, trimestre, total, grupos" if grupos else "ano, trimestre, total"
+    sql = f"""
+        SELECT {colunas}
+        FROM serie_trimestral
+        WHERE registro_ans = :reg
+        ORDER BY ano DESC, trimestre DESC
+    """
+    return await database.fetch_all(db, sql, {'reg': registro_ans})
+
 @app.get("/api/estatisticas", response_model=List[EstatisticaDTO])
-def obter_estatisticas(db: Session = Depends(database.get_db)):
+async def obter_estatisticas(db=Depends(database.get_db)):
     """
     retorna o Top 5 operadoras com maiores despesas (Pré-calculado no ETL)
     Estratégia: Leitura direta da tabela 'analise_agregada' para performance máxima
     """
     sql = "SELECT * FROM analise_agregada ORDER BY valor_total DESC LIMIT 10"
-    result = db.execute(text(sql)).mappings().all()
+    result = await database.fetch_all(db, sql)
     
-    return result
\ No newline at end of file
+    return result
+
+# --- exportação em streaming ---
+# extração de períodos inteiros pros analistas: as linhas saem de um cursor no servidor, lote a lote,
+# direto pro corpo da resposta (memória constante, não importa o tamanho do resultado)
+
+EXPORT_COLUMNS = ['registro_ans', 'cnpj', 'razao_social', 'uf', 'modalidade', 'ano', 'trimestre', 'conta', 'valor']
+EXPORT_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+def _json_value(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+def format_ndjson(batch):
+    return ''.join(
+        json.dumps({k: _json_value(v) for k, v in row.items()}, ensure_ascii=False) + '\n' for row in batch
+    )
+
+def format_csv(batch, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([row[c] for c in EXPORT_COLUMNS] for row in batch)
+    return buffer.getvalue()
+
+async def export_body(sql, params, formato):
+    if formato == 'csv':
+        # header sai mesmo sem linhas
+        yield format_csv([], header=True).encode('utf-8')
+    async for batch in database.stream_batches(sql, params):
+        text_batch = format_csv(batch) if formato == 'csv' else format_ndjson(batch)
+        yield text_batch.encode('utf-8')
+
+@app.get("/api/export/despesas")
+async def exportar_despesas(
+    formato: Literal['ndjson', 'csv'] = Query('ndjson', description="Formato da exportação"),
+    ano: Optional[int] = Query(None),
+    trimestre: Optional[str] = Query(None, description="Ex: 1T"),
+    uf: Optional[str] = Query(None),
+    modalidade: Optional[str] = Query(None),
+):
+    """
+    exporta as despesas (fato + dados cadastrais) em NDJSON ou CSV, em streaming
+    filtros por ano/trimestre usam o particionamento da fato (só as partições do período são lidas)
+    """
+    sql = """
+        SELECT f.registro_ans, o.cnpj, o.razao_social, o.uf, o.modalidade, f.ano, f.trimestre, f.conta, f.valor
+        FROM fato_despesas f
+        LEFT JOIN dim_operadoras o ON o.registro_ans = f.registro_ans
+        WHERE 1=1
+    """
+    params = {}
+    filtros = {'f.ano': ano, 'f.trimestre': trimestre, 'o.uf': uf, 'o.modalidade': modalidade}
+    for coluna, valor in filtros.items():
+        if valor is not None:
+            nome = coluna.split('.')[1]
+            sql += f" AND {coluna} = :{nome}"
+            params[nome] = valor
+
+    return StreamingResponse(
+        export_body(sql, params, formato),
+        media_type=EXPORT_MEDIA_TYPES[formato],
+        headers={'Content-Disposition': f'attachment; filename="despesas.{formato}"'}
+    )
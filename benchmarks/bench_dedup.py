@@ -0,0 +1,75 @@
+"""
+benchmark do filtro de duplicidade contábil (3_aggregator.remove_accounting_duplication)
+compara o caminho antigo (sort global por CONTA + decisão única para o arquivo todo) com o
+resolvedor vetorizado por operadora/trimestre. o antigo é mais barato, mas descarta quem não
+informou a conta '4'; o número de linhas mantidas mostra a diferença
+
+uso: python benchmarks/bench_dedup.py [linhas] [operadoras]
+"""
+import sys
+import time
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ETL_DIR = Path(__file__).resolve().parent.parent / "etl"
+sys.path.insert(0, str(ETL_DIR))
+spec = importlib.util.spec_from_file_location("aggregator", ETL_DIR / "3_aggregator.py")
+aggregator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(aggregator)
+
+CONTAS = ['4', '41', '411', '4111', '412', '46', '461', '4611', '31']
+
+
+def synthetic_frame(n_rows, n_ops, quarters=4):
+    rng = np.random.default_rng(0)
+    ops = rng.integers(0, n_ops, n_rows)
+    contas = rng.choice(CONTAS, n_rows)
+    # 1/3 das operadoras não informa a conta '4' (só as analíticas)
+    sem_total = (ops % 3 == 0) & (contas == '4')
+    contas = np.where(sem_total, '41', contas)
+    return pd.DataFrame({
+        'REG_ANS': pd.Categorical([f"{o:06d}" for o in ops]),
+        'CNPJ': pd.Categorical([f"{o:014d}" for o in ops]),
+        'Ano': 2024,
+        'Trimestre': pd.Categorical(rng.choice([f"{q + 1}T" for q in range(quarters)], n_rows)),
+        'CONTA': contas,
+        'VALOR': rng.random(n_rows),
+    })
+
+
+def legacy_dedup(df):
+    """reprodução do caminho antigo: sort global e, havendo qualquer '4', só as linhas '4'"""
+    df = df.sort_values(by='CONTA')
+    df_despesas = df[df['CONTA'].astype(str).str.startswith('4')]
+    totals = df_despesas[df_despesas['CONTA'].astype(str) == '4']
+    return totals if len(totals) > 0 else df_despesas
+
+
+def timed(func, df, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = func(df)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    n_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    df = synthetic_frame(n_rows, n_ops)
+
+    t_old, old = timed(legacy_dedup, df)
+    t_new, new = timed(aggregator.remove_accounting_duplication, df)
+    print(f"\n{n_rows} linhas, {n_ops} operadoras")
+    print(f"  sort global (antigo): {t_old:.3f}s  {n_rows / t_old:,.0f} linhas/s  {len(old)} linhas mantidas, "
+          f"{old['CNPJ'].nunique()} operadoras")
+    print(f"  por operadora/trim. : {t_new:.3f}s  {n_rows / t_new:,.0f} linhas/s  {len(new)} linhas mantidas, "
+          f"{new['CNPJ'].nunique()} operadoras")
+
+
+if __name__ == "__main__":
+    main()
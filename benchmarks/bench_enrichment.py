@@ -0,0 +1,95 @@
+"""
+benchmark do enriquecimento cadastral (REG_ANS -> CNPJ/RazaoSocial/UF/Modalidade)
+compara o caminho antigo (dict + apply com pd.Series por linha) com o join vetorizado atual
+
+uso: python benchmarks/bench_enrichment.py [linhas] [operadoras]
+"""
+import sys
+import time
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ETL_DIR = Path(__file__).resolve().parent.parent / "etl"
+sys.path.insert(0, str(ETL_DIR)) # o processor importa os módulos compartilhados do etl/ (storage, state)
+import cadastro
+spec = importlib.util.spec_from_file_location("processor", ETL_DIR / "2_processor.py")
+processor = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(processor)
+
+
+def synthetic_cadop(n_ops):
+    regs = np.arange(300000, 300000 + n_ops).astype(str)
+    return pd.DataFrame({
+        'Registro_ANS': regs,
+        'CNPJ': [f"{i:014d}" for i in range(n_ops)],
+        'Razao_Social': [f"OPERADORA {i}" for i in range(n_ops)],
+        'UF': np.random.choice(['SP', 'RJ', 'MG', 'RS'], n_ops),
+        'Modalidade': np.random.choice(['Cooperativa Médica', 'Medicina de Grupo'], n_ops),
+    })
+
+
+def synthetic_quarter(n_rows, n_ops):
+    # ~5% dos registros ficam fora do cadastro, como acontece nos dados reais
+    regs = np.random.randint(300000, 300000 + int(n_ops * 1.05), n_rows).astype(str)
+    return pd.DataFrame({
+        'REG_ANS': regs,
+        'CONTA': np.random.choice(['4', '41', '411', '46'], n_rows),
+        'VALOR': np.random.rand(n_rows).round(2).astype(str),
+    })
+
+
+def legacy_enrichment(df, df_cadop):
+    """reprodução do caminho antigo: iterrows pra montar o dict + apply por linha"""
+    lookup = {}
+    for _, row in df_cadop.iterrows():
+        lookup[str(row['Registro_ANS']).strip()] = {
+            'CNPJ': row['CNPJ'], 'RazaoSocial': row['Razao_Social'],
+            'UF': row['UF'], 'Modalidade': row['Modalidade']
+        }
+
+    def get_meta(reg):
+        d = lookup.get(str(reg), {})
+        return pd.Series([d.get('CNPJ'), d.get('RazaoSocial'), d.get('UF'), d.get('Modalidade')])
+
+    df[['CNPJ', 'RazaoSocial', 'UF', 'Modalidade']] = df['REG_ANS'].apply(get_meta)
+    return df
+
+
+def vectorized_enrichment(df, df_cadop):
+    cadop_map = cadastro.build_cadop_frame(df_cadop.copy())
+    return processor.enrich_with_cadastro(df, cadop_map)
+
+
+def timed(fn, df, df_cadop):
+    start = time.perf_counter()
+    out = fn(df.copy(), df_cadop)
+    return out, time.perf_counter() - start
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    n_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    np.random.seed(42)
+    df_cadop = synthetic_cadop(n_ops)
+    df = synthetic_quarter(n_rows, n_ops)
+
+    print(f"=== Benchmark de enriquecimento: {n_rows} linhas, {n_ops} operadoras ===")
+    legacy, t_legacy = timed(legacy_enrichment, df, df_cadop)
+    vector, t_vector = timed(vectorized_enrichment, df, df_cadop)
+
+    # os dois caminhos precisam dar o mesmo resultado (NaN e None contam como ausente)
+    cols = processor.CADOP_FIELDS
+    pd.testing.assert_frame_equal(
+        legacy[cols].astype(object).fillna('').astype(str), vector[cols].astype(object).fillna('').astype(str)
+    )
+
+    print(f"[LEGADO]    {t_legacy:8.3f}s  {n_rows / t_legacy:14,.0f} linhas/s")
+    print(f"[VETORIZADO]{t_vector:8.3f}s  {n_rows / t_vector:14,.0f} linhas/s")
+    print(f"[GANHO]     {t_legacy / t_vector:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
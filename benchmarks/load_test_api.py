@@ -0,0 +1,105 @@
+"""
+teste de carga da API: latência p50/p99 com N clientes concorrentes, modo sync x async
+
+sobe um uvicorn por modo (ANS_DB_ASYNC=0 e =1), dispara as rotas mais usadas pelo dashboard
+e imprime a comparação. precisa do banco de pé (docker-compose up -d) e com dados carregados
+
+uso: python benchmarks/load_test_api.py --clients 50 --requests 2000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+ROUTES = [
+    "/api/estatisticas",
+    "/api/operadoras?page=1&limit=10",
+    "/api/operadoras?page=50&limit=10",
+    "/api/operadoras?search=UNIMED&limit=10",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+async def run_load(base_url, clients, total_requests, routes):
+    latencies = []
+    errors = 0
+    counter = iter(range(total_requests))
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as http:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    response = await http.get(routes[i % len(routes)])
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "rps": total_requests / elapsed,
+        "errors": errors,
+    }
+
+
+def start_server(port, async_db):
+    env = dict(os.environ, ANS_DB_ASYNC="1" if async_db else "0")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    # espera a API responder
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("uvicorn não subiu")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50, help="clientes concorrentes")
+    parser.add_argument("--requests", type=int, default=2000, help="total de requisições por modo")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--modes", default="sync,async", help="modos a comparar (sync,async)")
+    args = parser.parse_args()
+
+    print(f"=== Teste de carga: {args.clients} clientes, {args.requests} requisições ===")
+    for mode in args.modes.split(","):
+        proc = start_server(args.port, async_db=(mode == "async"))
+        try:
+            # aquecimento (abre as conexões do pool)
+            asyncio.run(run_load(f"http://127.0.0.1:{args.port}", args.clients, args.clients, ROUTES))
+            stats = asyncio.run(run_load(f"http://127.0.0.1:{args.port}", args.clients, args.requests, ROUTES))
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f"[{mode.upper():5}] p50={stats['p50_ms']:7.1f}ms  p99={stats['p99_ms']:7.1f}ms  "
+              f"{stats['rps']:8.1f} req/s  erros={stats['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+benchmark ponta a ponta do pipeline com dados sintéticos (benchmarks/synthetic_ans.py)
+
+mede cada etapa: process_quarter_zip, clean_data, remove_accounting_duplication, aggregate_data,
+a carga no Postgres (opcional, numa transação desfeita no final) e as rotas principais da API
+(backend DuckDB em cima dos arquivos gerados, sem depender do banco). para cada etapa grava
+tempo, linhas/s e pico de RSS num JSON, que pode ser comparado com um baseline anterior
+
+uso:
+  python benchmarks/run_benchmarks.py --operators 1000 --rows 200000 --quarters 4 --output benchmarks/results/atual.json
+  python benchmarks/run_benchmarks.py --baseline benchmarks/results/atual.json --fail-on-regression
+  python benchmarks/run_benchmarks.py --loader   # inclui a carga (precisa do docker-compose up -d)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+import importlib.util
+from pathlib import Path
+from datetime import datetime, timezone
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+ETL_DIR = ROOT / "etl"
+sys.path.insert(0, str(ETL_DIR))
+sys.path.insert(0, str(ROOT))
+
+import storage
+import cadastro
+import synthetic_ans
+from metrics import PeakRSS # mesmo amostrador de memória da instrumentação do ETL
+
+API_ROUTES = [
+    "/api/estatisticas",
+    "/api/operadoras?page=1&limit=10",
+    "/api/operadoras?search=SINTÉTICA 12&limit=10",
+    "/api/operadoras/{reg}",
+    "/api/operadoras/{reg}/despesas",
+    "/api/operadoras/{reg}/serie",
+]
+
+
+def load_stage(filename, name):
+    spec = importlib.util.spec_from_file_location(name, ETL_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Results:
+    def __init__(self):
+        self.stages = {}
+
+    def measure(self, name, func, rows_in=None, rows_out=None, unit="linhas", **extra):
+        """roda func() medindo tempo e pico de RSS; rows_out pode ser uma função do resultado"""
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            result = func()
+            seconds = time.perf_counter() - start
+        out = rows_out(result) if callable(rows_out) else rows_out
+        rows = rows_in if rows_in is not None else out
+        self.stages[name] = {
+            "seconds": round(seconds, 4),
+            "rows_in": rows_in,
+            "rows_out": out,
+            "rows_per_sec": round(rows / seconds, 1) if rows and seconds > 0 else None,
+            "peak_rss_mb": round(rss.peak / 1024 / 1024, 1),
+            "unit": unit,
+            **extra,
+        }
+        print(f"[BENCH] {name:45} {seconds:8.3f}s  {self.stages[name]['rows_per_sec'] or '-':>12} {unit}/s  "
+              f"pico RSS {self.stages[name]['peak_rss_mb']} MB")
+        return result
+
+
+def bench_etl(results, zips, cadastro_csv, processed_dir, n_rows):
+    processor = load_stage("2_processor.py", "processor")
+    aggregator = load_stage("3_aggregator.py", "aggregator")
+
+    cadop_map = cadastro.build_cadop_frame(pd.read_csv(cadastro_csv, sep=';', dtype=str))
+
+    frames = results.measure(
+        "process_quarter_zip",
+        lambda: [processor.process_quarter_zip(z, cadop_map) for z in zips],
+        rows_in=n_rows * len(zips), rows_out=lambda fs: sum(len(f) for f in fs if f is not None),
+    )
+    consolidado = pd.concat([f for f in frames if f is not None], ignore_index=True)
+    del frames
+
+    # grava o consolidado como o processor faria (entrada do loader e do backend DuckDB)
+    dataset = processed_dir / "consolidado_despesas"
+    for (ano, trimestre), part in consolidado.groupby(['Ano', 'Trimestre'], sort=False):
+        storage.write_partition([part], dataset, ano, trimestre)
+
+    df = storage.read_consolidado(columns=aggregator.INPUT_COLUMNS, fmt='parquet', path=dataset)
+    n = len(df)
+    df = results.measure("clean_data", lambda: aggregator.clean_data(df), rows_in=n, rows_out=len)
+    n = len(df)
+    df = results.measure("remove_accounting_duplication", lambda: aggregator.remove_accounting_duplication(df),
+                         rows_in=n, rows_out=len)
+    n = len(df)
+    agregado = results.measure("aggregate_data", lambda: aggregator.aggregate_data(df), rows_in=n, rows_out=len)
+    agregado.to_parquet(processed_dir / "despesas_agregadas.parquet", index=False)
+    return consolidado
+
+
+def bench_loader(results, consolidado):
+    """carga completa (dimensão + fato por trimestre) numa transação que é desfeita no final"""
+    loader = load_stage("4_loader.py", "loader")
+    from sqlalchemy import text
+    engine = loader.get_engine()
+    try:
+        with engine.connect():
+            pass
+    except Exception as e:
+        print(f"[BENCH] loader ignorado (banco indisponível: {e.__class__.__name__})")
+        return
+    loader.ensure_staging_tables(engine)
+
+    def carga(conn):
+        ops = consolidado[['REG_ANS', 'CNPJ', 'RazaoSocial', 'UF', 'Modalidade']].drop_duplicates('REG_ANS')
+        ops.columns = loader.OPERADORA_COLUMNS
+        conn.execute(text("TRUNCATE stg_operadoras"))
+        loader.write_staging(conn, 'stg_operadoras', loader.OPERADORA_COLUMNS, [ops])
+        conn.execute(text("""
+            INSERT INTO dim_operadoras SELECT * FROM stg_operadoras ON CONFLICT (registro_ans) DO NOTHING
+        """))
+        rows = 0
+        for (ano, trimestre), part in consolidado.groupby(['Ano', 'Trimestre'], sort=False):
+            rows += loader.load_fato_periodos(conn, [part], [(int(ano), trimestre)])
+        return rows
+
+    with engine.connect() as conn:
+        tx = conn.begin()
+        try:
+            results.measure("loader", lambda: carga(conn), rows_in=len(consolidado), rows_out=lambda r: r,
+                            engine=loader.LOAD_ENGINE)
+        finally:
+            tx.rollback()
+
+
+def bench_api(results, processed_dir, requests_per_route):
+    # backend escolhido na importação: DuckDB direto nos arquivos recém-gerados, cache de respostas desligado
+    os.environ.update(ANS_DB_BACKEND="duckdb", ANS_PROCESSED_DIR=str(processed_dir), ANS_CACHE_ENABLED="0")
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    with TestClient(app) as client:
+        reg = client.get("/api/operadoras?limit=1").json()["data"][0]["registro_ans"]
+        for route in API_ROUTES:
+            url = route.format(reg=reg)
+            latencies = []
+
+            def run():
+                for _ in range(requests_per_route):
+                    start = time.perf_counter()
+                    assert client.get(url).status_code == 200, url
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+            results.measure(f"api {route}", run, rows_in=requests_per_route, unit="req")
+            stage = results.stages[f"api {route}"]
+            stage["p50_ms"] = round(statistics.median(latencies), 2)
+            stage["p99_ms"] = round(sorted(latencies)[int(0.99 * (len(latencies) - 1))], 2)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """imprime a variação por etapa; devolve as etapas que ficaram mais lentas que a tolerância"""
+    regressions = []
+    print(f"\n=== Comparação com o baseline ({baseline['meta'].get('commit')}) ===")
+    for name, stage in current['stages'].items():
+        old = baseline['stages'].get(name)
+        if not old:
+            print(f"  {name:45} (nova)")
+            continue
+        delta = (stage['seconds'] - old['seconds']) / old['seconds'] if old['seconds'] else 0
+        mem = stage['peak_rss_mb'] - old['peak_rss_mb']
+        flag = ""
+        if delta > tolerance:
+            flag = "  <-- REGRESSÃO"
+            regressions.append(name)
+        print(f"  {name:45} {old['seconds']:8.3f}s -> {stage['seconds']:8.3f}s ({delta:+.1%})  RSS {mem:+.1f} MB{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operators", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=200_000, help="linhas por trimestre")
+    parser.add_argument("--quarters", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--loader", action="store_true", help="inclui a carga no Postgres (desfeita no final)")
+    parser.add_argument("--no-api", action="store_true", help="pula as rotas da API")
+    parser.add_argument("--api-requests", type=int, default=50, help="requisições por rota")
+    parser.add_argument("--workdir", help="pasta dos dados gerados (padrão: temporária, apagada no fim)")
+    parser.add_argument("--output", default=str(ROOT / "benchmarks" / "results" / "latest.json"))
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="piora de tempo aceita antes de acusar regressão")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="ans_bench_"))
+    processed_dir = workdir / "processed"
+    processed_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"=== Benchmark: {args.operators} operadoras, {args.rows} linhas x {args.quarters} trimestres ===")
+    results = Results()
+    try:
+        cadastro_csv, zips = results.measure(
+            "generate", lambda: synthetic_ans.generate(workdir, args.operators, args.rows, args.quarters, args.seed),
+            rows_in=args.rows * args.quarters,
+        )
+        consolidado = bench_etl(results, zips, cadastro_csv, processed_dir, args.rows)
+        if args.loader:
+            bench_loader(results, consolidado)
+        del consolidado
+        if not args.no_api:
+            bench_api(results, processed_dir, args.api_requests)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "operators": args.operators,
+            "rows_per_quarter": args.rows,
+            "quarters": args.quarters,
+            "seed": args.seed,
+        },
+        "stages": results.stages,
+    }
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\n[BENCH] Resultado gravado em {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+gerador de dados sintéticos no formato da ANS (para benchmarks e testes sem baixar nada)
+
+- zips trimestrais (2024_1T.zip...) com um csv latin-1 separado por ';', colunas
+  DATA;REG_ANS;CD_CONTA_CONTABIL;DESCRICAO;VL_SALDO_INICIAL;VL_SALDO_FINAL e valores com vírgula decimal
+- Relatorio_cadop.csv com o cadastro das operadoras (Registro_ANS, CNPJ, Razao_Social, Modalidade, UF...)
+~5% das linhas usam REG_ANS fora do cadastro e parte das contas não é de despesa (3x), como nos dados reais
+
+uso: python benchmarks/synthetic_ans.py --out data/synthetic --operators 1000 --rows 200000 --quarters 4
+"""
+import csv
+import zipfile
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+FIRST_REG_ANS = 300000
+UFS = ['SP', 'RJ', 'MG', 'RS', 'PR', 'BA', 'SC', 'PE', 'GO', 'DF']
+MODALIDADES = ['Cooperativa Médica', 'Medicina de Grupo', 'Autogestão', 'Odontologia de Grupo', 'Seguradora Especializada em Saúde']
+# plano de contas simplificado: sintéticas (4, 41, 46) e analíticas, mais receitas (3x) que o processor descarta
+CONTAS = ['4', '41', '411', '4111', '412', '46', '461', '3', '31', '311']
+CONTA_PESOS = [0.05, 0.10, 0.20, 0.20, 0.10, 0.05, 0.10, 0.05, 0.05, 0.10]
+DESCRICOES = {
+    '4': 'DESPESAS', '41': 'EVENTOS INDENIZÁVEIS LÍQUIDOS', '411': 'EVENTOS CONHECIDOS OU AVISADOS',
+    '4111': 'CONSULTAS MÉDICAS', '412': 'VARIAÇÃO DA PROVISÃO DE EVENTOS', '46': 'DESPESAS ADMINISTRATIVAS',
+    '461': 'DESPESAS COM PESSOAL', '3': 'RECEITAS', '31': 'CONTRAPRESTAÇÕES EFETIVAS', '311': 'RECEITAS COM OPERAÇÕES',
+}
+
+
+def operator_registry(n_operators):
+    return np.arange(FIRST_REG_ANS, FIRST_REG_ANS + n_operators)
+
+
+def cadastro_frame(n_operators, seed=0):
+    rng = np.random.default_rng(seed)
+    regs = operator_registry(n_operators)
+    return pd.DataFrame({
+        'Registro_ANS': regs.astype(str),
+        'CNPJ': [f"{90000000000000 + int(r):014d}" for r in regs],
+        'Razao_Social': [f"OPERADORA SINTÉTICA {int(r)} LTDA" for r in regs],
+        'Nome_Fantasia': [f"SINTÉTICA {int(r)}" for r in regs],
+        'Modalidade': rng.choice(MODALIDADES, n_operators),
+        'Cidade': 'São Paulo',
+        'UF': rng.choice(UFS, n_operators),
+    })
+
+
+def write_cadastro(path, n_operators, seed=0, encoding='utf-8'):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cadastro_frame(n_operators, seed).to_csv(path, sep=';', index=False, encoding=encoding, quoting=csv.QUOTE_ALL)
+    return path
+
+
+def quarter_frame(n_rows, n_operators, ano, trimestre, seed=0):
+    rng = np.random.default_rng(seed)
+    # ~5% dos registros ficam fora do cadastro
+    regs = rng.integers(FIRST_REG_ANS, FIRST_REG_ANS + int(n_operators * 1.05) + 1, n_rows)
+    contas = rng.choice(CONTAS, n_rows, p=CONTA_PESOS)
+    # valores com vírgula decimal (formato brasileiro), alguns negativos (estornos)
+    saldo_final = np.round(rng.lognormal(10, 2, n_rows) * np.where(rng.random(n_rows) < 0.02, -1, 1), 2)
+    saldo_inicial = np.round(saldo_final * rng.random(n_rows), 2)
+    mes = {'1T': '01', '2T': '04', '3T': '07', '4T': '10'}.get(trimestre, '01')
+    return pd.DataFrame({
+        'DATA': f"{ano}-{mes}-01",
+        'REG_ANS': regs.astype(str),
+        'CD_CONTA_CONTABIL': contas,
+        'DESCRICAO': pd.Series(contas).map(DESCRICOES),
+        'VL_SALDO_INICIAL': pd.Series(saldo_inicial).map('{:.2f}'.format).str.replace('.', ',', regex=False),
+        'VL_SALDO_FINAL': pd.Series(saldo_final).map('{:.2f}'.format).str.replace('.', ',', regex=False),
+    })
+
+
+def write_quarter_zip(path, n_rows, n_operators, seed=0):
+    """grava <ano>_<trimestre>.zip com o csv do trimestre (o nome define o período, como no processor)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ano, trimestre = path.stem.split('_')
+    df = quarter_frame(n_rows, n_operators, ano, trimestre, seed)
+    data = df.to_csv(sep=';', index=False, quoting=csv.QUOTE_ALL).encode('latin-1')
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr(f"{trimestre}{ano}.csv", data)
+    return path
+
+
+def quarter_names(n_quarters, first_year=2021):
+    return [f"{first_year + i // 4}_{i % 4 + 1}T" for i in range(n_quarters)]
+
+
+def generate(out_dir, n_operators=1000, n_rows=200_000, n_quarters=4, seed=0):
+    """gera o cadastro e os zips em out_dir/raw; devolve (caminho do cadastro, lista de zips)"""
+    out_dir = Path(out_dir)
+    cadastro = write_cadastro(out_dir / "Relatorio_cadop.csv", n_operators, seed)
+    zips = [
+        write_quarter_zip(out_dir / "raw" / f"{name}.zip", n_rows, n_operators, seed + i)
+        for i, name in enumerate(quarter_names(n_quarters))
+    ]
+    return cadastro, zips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="data/synthetic", help="pasta de saída")
+    parser.add_argument("--operators", type=int, default=1000, help="operadoras no cadastro")
+    parser.add_argument("--rows", type=int, default=200_000, help="linhas por trimestre")
+    parser.add_argument("--quarters", type=int, default=4, help="quantidade de trimestres")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cadastro, zips = generate(args.out, args.operators, args.rows, args.quarters, args.seed)
+    print(f"[SINTÉTICO] Cadastro: {cadastro}")
+    for z in zips:
+        print(f"[SINTÉTICO] {z} ({z.stat().st_size / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,112 @@
 import os
 import re
+import json
+import zipfile
+import importlib.util
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+import metrics
 
 # config
 BASE_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/demonstracoes_contabeis/"
 OUTPUT_DIR = Path("data/raw")
 TIMEOUT = 30
+QUARTERS_LIMIT = int(os.getenv("ANS_QUARTERS_LIMIT", "3"))
+DOWNLOAD_WORKERS = int(os.getenv("ANS_DOWNLOAD_WORKERS", "4")) # 1 = modo serial antigo
+CHUNK_SIZE = 1024 * 1024 # 1 MB por bloco (antes eram 8 KB)
+PART_SUFFIX = ".part"
+MANIFEST_FILE = Path(os.getenv("ANS_CRAWL_MANIFEST", "data/cache/crawl_manifest.json"))
+# lxml é bem mais rápido que o html.parser puro; usa se estiver instalado
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
 
 def setup_dirs():
     if not OUTPUT_DIR.exists():
         os.makedirs(OUTPUT_DIR)
 
-def get_soup(url):
+def get_session(pool_size=DOWNLOAD_WORKERS):
+    """
+    sessão HTTP compartilhada entre os workers (reaproveita conexões keep-alive)
+    o pool do adapter acompanha o número de workers pra nenhuma thread ficar esperando conexão
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def load_manifest(path=MANIFEST_FILE):
+    """
+    manifesto do crawl: para cada URL de índice guarda ETag/Last-Modified e os links já extraídos
+    formato: {url: {"etag": ..., "last_modified": ..., "links": [...]}}
+    """
     try:
-        response = requests.get(url, timeout=TIMEOUT)
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest, path=MANIFEST_FILE):
+    # grava num temporário e renomeia, pra um crash nao deixar o manifesto pela metade
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def parse_links(html):
+    # só os <a> interessam, então o SoupStrainer evita montar a árvore inteira da página
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=SoupStrainer('a'))
+    return [a.get('href') for a in soup.find_all('a') if a.get('href')]
+
+@metrics.instrument()
+def get_links(url, session=None, manifest=None):
+    """
+    retorna os hrefs de uma página de índice da ANS
+    com manifesto, faz GET condicional (If-None-Match/If-Modified-Since):
+    se o servidor responder 304 reaproveita a listagem salva sem baixar nem parsear nada
+    """
+    http = session or requests
+    cached = manifest.get(url) if manifest is not None else None
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    try:
+        response = http.get(url, timeout=TIMEOUT, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached['links']
         response.raise_for_status()
-        return BeautifulSoup(response.text, 'html.parser')
     except requests.exceptions.RequestException as e:
         print(f"[ERRO] Falha ao acessar {url}: {e}")
-        return None
+        # sem rede, a última listagem conhecida ainda é melhor que nada
+        return cached['links'] if cached else None
 
-def find_latest_quarters(base_url, limit=3):
-    soup = get_soup(base_url)
-    if not soup:
+    links = parse_links(response.text)
+    if manifest is not None:
+        manifest[url] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'links': links
+        }
+    return links
+
+def find_latest_quarters(base_url, limit=3, session=None, manifest=None):
+    links = get_links(base_url, session, manifest)
+    if not links:
         return []
 
     # forma de encontrar anos
     years = []
-    for link in soup.find_all('a'):
-        href = link.get('href')
-        if href and re.match(r'^\d{4}/?$', href): # aceita com ou sem barra final
+    for href in links:
+        if re.match(r'^\d{4}/?$', href): # aceita com ou sem barra final
             years.append(href.strip('/'))
     
     years.sort(key=int, reverse=True)
@@ -45,19 +119,16 @@ def find_latest_quarters(base_url, limit=3):
             break
             
         year_url = urljoin(base_url, f"{year}/")
-        year_soup = get_soup(year_url)
+        year_links = get_links(year_url, session, manifest)
         
-        if not year_soup:
+        if not year_links:
             continue
 
         # jeito hibrido, aqui procura tanto pastas (1T/) quanto os arquivos zip diretos (1T2023.zip)
         # vamos usar um dicionario pra evitar duplicidade
         found_in_year = {} 
 
-        for link in year_soup.find_all('a'):
-            href = link.get('href')
-            if not href: continue
-
+        for href in year_links:
             # padrao A: pasta de Trimestre (ex: "1T/", "2T")
             match_folder = re.match(r'^([1-4])T/?$', href, re.IGNORECASE)
             
@@ -97,71 +168,167 @@ def find_latest_quarters(base_url, limit=3):
 
     return quarters_found
 
-def download_item(item):
-    
-    # case 1: é um arquivo ZIP direto (praticamente se refere a nova estrutura da ANS)
-    if item['type'] == 'file':
-        file_url = item['url']
-        filename = item['filename'] or f"{item['ano']}_{item['trimestre']}.zip"
-        # organiza o nome/normaliza
-        save_name = f"{item['ano']}_{item['trimestre']}.zip"
-        save_path = OUTPUT_DIR / save_name
-        
-        if save_path.exists():
-            print(f"[SKIP] Já existe: {save_name}")
-            return
-
-        print(f"[BAIXANDO] {save_name} (Direto)...")
-        try:
-            r = requests.get(file_url, stream=True, timeout=TIMEOUT)
-            with open(save_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"[SUCESSO] Download concluído")
-        except Exception as e:
-            print(f"[ERRO] {e}")
-
-    # case 2: é uma pasta (praticamente se refere a estrutura antiga da ANS)
-    elif item['type'] == 'folder':
-        soup = get_soup(item['url'])
-        if not soup: return
-        
-        # aqui baixa o primeiro zip que encontrar dentro da pasta
-        for link in soup.find_all('a'):
-            href = link.get('href')
-            if href and href.lower().endswith('.zip'):
-                file_url = urljoin(item['url'], href)
-                save_name = f"{item['ano']}_{item['trimestre']}.zip"
-                save_path = OUTPUT_DIR / save_name
-                
-                if save_path.exists():
-                    print(f"[SKIP] Já existe: {save_name}")
-                    continue
-
-                print(f"[BAIXANDO] {save_name} (Da pasta)...")
-                r = requests.get(file_url, stream=True)
-                with open(save_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
+def is_complete(path):
+    """um arquivo só conta como baixado se for um zip íntegro (tabela central legível)"""
+    return path.exists() and zipfile.is_zipfile(path)
+
+def expected_size(response, offset):
+    """
+    tamanho final esperado do arquivo a partir dos headers
+    - 206: Content-Range traz o total ("bytes 100-199/200")
+    - 200: Content-Length é o arquivo inteiro
+    """
+    content_range = response.headers.get('Content-Range')
+    if response.status_code == 206 and content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit():
+        return int(length) + (offset if response.status_code == 206 else 0)
+    return None
+
+@metrics.instrument()
+def download_file(file_url, save_path, session=None):
+    """
+    baixa file_url para save_path de forma atômica e retomável:
+    - escreve em '<arquivo>.part' e só renomeia (os.replace) depois de validar
+    - se já existir um .part de uma execução interrompida, pede só o restante via HTTP Range
+    - valida o tamanho contra Content-Length/Content-Range e a integridade do zip
+    retorna True se o arquivo final está pronto
+    """
+    http = session or requests
+    tmp_path = save_path.with_name(save_path.name + PART_SUFFIX)
+    offset = tmp_path.stat().st_size if tmp_path.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+    try:
+        with http.get(file_url, stream=True, timeout=TIMEOUT, headers=headers) as r:
+            if r.status_code == 416:
+                # o .part já tem tudo (ou está corrompido), a validação abaixo decide
+                total = None
+            else:
+                r.raise_for_status()
+                if offset and r.status_code != 206:
+                    # servidor ignorou o Range, recomeça do zero
+                    print(f"[INFO] Servidor sem suporte a Range, reiniciando {save_path.name}")
+                    offset = 0
+                elif offset:
+                    print(f"[RETOMANDO] {save_path.name} a partir de {offset} bytes")
+
+                total = expected_size(r, offset)
+                mode = 'ab' if offset else 'wb'
+                with open(tmp_path, mode) as f:
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
                         f.write(chunk)
-                print(f"[SUCESSO]")
-                return # baixa apenas um por trimestre
+    except requests.exceptions.RequestException as e:
+        # mantém o .part para a próxima execução retomar de onde parou
+        print(f"[ERRO] Falha ao baixar {save_path.name}: {e}")
+        return False
+
+    size = tmp_path.stat().st_size if tmp_path.exists() else 0
+    if total is not None and size != total:
+        print(f"[ERRO] Tamanho divergente em {save_path.name}: {size} de {total} bytes")
+        if size > total:
+            tmp_path.unlink()
+        return False
+
+    if not zipfile.is_zipfile(tmp_path):
+        print(f"[ERRO] {save_path.name} não é um zip válido, descartando download")
+        tmp_path.unlink()
+        return False
+
+    os.replace(tmp_path, save_path)
+    return True
+
+def resolve_zip_url(item, session=None, manifest=None):
+    """
+    descobre a URL do zip de um trimestre
+    case 1: é um arquivo ZIP direto (praticamente se refere a nova estrutura da ANS)
+    case 2: é uma pasta (praticamente se refere a estrutura antiga da ANS), usa o primeiro zip dela
+    """
+    if item['type'] == 'file':
+        return item['url']
+
+    if item['type'] == 'folder':
+        links = get_links(item['url'], session, manifest)
+        if not links: return None
+
+        for href in links:
+            if href.lower().endswith('.zip'):
+                return urljoin(item['url'], href)
+    return None
+
+def download_item(item, session=None, manifest=None):
+    # organiza o nome/normaliza
+    save_name = f"{item['ano']}_{item['trimestre']}.zip"
+    save_path = OUTPUT_DIR / save_name
+
+    if is_complete(save_path):
+        print(f"[SKIP] Já existe: {save_name}")
+        return True
+
+    file_url = resolve_zip_url(item, session, manifest)
+    if not file_url:
+        print(f"[ERRO] Nenhum zip encontrado para {item['ano']}/{item['trimestre']}")
+        return False
+
+    origem = "Direto" if item['type'] == 'file' else "Da pasta"
+    print(f"[BAIXANDO] {save_name} ({origem})...")
+    if download_file(file_url, save_path, session):
+        print(f"[SUCESSO] Download concluído: {save_name}")
+        return True
+    return False
+
+@metrics.instrument()
+def download_all(targets, workers=DOWNLOAD_WORKERS, session=None, manifest=None):
+    """
+    baixa os trimestres em paralelo com um pool limitado de threads
+    (download é I/O bound, então threads bastam) compartilhando uma única sessão
+    """
+    workers = max(1, min(workers, len(targets)))
+    own_session = session is None
+    session = session or get_session(workers)
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download_item, t, session, manifest): t for t in targets}
+        for future in as_completed(futures):
+            t = futures[future]
+            try:
+                results[(t['ano'], t['trimestre'])] = future.result()
+            except Exception as e:
+                print(f"[ERRO] {t['ano']}/{t['trimestre']}: {e}")
+                results[(t['ano'], t['trimestre'])] = False
+
+    if own_session:
+        session.close()
+    return results
 
 def main():
     print("=== Crawler ANS v2.0 (Resiliente) ===")
     setup_dirs()
+    session = get_session()
+    manifest = load_manifest()
     
-    targets = find_latest_quarters(BASE_URL, limit=3)
+    targets = find_latest_quarters(BASE_URL, limit=QUARTERS_LIMIT, session=session, manifest=manifest)
     
     if not targets:
         print("[ERRO] Nada encontrado. A estrutura do site mudou drasticamente(?)")
+        session.close()
         return
 
-    print(f"[INFO] Alvos: {[f'{t['ano']}/{t['trimestre']} ({t['type']})' for t in targets]}")
+    alvos = [f"{t['ano']}/{t['trimestre']} ({t['type']})" for t in targets]
+    print(f"[INFO] Alvos: {alvos}")
     
-    for target in targets:
-        download_item(target)
+    results = download_all(targets, session=session, manifest=manifest)
+    save_manifest(manifest)
+    session.close()
+    falhas = [f"{ano}/{tri}" for (ano, tri), ok in results.items() if not ok]
+    if falhas:
+        print(f"[WARN] Downloads incompletos (serão retomados na próxima execução): {falhas}")
         
     print(f"\nVerifique os arquivos em: {OUTPUT_DIR.absolute()}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    metrics.run_stage("1_downloader", main)
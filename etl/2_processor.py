@@ -1,88 +1,248 @@
 import pandas as pd
+import numpy as np
 import zipfile
 import os
-import requests
-import io
+import re
+import csv
+import codecs
+import shutil
+import tempfile
 from pathlib import Path
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import storage
+import schema
+import state
+import metrics
+import cadastro
+from cadastro import normalize_reg_ans
 
 #configs
 RAW_DIR = Path("data/raw")
-PROCESSED_DIR = Path("data/processed")
-OUTPUT_FILE = PROCESSED_DIR / "consolidado_despesas.csv"
-CADASTRO_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude_ativas/Relatorio_cadop.csv"
+PROCESSED_DIR = storage.PROCESSED_DIR
+OUTPUT_FILE = storage.CONSOLIDADO_CSV
+OUTPUT_DATASET = storage.CONSOLIDADO_DATASET
+# 'parquet' (dataset particionado por Ano/Trimestre) ou 'csv', ver etl/storage.py
+OUTPUT_FORMAT = storage.DATA_FORMAT
+# snapshot local versionado do cadastro, ver etl/cadastro.py
+CADASTRO_URL = cadastro.CADASTRO_URL
 
 COLUMN_MAP = {
     "VALOR": ["VL_SALDO_FINAL", "VALOR", "Valor", "DESPESA"],
     "CONTA": ["CD_CONTA_CONTABIL", "CD_CONTA", "Conta"],
     "REG_ANS": ["REG_ANS", "RegistroANS"]
 }
+# colunas do arquivo que o COLUMN_MAP usa: só essas são parseadas
+MAPPED_SOURCE_COLUMNS = {c for candidates in COLUMN_MAP.values() for c in candidates}
 ACCOUNT_FILTER_START = '4' 
+CADOP_FIELDS = cadastro.CADOP_FIELDS
+OUTPUT_COLUMNS = storage.CONSOLIDADO_COLUMNS
+
+# modo de processamento: 'stream' (memória limitada, padrão) ou 'batch' (tudo em memória)
+PROCESSING_MODE = os.getenv("ANS_PROCESSOR_MODE", "stream")
+# tamanho do bloco: linhas fixas (ANS_CHUNK_ROWS) ou derivado do orçamento de memória
+CHUNK_ROWS = int(os.getenv("ANS_CHUNK_ROWS", "0"))
+MEMORY_BUDGET_MB = int(os.getenv("ANS_MEMORY_BUDGET_MB", "256"))
+BYTES_PER_ROW_ESTIMATE = 1024 # linha com dtype=str + enriquecimento, estimativa conservadora
+# processos para o modo paralelo (1 = serial); cada trimestre vai para um processo
+WORKERS = int(os.getenv("ANS_PROCESSOR_WORKERS", "1"))
+
+# detecção do dialeto dos csv: amostra limitada, decidida uma vez por layout/ano
+SNIFF_BYTES = int(os.getenv("ANS_SNIFF_BYTES", str(1024 * 1024)))
+HEADER_BYTES = 64 * 1024
+SNIFF_LINES = 200
+SEPARATORS = [';', ',', '\t', '|']
+BR_DECIMAL = re.compile(r"^-?\d{1,3}(\.\d{3})*,\d+$|^-?\d+,\d+$")
+DOT_DECIMAL = re.compile(r"^-?\d+\.\d{1,2}$") # '.' com 1-2 casas não é separador de milhar
+CSV_ENGINE = 'pyarrow' if storage.HAS_PYARROW else 'c'
+# número já com '.' decimal e sem milhar (depois da troca dos separadores)
+NUMBER_PATTERN = r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$"
+Dialect = namedtuple('Dialect', 'encoding sep decimal columns')
+_dialect_cache = {}
+
+# lookup do cadastro dentro de cada processo do pool (ver _init_worker)
+_worker_cadop_map = None
 
 def setup_dirs():
     if not PROCESSED_DIR.exists():
         os.makedirs(PROCESSED_DIR)
 
+@metrics.instrument()
 def get_cadop_map():
-    print("[CADASTRO] Baixando dados cadastrais para lookup...")
+    """lookup do cadastro indexado por REG_ANS, lido do snapshot local (GET condicional só se estiver velho)"""
+    print("[CADASTRO] Verificando snapshot local do cadastro...")
+    versao = cadastro.refresh(CADASTRO_URL)
+    lookup = cadastro.load_lookup(versao)
+    if lookup.empty:
+        print("[ERRO] Cadastro indisponível: as linhas vão sair sem CNPJ e serão descartadas na limpeza.")
+    else:
+        print(f"[CADASTRO] Mapa criado: {len(lookup)} operadoras com UF/Modalidade (snapshot {versao}).")
+    return lookup
+
+def cadop_for_quarter(cadop_map, ano, trimestre):
+    """com ANS_CADASTRO_HISTORICO=1 cada trimestre usa o snapshot vigente no fim dele"""
+    if not cadastro.HISTORICAL:
+        return cadop_map
+    lookup = cadastro.lookup_for_period(ano, trimestre)
+    return cadop_map if lookup.empty else lookup
+
+def enrich_with_cadastro(df, cadop_map):
+    """
+    adiciona CNPJ/RazaoSocial/UF/Modalidade em todas as linhas de uma vez:
+    uma única busca das posições no lookup pela chave normalizada (join vetorizado, sem apply por linha)
+    REG_ANS fora do cadastro fica com NaN, e o clean_data do agregador descarta depois
+    """
+    pos = cadop_map.index.get_indexer(normalize_reg_ans(df['REG_ANS'])) # -1 = fora do cadastro
+    for col in CADOP_FIELDS:
+        # categórica com o dicionário do próprio cadastro: cada linha guarda só o código
+        # (e os blocos de todos os trimestres compartilham o mesmo dicionário)
+        # o -1 no fim faz a posição -1 (fora do cadastro) cair no código de NaN
+        codes, values = pd.factorize(cadop_map[col])
+        df[col] = pd.Categorical.from_codes(np.append(codes, -1)[pos], categories=values)
+    return df
+
+def sniff_encoding(sample):
+    """
+    utf-8 só se a amostra tiver acentos e eles forem utf-8 válido; amostra só ASCII fica
+    latin-1 (o padrão dos arquivos da ANS, que decodifica qualquer byte, então o arquivo
+    inteiro nunca falha no meio da leitura)
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.isascii():
+        return 'latin-1'
     try:
-        r = requests.get(CADASTRO_URL, timeout=30)
-        r.raise_for_status()
-        
-        try:
-            df_cadop = pd.read_csv(io.BytesIO(r.content), sep=';', encoding='utf-8', dtype=str)
-            print("[CADASTRO] Detectado UTF-8.")
-        except:
-            print("[CADASTRO] Fallback para Latin-1.")
-            df_cadop = pd.read_csv(io.BytesIO(r.content), sep=';', encoding='latin-1', dtype=str)
-            
-        df_cadop.columns = [c.upper().replace('_', '') for c in df_cadop.columns]
-        
-        # udentificacao dinâmica das colunas
-        reg_col = next((c for c in df_cadop.columns if 'REGISTRO' in c), None)
-        cnpj_col = next((c for c in df_cadop.columns if 'CNPJ' in c), None)
-        razao_col = next((c for c in df_cadop.columns if 'RAZAO' in c), None)
-        uf_col = next((c for c in df_cadop.columns if 'UF' in c), None)
-        mod_col = next((c for c in df_cadop.columns if 'MODALIDADE' in c), None)
-
-        if not (reg_col and cnpj_col and razao_col):
-            print(f"[ERRO] Colunas chave não encontradas. Disp: {df_cadop.columns}")
-            return {}
-
-        lookup = {}
-        for _, row in df_cadop.iterrows():
-            reg = str(row[reg_col]).strip()
-            lookup[reg] = {
-                'CNPJ': row[cnpj_col],
-                'RazaoSocial': row[razao_col],
-                'UF': row[uf_col] if uf_col else 'ND',
-                'Modalidade': row[mod_col] if mod_col else 'ND'
-            }
-        
-        print(f"[CADASTRO] Mapa criado: {len(lookup)} operadoras com UF/Modalidade.")
-        return lookup
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # só aceita se o erro for a amostra ter cortado um caractere multibyte no final
+        if e.reason != 'unexpected end of data':
+            return 'latin-1'
+    return 'utf-8'
+
+def sniff_separator(lines):
+    """o separador que dá o mesmo número (>1) de campos em todas as linhas da amostra"""
+    counts = {}
+    for sep in SEPARATORS:
+        fields = [len(row) for row in csv.reader(lines, delimiter=sep) if row]
+        if fields and fields[0] > 1 and len(set(fields)) == 1:
+            counts[sep] = fields[0]
+    if counts:
+        return max(counts, key=counts.get)
+    # amostra irregular: volta pra regra antiga (o mais frequente no cabeçalho)
+    return max(SEPARATORS, key=lambda sep: lines[0].count(sep))
+
+def decimal_evidence(lines, sep, columns):
+    """
+    formato decimal que a amostra comprova: ',' se algum VALOR é inequivocamente brasileiro (1.234,56),
+    '.' se só aparecem valores com ponto decimal (10.5, 1234.56); None se é ambígua (só inteiros, '1.234')
+    """
+    value_col = next((c for c in COLUMN_MAP['VALOR'] if c in columns), None)
+    if value_col is None:
+        return None
+    pos = columns.index(value_col)
+    values = [row[pos] for row in csv.reader(lines[1:], delimiter=sep) if len(row) > pos and row[pos]]
+    if any(BR_DECIMAL.match(v) for v in values):
+        return ','
+    return '.' if any(DOT_DECIMAL.match(v) for v in values) else None
 
-    except Exception as e:
-        print(f"[ERRO] Falha no cadastro: {e}")
-        return {}
+def sniff_decimal(lines, sep, columns):
+    """formato decimal da coluna de VALOR; amostra ambígua fica no padrão da ANS (',')"""
+    return decimal_evidence(lines, sep, columns) or ','
 
-def load_csv_robust(file_stream):
-    sample = file_stream.read(4096)
+def sample_lines(sample, encoding):
+    text_sample = sample.decode(encoding, errors='ignore')
+    lines = text_sample.splitlines()
+    if len(lines) > 1 and not text_sample.endswith(('\n', '\r')):
+        lines = lines[:-1] # última linha cortada pela amostra
+    return lines[:SNIFF_LINES]
+
+def detect_dialect(sample):
+    """
+    encoding, separador, formato decimal e colunas do arquivo, decididos só pela amostra
+    (SNIFF_BYTES no máximo), então o membro do zip é lido uma única vez depois
+    """
+    encoding = sniff_encoding(sample)
+    lines = sample_lines(sample, encoding)
+    sep = sniff_separator(lines)
+    columns = next(csv.reader(lines[:1], delimiter=sep), [])
+    return Dialect(encoding, sep, sniff_decimal(lines, sep, columns), tuple(columns))
+
+def sniff_member(file_stream, ano=None):
+    """
+    dialeto do membro. separador/colunas vêm do cache por (ano, cabeçalho): arquivos do mesmo
+    layout/ano só leem o começo (HEADER_BYTES) em vez da amostra inteira. encoding e formato
+    decimal variam entre arquivos do mesmo layout, então são conferidos no começo de cada membro
+    (o do cache só vale quando esse começo não decide: só ASCII ou só inteiros)
+    """
+    head = file_stream.read(HEADER_BYTES)
+    key = (ano, head.split(b'\n', 1)[0])
+    cached = _dialect_cache.get(key)
+    if cached is None:
+        sample = head + file_stream.read(max(0, SNIFF_BYTES - len(head)))
+        dialect = _dialect_cache[key] = detect_dialect(sample)
+    else:
+        encoding = sniff_encoding(head) if not head.isascii() else cached.encoding
+        lines = sample_lines(head, encoding)
+        decimal = decimal_evidence(lines, cached.sep, list(cached.columns)) or cached.decimal
+        dialect = cached._replace(encoding=encoding, decimal=decimal)
     file_stream.seek(0)
-    encodings = ['latin-1', 'utf-8', 'cp1252']
-    separators = [';', ',', '\t']
-    
-    for enc in encodings:
-        try:
-            text_sample = sample.decode(enc)
-            first_line = text_sample.split('\n')[0]
-            sep = max(separators, key=lambda s: first_line.count(s))
-            df = pd.read_csv(file_stream, sep=sep, encoding=enc, dtype=str)
-            return df
-        except Exception:
-            file_stream.seek(0)
-            continue
-    return None
+    return dialect
+
+def mapped_columns(dialect):
+    """só as colunas que o COLUMN_MAP usa (DATA, DESCRICAO, saldo inicial... nem são parseadas)"""
+    return [c for c in dialect.columns if c in MAPPED_SOURCE_COLUMNS]
+
+def read_csv_arrow(file_stream, dialect, usecols):
+    """
+    pyarrow.csv direto: as colunas já saem como texto (o engine='pyarrow' do pandas infere os
+    tipos e depois converte tudo pra str de novo, ~3x mais lento)
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    table = pacsv.read_csv(
+        file_stream,
+        read_options=pacsv.ReadOptions(encoding=dialect.encoding),
+        parse_options=pacsv.ParseOptions(delimiter=dialect.sep),
+        # campo vazio vira NaN, como no read_csv do pandas
+        convert_options=pacsv.ConvertOptions(include_columns=usecols, strings_can_be_null=True,
+                                             column_types={c: pa.string() for c in usecols}),
+    )
+    return table.to_pandas()
+
+@metrics.instrument()
+def load_csv_robust(file_stream, ano=None, dialect=None):
+    """
+    lê o membro inteiro numa passada só, com o dialeto da amostra e só as colunas mapeadas
+    (motor do pyarrow quando instalado); erro de parse é reportado, não engolido
+    """
+    dialect = dialect or sniff_member(file_stream, ano)
+    usecols = mapped_columns(dialect)
+    if not usecols:
+        print(f"   [SKIP] Nenhuma coluna conhecida no cabeçalho: {list(dialect.columns)[:6]}")
+        return None
+    try:
+        if CSV_ENGINE == 'pyarrow':
+            return read_csv_arrow(file_stream, dialect, usecols)
+        return pd.read_csv(file_stream, sep=dialect.sep, encoding=dialect.encoding, dtype=str, usecols=usecols)
+    except (pd.errors.ParserError, UnicodeDecodeError, ValueError) as e: # ArrowInvalid é ValueError
+        print(f"   [ERRO] Falha ao ler o csv ({dialect.encoding}, sep={dialect.sep!r}): {e}")
+        return None
+
+def iter_csv_chunks(file_stream, chunksize, ano=None, dialect=None):
+    """
+    versão em streaming do load_csv_robust: devolve um iterador de DataFrames com até
+    'chunksize' linhas, então o membro do zip nunca fica inteiro em memória
+    (motor C, o único com chunksize; mesmo dialeto e mesmas colunas do load_csv_robust)
+    """
+    dialect = dialect or sniff_member(file_stream, ano)
+    usecols = mapped_columns(dialect)
+    if not usecols:
+        return iter(())
+    return pd.read_csv(file_stream, sep=dialect.sep, encoding=dialect.encoding, dtype=str,
+                       usecols=usecols, chunksize=chunksize)
 
+@metrics.instrument()
 def normalize_columns(df):
     found_map = {}
     for target, candidates in COLUMN_MAP.items():
@@ -92,74 +252,389 @@ def normalize_columns(df):
                 break
     return df.rename(columns=found_map)
 
-def process_quarter_zip(zip_path, cadop_map):
-    print(f"\n[PROCESSANDO] {zip_path.name}...")
+def parse_quarter_name(zip_path):
     try:
         parts = zip_path.stem.split('_')
         ano = parts[0]
         trimestre = parts[1]
     except:
         ano, trimestre = "0000", "0T"
+    return ano, trimestre
+
+def iter_data_members(z):
+    """membros do zip que são dados (ignora o 'leia-me')"""
+    for filename in z.namelist():
+        if (filename.lower().endswith('.csv') or filename.endswith('.txt')) and 'leia' not in filename.lower():
+            yield filename
+
+@metrics.instrument()
+def transform_frame(df, cadop_map, ano, trimestre, decimal=',', invalid=None):
+    """
+    normaliza, filtra despesas (conta 4*), converte o VALOR, enriquece e padroniza as colunas
+    de um bloco de dados. retorna None quando o bloco não tem nada aproveitável
+    invalid: acumulador dos VALOR que não são número (ver new_invalid_report)
+    """
+    df = normalize_columns(df)
+    if 'VALOR' not in df.columns: return None
+    if 'CONTA' in df.columns:
+        df = df[df["CONTA"].str.startswith(ACCOUNT_FILTER_START, na=False)]
+    if df.empty: return None
+
+    # convertido aqui, bloco a bloco e só nas linhas de despesa: a coluna de texto some logo
+    raw = df['VALOR']
+    valor = parse_valor(raw, decimal)
+    if invalid is not None:
+        count_invalid(raw, valor, invalid)
+    df = df.assign(VALOR=valor)
+
+    if 'REG_ANS' in df.columns:
+        # os 4 campos
+        df = enrich_with_cadastro(df, cadop_map)
+    
+    df['Trimestre'] = trimestre
+    df['Ano'] = ano
+    
+    for c in OUTPUT_COLUMNS:
+        if c not in df.columns: df[c] = None
+        
+    # já sai com os tipos compactos do etl/schema.py (os mesmos que as etapas 3 e 4 leem)
+    return schema.compact(df[OUTPUT_COLUMNS])
+
+@metrics.instrument()
+def parse_valor(series, decimal=','):
+    """
+    converte o VALOR para número; decimal=',' é o formato brasileiro ('1.234,56'), com '.' de milhar
+    o que não for número vira NaN (quem chama conta com count_invalid)
+    """
+    thousands = '.' if decimal == ',' else ','
+    if not storage.HAS_PYARROW:
+        series = series.astype(str).str.replace(thousands, '', regex=False).str.replace(decimal, '.', regex=False)
+        return pd.to_numeric(series, errors='coerce')
+
+    # pyarrow.compute: troca de separadores + validação + cast, sem passar por objetos python
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    arr = pa.array(series, type=pa.string(), from_pandas=True)
+    arr = pc.utf8_trim_whitespace(pc.replace_substring(arr, thousands, ''))
+    if decimal != '.':
+        arr = pc.replace_substring(arr, decimal, '.')
+    valid = pc.match_substring_regex(arr, NUMBER_PATTERN)
+    values = pc.cast(pc.if_else(valid, arr, pa.scalar(None, pa.string())), pa.float64())
+    return pd.Series(values.to_numpy(zero_copy_only=False), index=series.index, name=series.name)
+
+def new_invalid_report():
+    return {'qtd': 0, 'exemplos': []}
+
+def count_invalid(raw, valor, invalid, max_examples=5):
+    """acumula os VALOR preenchidos que não viraram número (vazio não conta, é só ausente)"""
+    bad = valor.isna() & raw.notna() & (raw.str.len() > 0)
+    n = int(bad.sum())
+    if n:
+        invalid['qtd'] += n
+        faltam = max_examples - len(invalid['exemplos'])
+        if faltam > 0:
+            invalid['exemplos'] += raw[bad].head(faltam).tolist()
+
+def report_invalid(name, invalid):
+    if invalid['qtd']:
+        print(f"   [WARN] {name}: {invalid['qtd']} valores de VALOR não numéricos ficaram vazios "
+              f"(descartados na limpeza). Ex: {invalid['exemplos']}")
+
+@metrics.instrument()
+def process_quarter_zip(zip_path, cadop_map):
+    print(f"\n[PROCESSANDO] {zip_path.name}...")
+    ano, trimestre = parse_quarter_name(zip_path)
+    cadop_map = cadop_for_quarter(cadop_map, ano, trimestre)
 
     processed_data = []
+    invalid = new_invalid_report()
 
     with zipfile.ZipFile(zip_path, 'r') as z:
-        for filename in z.namelist():
-            if (filename.lower().endswith('.csv') or filename.endswith('.txt')) and 'leia' not in filename.lower():
-                with z.open(filename) as f:
-                    df = load_csv_robust(f)
-                    if df is None: continue
-                    
-                    df = normalize_columns(df)
-                    if 'VALOR' not in df.columns: continue
-                    if 'CONTA' in df.columns:
-                        df = df[df["CONTA"].str.startswith(ACCOUNT_FILTER_START, na=False)]
-                    if df.empty: continue
-
-                    if 'REG_ANS' in df.columns:
-                        # os 4 campos
-                        def get_meta(reg):
-                            d = cadop_map.get(str(reg), {})
-                            return pd.Series([d.get('CNPJ'), d.get('RazaoSocial'), d.get('UF'), d.get('Modalidade')])
-                        
-                        df[['CNPJ', 'RazaoSocial', 'UF', 'Modalidade']] = df['REG_ANS'].apply(get_meta)
-                    
-                    df['Trimestre'] = trimestre
-                    df['Ano'] = ano
-                    
-                    cols = ['REG_ANS', 'CNPJ', 'RazaoSocial', 'UF', 'Modalidade', 'Trimestre', 'Ano', 'VALOR', 'CONTA']
-                    for c in cols:
-                        if c not in df.columns: df[c] = None
-                        
-                    processed_data.append(df[cols])
+        for filename in iter_data_members(z):
+            with z.open(filename) as f:
+                dialect = sniff_member(f, ano)
+                df = load_csv_robust(f, ano, dialect)
+                if df is None: continue
+                
+                df = transform_frame(df, cadop_map, ano, trimestre, dialect.decimal, invalid)
+                if df is not None:
+                    processed_data.append(df)
 
+    report_invalid(zip_path.name, invalid)
     if not processed_data: return None
-    return pd.concat(processed_data, ignore_index=True)
+    return schema.concat(processed_data)
 
-def main():
-    setup_dirs()
-    cadop_map = get_cadop_map()
-    all_zips = list(RAW_DIR.glob('*.zip'))
-    dfs = []
+@metrics.instrument()
+def iter_quarter_chunks(zip_path, cadop_map, chunksize):
+    """
+    mesmo resultado do process_quarter_zip, só que bloco a bloco:
+    cada chunk já sai filtrado, enriquecido e com o VALOR convertido
+    """
+    print(f"\n[PROCESSANDO] {zip_path.name} (streaming, {chunksize} linhas/bloco)...")
+    ano, trimestre = parse_quarter_name(zip_path)
+    cadop_map = cadop_for_quarter(cadop_map, ano, trimestre)
+
+    invalid = new_invalid_report()
+
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        for filename in iter_data_members(z):
+            with z.open(filename) as f:
+                dialect = sniff_member(f, ano)
+                for chunk in iter_csv_chunks(f, chunksize, ano, dialect):
+                    chunk = transform_frame(chunk, cadop_map, ano, trimestre, dialect.decimal, invalid)
+                    if chunk is None: continue
+                    yield chunk
+    report_invalid(zip_path.name, invalid)
+
+def resolve_chunk_rows():
+    """ANS_CHUNK_ROWS tem prioridade; senão deriva as linhas por bloco do orçamento de memória"""
+    if CHUNK_ROWS:
+        return CHUNK_ROWS
+    return max(1000, MEMORY_BUDGET_MB * 1024 * 1024 // BYTES_PER_ROW_ESTIMATE)
+
+def _keep_sample(chunks, holder):
+    # guarda as primeiras linhas pra amostra final sem segurar o resto dos dados
+    for chunk in chunks:
+        if not holder:
+            holder.append(chunk.head())
+        yield chunk
+
+def new_staging_dataset():
+    return Path(tempfile.mkdtemp(prefix='dataset_', dir=PROCESSED_DIR))
+
+def publish_dataset(staging, all_zips, incremental):
+    """
+    completo: o staging vira o dataset inteiro (partições de zips removidos somem junto)
+    incremental: só as partições dos zips processados agora são trocadas
+    """
+    if not incremental:
+        storage.swap_dataset(staging, OUTPUT_DATASET)
+        return
+    replaced = [(*parse_quarter_name(z), z.stem) for z in all_zips]
+    storage.merge_dataset(staging, OUTPUT_DATASET, replaced)
+
+@metrics.instrument()
+def run_batch(all_zips, cadop_map):
+    """modo original: tudo em memória e um único concat no final"""
+    dfs, done = [], []
     
     for zip_file in all_zips:
         df_quarter = process_quarter_zip(zip_file, cadop_map)
         if df_quarter is not None:
             dfs.append(df_quarter)
+            done.append(zip_file)
     
-    if dfs:
-        print("\n[CONSOLIDANDO] Unindo trimestres...")
-        final_df = pd.concat(dfs, ignore_index=True)
-        
-        final_df['VALOR'] = final_df['VALOR'].astype(str).str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
-        final_df['VALOR'] = pd.to_numeric(final_df['VALOR'], errors='coerce')
-        
+    if not dfs:
+        return None
+
+    print("\n[CONSOLIDANDO] Unindo trimestres...")
+    final_df = schema.concat(dfs)
+    
+    if OUTPUT_FORMAT == 'parquet':
+        staging = new_staging_dataset()
+        try:
+            # um arquivo por zip, com o mesmo nome dos outros modos (o ledger e o incremental contam com isso)
+            for zip_file, df_quarter in zip(done, dfs):
+                ano, trimestre = parse_quarter_name(zip_file)
+                storage.write_partition([df_quarter], staging, ano, trimestre, part_name=zip_file.stem)
+            storage.swap_dataset(staging, OUTPUT_DATASET)
+        finally:
+            # mesma limpeza do run_streaming: gravação que falha não deixa dataset_* perdido
+            shutil.rmtree(staging, ignore_errors=True)
+    else:
         final_df.to_csv(OUTPUT_FILE, index=False, encoding='utf-8')
-        print(f"Arquivo salvo: {OUTPUT_FILE}")
+    return final_df.head()
+
+@metrics.instrument()
+def run_streaming(all_zips, cadop_map, chunksize, incremental=False):
+    """
+    modo streaming: cada bloco é anexado direto na saída, então a memória
+    fica limitada ao tamanho do bloco, independente de quantos trimestres existam
+    escreve num temporário e renomeia no final (um crash nao deixa consolidado pela metade)
+    - csv: um único arquivo, blocos anexados em sequência
+    - parquet: uma partição Ano/Trimestre por zip, cada bloco vira um row group
+    """
+    sample = []
+    rows = 0
+
+    if OUTPUT_FORMAT == 'parquet':
+        staging = new_staging_dataset()
+        try:
+            for zip_file in all_zips:
+                ano, trimestre = parse_quarter_name(zip_file)
+                chunks = _keep_sample(iter_quarter_chunks(zip_file, cadop_map, chunksize), sample)
+                rows += storage.write_partition(chunks, staging, ano, trimestre, part_name=zip_file.stem)
+            if rows == 0 and not incremental:
+                return None
+            publish_dataset(staging, all_zips, incremental)
+        finally:
+            # falha no meio (zip corrompido, disco cheio...) não deixa dataset_* perdido em data/processed
+            shutil.rmtree(staging, ignore_errors=True)
+        print(f"\n[CONSOLIDANDO] {rows} linhas gravadas em streaming.")
+        return sample[0] if sample else None
+
+    tmp_file = OUTPUT_FILE.with_name(OUTPUT_FILE.name + '.tmp')
+    try:
+        with open(tmp_file, 'w', encoding='utf-8', newline='') as out:
+            write_header(out)
+            for zip_file in all_zips:
+                for chunk in _keep_sample(iter_quarter_chunks(zip_file, cadop_map, chunksize), sample):
+                    chunk.to_csv(out, index=False, header=False)
+                    rows += len(chunk)
+        if rows == 0:
+            return None
+        os.replace(tmp_file, OUTPUT_FILE)
+    finally:
+        # sem saída ou falha no meio: o .tmp não fica largado (depois do replace ele já não existe)
+        tmp_file.unlink(missing_ok=True)
+    print(f"\n[CONSOLIDANDO] {rows} linhas gravadas em streaming.")
+    return sample[0]
+
+def write_header(out):
+    pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(out, index=False)
+
+def _init_worker(cadop_map):
+    # o cadastro é enviado uma vez por processo (initializer), e não a cada trimestre
+    global _worker_cadop_map
+    _worker_cadop_map = cadop_map
+
+def _process_zip_to_part(zip_path, target, chunksize, fmt):
+    """
+    roda no processo filho
+    - csv: grava o trimestre inteiro num arquivo parcial sem header (target = arquivo)
+    - parquet: grava a partição do trimestre direto no dataset de staging (target = diretório)
+    """
+    chunks = iter_quarter_chunks(zip_path, _worker_cadop_map, chunksize)
+    if fmt == 'parquet':
+        ano, trimestre = parse_quarter_name(zip_path)
+        return storage.write_partition(chunks, target, ano, trimestre, part_name=zip_path.stem)
+
+    rows = 0
+    with open(target, 'w', encoding='utf-8', newline='') as out:
+        for chunk in chunks:
+            chunk.to_csv(out, index=False, header=False)
+            rows += len(chunk)
+    return rows
+
+@metrics.instrument()
+def run_parallel(all_zips, cadop_map, chunksize, workers, incremental=False):
+    """
+    modo paralelo: um processo por trimestre, cada um escrevendo sua própria saída
+    no csv as partes são concatenadas na ordem dos zips, então o resultado é idêntico ao modo serial;
+    no parquet cada processo já escreve sua partição, e o dataset inteiro é trocado no final
+    """
+    staging = new_staging_dataset()
+    if OUTPUT_FORMAT == 'parquet':
+        targets = [staging] * len(all_zips)
+    else:
+        targets = [staging / f"{i:05d}.csv" for i in range(len(all_zips))]
+    tmp_file = OUTPUT_FILE.with_name(OUTPUT_FILE.name + '.tmp')
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cadop_map,)) as pool:
+            counts = list(pool.map(
+                _process_zip_to_part, all_zips, targets,
+                [chunksize] * len(all_zips), [OUTPUT_FORMAT] * len(all_zips)
+            ))
+
+        rows = sum(counts)
+        if rows == 0 and not (incremental and OUTPUT_FORMAT == 'parquet'):
+            return None
+
+        if OUTPUT_FORMAT == 'parquet':
+            publish_dataset(staging, all_zips, incremental)
+        else:
+            with open(tmp_file, 'w', encoding='utf-8', newline='') as out:
+                write_header(out)
+                for part in targets:
+                    with open(part, encoding='utf-8', newline='') as f:
+                        shutil.copyfileobj(f, out)
+            os.replace(tmp_file, OUTPUT_FILE)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        tmp_file.unlink(missing_ok=True)
+
+    print(f"\n[CONSOLIDANDO] {rows} linhas de {len(all_zips)} trimestres ({workers} processos).")
+    saida = OUTPUT_DATASET if OUTPUT_FORMAT == 'parquet' else OUTPUT_FILE
+    return storage.sample_consolidado(fmt=OUTPUT_FORMAT, path=saida)
+
+def plan_incremental(all_zips, cadop_map, ledger):
+    """
+    compara os zips de data/raw com o ledger e decide o que precisa ser (re)processado
+    retorna (zips pendentes, nomes de zips removidos, hashes atuais)
+    se o cadastro mudou ou o dataset sumiu, tudo vira pendente (o enriquecimento antigo ficou velho)
+    """
+    hashes = {z.name: state.file_sha256(z) for z in all_zips}
+    fingerprint = state.frame_fingerprint(cadop_map)
+
+    if ledger['cadastro'] != fingerprint or not OUTPUT_DATASET.exists():
+        ledger['quarters'] = {}
+    ledger['cadastro'] = fingerprint
+
+    pending = [z for z in all_zips if ledger['quarters'].get(z.name, {}).get('sha256') != hashes[z.name]]
+    removed = [name for name in ledger['quarters'] if name not in hashes]
+    return pending, removed, hashes
+
+def record_quarters(ledger, zips, hashes, removed=()):
+    for name in removed:
+        ledger['quarters'].pop(name, None)
+    for z in zips:
+        ano, trimestre = parse_quarter_name(z)
+        ledger['quarters'][z.name] = {
+            'sha256': hashes[z.name],
+            'ano': ano,
+            'trimestre': trimestre,
+            'partition': str(storage.partition_file('', ano, trimestre, z.stem))
+        }
+
+def main():
+    setup_dirs()
+    cadop_map = get_cadop_map()
+    all_zips = sorted(RAW_DIR.glob('*.zip'))
+
+    # o ledger só faz sentido no dataset particionado (no csv o arquivo é sempre reescrito inteiro)
+    # o batch reescreve o dataset inteiro, mas ainda registra os trimestres pro agregador e o loader
+    use_ledger = OUTPUT_FORMAT == 'parquet'
+    incremental = use_ledger and state.INCREMENTAL and PROCESSING_MODE != 'batch'
+    ledger = state.load_state() if use_ledger else None
+    todo, removed, hashes = all_zips, [], {}
+
+    if use_ledger:
+        pending, removed, hashes = plan_incremental(all_zips, cadop_map, ledger)
+        if incremental:
+            todo = pending
+            print(f"[INCREMENTAL] {len(pending)} de {len(all_zips)} zips novos/alterados, {len(removed)} removidos.")
+            for name in removed:
+                q = ledger['quarters'][name]
+                storage.remove_partition_file(OUTPUT_DATASET, q['ano'], q['trimestre'], Path(name).stem)
+            if not todo:
+                record_quarters(ledger, [], hashes, removed)
+                state.save_state(ledger)
+                print("Nada novo para processar.")
+                return
+        else:
+            ledger['quarters'] = {}
+    
+    if PROCESSING_MODE == 'batch':
+        sample = run_batch(todo, cadop_map)
+    elif WORKERS > 1 and len(todo) > 1:
+        sample = run_parallel(todo, cadop_map, resolve_chunk_rows(), WORKERS, incremental=incremental)
+    else:
+        sample = run_streaming(todo, cadop_map, resolve_chunk_rows(), incremental=incremental)
+
+    # None sem incremental = nada foi gravado e o dataset anterior ficou: os zips não entram no ledger
+    # (no incremental o dataset é sempre publicado, mesmo com trimestres vazios)
+    if use_ledger and (sample is not None or incremental):
+        record_quarters(ledger, todo, hashes, removed)
+        state.save_state(ledger)
+    
+    saida = OUTPUT_DATASET if OUTPUT_FORMAT == 'parquet' else OUTPUT_FILE
+    if sample is not None:
+        print(f"Arquivo salvo: {saida}")
         # aqui mostra UF e Modalidade na amostra para confirmar se tá tudo ok
-        print("Amostra:\n", final_df[['RazaoSocial', 'UF', 'VALOR']].head())
+        print("Amostra:\n", sample[['RazaoSocial', 'UF', 'VALOR']])
     else:
         print("Falha geral.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    metrics.run_stage("2_processor", main)
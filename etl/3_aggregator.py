@@ -1,41 +1,98 @@
 import pandas as pd
 import numpy as np
-from pathlib import Path
+
+import storage
+import state
+import schema
+import metrics
 
 #configss
-INPUT_FILE = Path("data/processed/consolidado_despesas.csv")
-OUTPUT_FILE = Path("data/processed/despesas_agregadas.csv")
+INPUT_FILE = storage.consolidado_path()
+OUTPUT_FILE = storage.agregado_path()
+# só o que a agregação usa; no parquet as demais colunas nem saem do disco
+INPUT_COLUMNS = ['REG_ANS', 'CNPJ', 'RazaoSocial', 'UF', 'Ano', 'Trimestre', 'VALOR', 'CONTA']
+MOMENT_KEYS = ['RazaoSocial', 'UF']
+# o estado incremental guarda texto puro (categóricas de arquivos diferentes não alinham no merge)
+TOTALS_TEXT = {'RazaoSocial': str, 'UF': str, 'Trimestre': str}
+
+def totals_as_text(totals):
+    """
+    totais no formato do estado incremental; linha sem RazaoSocial/UF sai antes do cast
+    (o astype(str) viraria o texto 'nan'), igual ao groupby do caminho completo, que descarta chave vazia
+    """
+    return totals.dropna(subset=MOMENT_KEYS).astype(TOTALS_TEXT)
 
 def setup_dirs():
     #garante que exista o diretorio de saida/OUTPUT
     OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
 
+def group_ids(df, keys):
+    """
+    id inteiro por combinação das colunas (não precisa ser denso, só único): combina os
+    códigos do factorize de cada coluna, bem mais barato que groupby().ngroup() sem sort
+    """
+    ids = np.zeros(len(df), dtype=np.int64)
+    for col in keys:
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=True)
+        ids = ids * (len(uniques) + 1) + (codes + 1) # NaN (-1) vira o código 0
+    return ids
+
+def has_ancestor_account(group, codes, contas):
+    """
+    máscara: a conta da linha (codes = posição em 'contas', as contas distintas) tem alguma
+    conta-mãe (prefixo próprio, ex: '41' de '411') informada no mesmo grupo. as contas distintas
+    são poucas (plano de contas), então por linha só roda o isin (hash), uma passada por nível
+    da hierarquia: custo linear nas linhas
+    """
+    n_contas = len(contas)
+    index = {c: i for i, c in enumerate(contas)}
+    present = pd.unique(group * n_contas + codes) # pares (grupo, conta) que existem
+    max_len = max((len(c) for c in contas), default=0)
+
+    mask = np.zeros(len(codes), dtype=bool)
+    for level in range(1, max_len):
+        # prefixo de tamanho 'level' de cada conta distinta (-1 se não é prefixo próprio ou não existe)
+        prefix = np.array([index.get(c[:level], -1) if len(c) > level else -1 for c in contas], dtype=np.int64)
+        parent = prefix[codes]
+        rows = np.flatnonzero(parent >= 0)
+        if len(rows):
+            keys = group[rows] * n_contas + parent[rows]
+            mask[rows[pd.Series(keys).isin(present).to_numpy()]] = True
+    return mask
+
+@metrics.instrument()
 def remove_accounting_duplication(df):
     """
     aqui trata a hierarquia do plano de contas para evitar dupla contagem
-    a estratégia: Prioriza a conta sintética de nível 1 ('4') que representa o total
+    a estratégia: em cada operadora/trimestre fica a conta mais sintética informada e saem
+    as descendentes dela (com '4' presente só ela fica; sem '4', ficam '41' e '46' no lugar
+    das filhas). antes a decisão era global e quem só reportou analíticas sumia
     """
     print("[FILTRO] Aplicando filtro de duplicidade contábil...")
-    
-    # garante ordenação dos dados
-    df = df.sort_values(by='CONTA')
-    
+
+    # as comparações de texto rodam só nas contas distintas, não em cada linha
+    # (CONTA categórica: o factorize usa os códigos que já existem, sem montar texto por linha)
+    codes, contas = pd.factorize(df['CONTA'])
+    contas = np.asarray(contas.astype(str), dtype=object)
+
     # filtra apenas o grupo de Despesas (iniciadas em 4)
     # O teste menciona "Eventos" (41), mas pede valores totais em outras partes
-    df_despesas = df[df['CONTA'].astype(str).str.startswith('4')]
-    
-    # aqui tenta isolar apenas a conta '4' (Total Geral)
-    # pelo motivo: Somar a conta '4' com a conta '41' duplicaria os valores.
-    totals = df_despesas[df_despesas['CONTA'].astype(str) == '4']
-    
-    if len(totals) > 0:
-        print(f"   [INFO] Utilizando conta sintética '4' (Total) para agregação segura. ({len(totals)} registros)")
-        return totals
-    else:
-        # fallback: se a operadora não reportou a conta '4', mantemos as analíticas para nao perder dados
-        print("   [WARN] Conta totalizadora '4' não encontrada. Mantendo dados brutos.")
-        return df_despesas
+    # conta vazia tem código -1, que cai no False acrescentado no fim
+    despesa = np.array([c.startswith('4') for c in contas] + [False], dtype=bool)[codes]
+    df_despesas, codes = df[despesa], codes[despesa]
+
+    # grupo = operadora (REG_ANS, igual à serie_trimestral) + período: registros diferentes
+    # com o mesmo CNPJ não se misturam (o '4' de um não derruba as '41'/'46' do outro)
+    group = group_ids(df_despesas, ['REG_ANS', 'Ano', 'Trimestre'])
+    keep = ~has_ancestor_account(group, codes, contas)
+
+    grupos = len(pd.unique(group))
+    com_total = len(pd.unique(group[keep & (contas == '4')[codes]]))
+    print(f"   [INFO] Conta sintética '4' (Total) em {com_total} de {grupos} operadoras/trimestres; "
+          f"nas demais ficam as contas mais sintéticas informadas. ({keep.sum()} registros)")
+    return df_despesas[keep]
 
+@metrics.instrument()
 def clean_data(df):
     """validações do Teste 2.1"""
     print("[VALIDAÇÃO] Limpando dados...")
@@ -56,6 +113,20 @@ def clean_data(df):
     
     return df
 
+@metrics.instrument()
+def quarterly_totals(df):
+    """
+    step 1: Calcular o TOTAL de despesas por Operadora + UF + Trimestre + Ano
+    isso garante que temos um único valor por trimestre para calcular a média depois
+    """
+    # observed=True: as chaves são categóricas, sem isso o groupby faria o produto cartesiano das categorias
+    # soma em centavos inteiros: total exato, independente da ordem das linhas
+    totals = df[['RazaoSocial', 'UF', 'Ano', 'Trimestre']].assign(VALOR=schema.to_cents(df['VALOR']))
+    totals = totals.groupby(['RazaoSocial', 'UF', 'Ano', 'Trimestre'], observed=True)['VALOR'].sum().reset_index()
+    totals['VALOR'] = schema.from_cents(totals['VALOR'])
+    return totals
+
+@metrics.instrument()
 def aggregate_data(df):
     """
     aqui executa a agregação complexa (Teste 2.3):
@@ -63,18 +134,18 @@ def aggregate_data(df):
     - Média trimestral
     - Desvio Padrao
     """
+    return aggregate_quarterly(quarterly_totals(df))
+
+@metrics.instrument()
+def aggregate_quarterly(df_quarterly):
     print("[AGREGAÇÃO] Calculando estatísticas...")
     
-    #step 1: Calcular o TOTAL de despesas por Operadora + UF + Trimestre + Ano
-    # isso garante que temos um único valor por trimestre para calcular a média depois
-    df_quarterly = df.groupby(['RazaoSocial', 'UF', 'Ano', 'Trimestre'])['VALOR'].sum().reset_index()
-    
     # step 2: agora agrupamos por Operadora + UF para tirar as estatísticas entre os trimestres
     # agregações:
     # - sum: soma dos totais de todos os trimestres
     # - mean: Média dos valores trimestrais
     # - std: Desvio padrao entre os trimestres
-    df_final = df_quarterly.groupby(['RazaoSocial', 'UF']).agg(
+    df_final = df_quarterly.groupby(['RazaoSocial', 'UF'], observed=True).agg(
         Valor_Total=('VALOR', 'sum'),
         Media_Trimestral=('VALOR', 'mean'),
         Desvio_Padrao=('VALOR', 'std'),
@@ -89,15 +160,127 @@ def aggregate_data(df):
     
     return df_final
 
-def main():
-    if not INPUT_FILE.exists():
-        print(f"[ERRO] Arquivo de entrada nao encontrado: {INPUT_FILE}")
-        return
+# --- agregação incremental (momentos combináveis) ---
+# por operadora guardamos n (trimestres), soma e M2 (soma dos quadrados dos desvios, Welford)
+# dois conjuntos se combinam pela fórmula de Chan, então um trimestre novo entra nas
+# estatísticas sem reler o histórico, e um trimestre reprocessado pode ser retirado antes
 
-    print("=== Iniciando Agregador de despesas ===")
-    
+def moments_from_totals(df_quarterly):
+    df_quarterly = totals_as_text(df_quarterly)
+    g = df_quarterly.groupby(MOMENT_KEYS, observed=True)['VALOR']
+    moments = pd.DataFrame({'n': g.count(), 'soma': g.sum()})
+    moments['m2'] = g.var(ddof=0).fillna(0) * moments['n']
+    return moments.reset_index()
+
+def merge_moments(a, b, sign=1):
+    """
+    combina os momentos de 'a' com os de 'b' (sign=1) ou retira 'b' de 'a' (sign=-1)
+    """
+    a = a.set_index(MOMENT_KEYS)
+    b = b.set_index(MOMENT_KEYS)
+    idx = a.index.union(b.index)
+    a = a.reindex(idx, fill_value=0)
+    b = b.reindex(idx, fill_value=0)
+
+    n = a['n'] + sign * b['n']
+    soma = a['soma'] + sign * b['soma']
+    valid = n > 0
+    n_safe = n.where(valid, 1)
+    mean_b = b['soma'] / b['n'].where(b['n'] > 0, 1)
+
+    if sign > 0:
+        mean_a = a['soma'] / a['n'].where(a['n'] > 0, 1)
+        delta = mean_b - mean_a
+        m2 = a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / n_safe
+    else:
+        # 'a' é a união (resto + b); o resto tem n=n, média=soma/n
+        mean_rest = soma / n_safe
+        delta = mean_b - mean_rest
+        m2 = a['m2'] - b['m2'] - delta ** 2 * n * b['n'] / a['n'].where(a['n'] > 0, 1)
+
+    merged = pd.DataFrame({'n': n, 'soma': soma, 'm2': m2.clip(lower=0)})
+    return merged[valid].reset_index()
+
+def finalize_moments(moments):
+    """mesmas colunas do aggregate_data, calculadas a partir dos momentos"""
+    n = moments['n']
+    df_final = pd.DataFrame({
+        'RazaoSocial': moments['RazaoSocial'],
+        'UF': moments['UF'],
+        'Valor_Total': moments['soma'],
+        'Media_Trimestral': moments['soma'] / n,
+        'Desvio_Padrao': np.sqrt(moments['m2'] / (n - 1).where(n > 1, 1)).where(n > 1, 0.0),
+        'Qtd_Trimestres': n.astype(int)
+    })
+    return df_final.sort_values(by='Valor_Total', ascending=False)
+
+def quarter_totals_for(name, quarter):
+    """lê só a partição de um trimestre do dataset e devolve seus totais por operadora"""
+    filters = [('Ano', '=', int(quarter['ano'])), ('Trimestre', '=', quarter['trimestre'])]
+    df = storage.read_consolidado(columns=INPUT_COLUMNS, filters=filters)
+    df = remove_accounting_duplication(clean_data(df))
+    totals = totals_as_text(quarterly_totals(df))
+    totals['Origem'] = name
+    return totals
+
+def save_incremental_state(ledger, df_totals, moments):
+    df_totals.to_parquet(storage.TRIMESTRAIS_PARQUET, index=False)
+    moments.to_parquet(storage.MOMENTOS_PARQUET, index=False)
+    ledger['aggregated'] = {name: q['sha256'] for name, q in ledger['quarters'].items()}
+    ledger['aggregated_with'] = aggregation_stamp(ledger)
+    state.save_state(ledger)
+
+def aggregation_stamp(ledger):
+    # o que, além dos zips, entra nos totais guardados: o cadastro (RazaoSocial/UF vêm dele) e a regra de dedup
+    return {'cadastro': ledger['cadastro'], 'regra': state.DEDUP_RULE_VERSION}
+
+def can_run_incremental(ledger):
+    return (
+        storage.DATA_FORMAT == 'parquet' and state.INCREMENTAL and bool(ledger['aggregated'])
+        and ledger['aggregated_with'] == aggregation_stamp(ledger)
+        and storage.TRIMESTRAIS_PARQUET.exists() and storage.MOMENTOS_PARQUET.exists()
+        and OUTPUT_FILE.exists()
+    )
+
+@metrics.instrument()
+def run_incremental(ledger):
+    """
+    aplica nas estatísticas só os trimestres que mudaram desde a última agregação:
+    retira os totais antigos dos trimestres alterados/removidos e soma os novos
+    custo proporcional aos trimestres novos, não ao histórico inteiro
+    """
+    quarters, applied = ledger['quarters'], ledger['aggregated']
+    stale = [name for name, sha in applied.items() if quarters.get(name, {}).get('sha256') != sha]
+    pending = [name for name, q in quarters.items() if applied.get(name) != q['sha256']]
+    print(f"[INCREMENTAL] {len(pending)} trimestres novos/alterados, {len(stale)} a retirar.")
+
+    if not pending and not stale:
+        return None
+
+    df_totals = pd.read_parquet(storage.TRIMESTRAIS_PARQUET)
+    moments = pd.read_parquet(storage.MOMENTOS_PARQUET)
+
+    old = df_totals[df_totals['Origem'].isin(stale)]
+    if len(old):
+        moments = merge_moments(moments, moments_from_totals(old), sign=-1)
+    df_totals = df_totals[~df_totals['Origem'].isin(stale)]
+
+    new = [quarter_totals_for(name, quarters[name]) for name in pending]
+    new = [t for t in new if len(t)]
+    if new:
+        df_new = pd.concat(new, ignore_index=True)
+        moments = merge_moments(moments, moments_from_totals(df_new))
+        df_totals = pd.concat([df_totals, df_new], ignore_index=True)
+
+    save_incremental_state(ledger, df_totals, moments)
+    return finalize_moments(moments)
+
+@metrics.instrument()
+def run_full(ledger):
+    """agregação completa (comportamento original); no parquet também grava o estado incremental"""
     # carrega definindo tipos para economizar memoria, focando em desempenho
-    df = pd.read_csv(INPUT_FILE, dtype={'CNPJ': str, 'CONTA': str, 'Trimestre': str})
+    # (categóricas para UF/Modalidade/Trimestre, ver etl/storage.py)
+    df = storage.read_consolidado(columns=INPUT_COLUMNS)
     
     # 1.limpeza basica
     df = clean_data(df)
@@ -106,13 +289,40 @@ def main():
     df = remove_accounting_duplication(df)
     
     # 3 agregação estatística
-    df_agregado = aggregate_data(df)
+    df_quarterly = quarterly_totals(df)
+    df_agregado = aggregate_quarterly(df_quarterly)
+
+    if ledger is not None and ledger['quarters']:
+        origem = {(int(q['ano']), q['trimestre']): name for name, q in ledger['quarters'].items()}
+        df_totals = totals_as_text(df_quarterly)
+        df_totals['Origem'] = [origem.get(k) for k in zip(df_totals['Ano'], df_totals['Trimestre'])]
+        save_incremental_state(ledger, df_totals, moments_from_totals(df_totals))
+
+    return df_agregado
+
+def main():
+    if not INPUT_FILE.exists():
+        print(f"[ERRO] Arquivo de entrada nao encontrado: {INPUT_FILE}")
+        return
+
+    print("=== Iniciando Agregador de despesas ===")
+
+    # o ledger do processor (etl/state.py) diz quais trimestres existem no dataset parquet
+    ledger = state.load_state() if storage.DATA_FORMAT == 'parquet' else None
+
+    if ledger is not None and can_run_incremental(ledger):
+        df_agregado = run_incremental(ledger)
+        if df_agregado is None:
+            print("[SKIP] Nenhum trimestre novo desde a última agregação.")
+            return
+    else:
+        df_agregado = run_full(ledger)
     
     #salvamento
-    df_agregado.to_csv(OUTPUT_FILE, index=False, float_format='%.2f')
+    storage.write_agregado(df_agregado)
     print(f"\n[SUCESSO] Arquivo gerado: {OUTPUT_FILE}")
     print("Top 5 Maiores Despesas por Operadora/UF:")
     print(df_agregado.head())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    metrics.run_stage("3_aggregator", main)
\ No newline at end of file
@@ -1,7 +1,13 @@
-import pandas as pd
+import io
+import os
+import re
 from sqlalchemy import create_engine, text
-from pathlib import Path
 import time
+import uuid
+
+import storage
+import state
+import metrics
 
 # config do docker (precisa tá certinho)
 DB_USER = "user"
@@ -10,26 +16,91 @@ DB_HOST = "localhost"
 DB_PORT = "5432"
 DB_NAME = "ans_database"
 
-#conexão com o SQLAlchemy
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+#conexão com o SQLAlchemy (driver psycopg2 explícito, o COPY usa o copy_expert dele)
+DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# motor de carga da fato: 'copy' (COPY FROM STDIN, padrão) ou 'to_sql' (INSERT multi-valores antigo)
+LOAD_ENGINE = os.getenv("ANS_LOAD_ENGINE", "copy")
+# linhas por lote lidas do consolidado e enviadas ao COPY
+COPY_BATCH_ROWS = int(os.getenv("ANS_COPY_BATCH_ROWS", "200000"))
+# derruba e recria os índices da fato em volta da carga (vale a pena em cargas grandes)
+REBUILD_INDEXES = os.getenv("ANS_REBUILD_INDEXES", "0") == "1"
+COPY_READ_SIZE = 1024 * 1024 # bytes por leitura do copy_expert (o padrão é 8 KB)
+
+FATO_COLUMNS = ['registro_ans', 'ano', 'trimestre', 'conta', 'valor']
+OPERADORA_COLUMNS = ['registro_ans', 'cnpj', 'razao_social', 'uf', 'modalidade']
+FATO_RENAME = {
+    'REG_ANS': 'registro_ans',
+    'Ano': 'ano',
+    'Trimestre': 'trimestre',
+    'CONTA': 'conta',
+    'VALOR': 'valor'
+}
 
-#arquivos
-CONSOLIDADO_FILE = Path("data/processed/consolidado_despesas.csv")
-AGREGADO_FILE = Path("data/processed/despesas_agregadas.csv")
+#arquivos (csv ou dataset parquet, conforme ANS_DATA_FORMAT, ver etl/storage.py)
+CONSOLIDADO_FILE = storage.consolidado_path()
+AGREGADO_FILE = storage.agregado_path()
 
 def get_engine():
     return create_engine(DATABASE_URL)
 
+def ensure_staging_tables(engine):
+    """
+    tabelas de staging UNLOGGED (sem WAL, escrita bem mais rápida; o conteúdo é descartável)
+    também criadas no sql/init.sql, aqui só garante para bancos criados antes disso
+    """
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS stg_operadoras (
+                registro_ans VARCHAR(10), cnpj VARCHAR(20), razao_social TEXT, uf VARCHAR(2), modalidade TEXT
+            )
+        """))
+        conn.execute(text("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS stg_fato_despesas (
+                registro_ans VARCHAR(10), ano INTEGER, trimestre VARCHAR(10), conta VARCHAR(50), valor NUMERIC(18, 2)
+            )
+        """))
+        criar_serie = conn.execute(text("SELECT to_regclass('serie_trimestral')")).scalar() is None
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS serie_trimestral (
+                registro_ans VARCHAR(10) NOT NULL, ano INTEGER NOT NULL, trimestre VARCHAR(10) NOT NULL,
+                total NUMERIC(18, 2), qtd_lancamentos INTEGER, grupos JSONB NOT NULL DEFAULT '{}',
+                PRIMARY KEY (registro_ans, ano, trimestre) INCLUDE (total)
+            )
+        """))
+        if criar_serie:
+            # banco antigo: a carga incremental só mexeria nos trimestres novos, então preenche o histórico da fato
+            print("   [SÉRIE] Criando serie_trimestral a partir da fato existente...")
+            refresh_serie_trimestral(conn, source='fato_despesas')
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS etl_versao (
+                id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1), versao TEXT NOT NULL, carregado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+
+def stamp_data_version(engine):
+    """grava uma versão nova dos dados (a API descarta o cache de respostas quando ela muda)"""
+    versao = uuid.uuid4().hex[:12]
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO etl_versao (id, versao, carregado_em) VALUES (1, :versao, now())
+            ON CONFLICT (id) DO UPDATE SET versao = EXCLUDED.versao, carregado_em = EXCLUDED.carregado_em
+        """), {'versao': versao})
+    print(f"[VERSÃO] Dados publicados com versão {versao}")
+    return versao
+
+@metrics.instrument()
 def load_dimensao_operadoras(df, engine):
     """
-    popula a tabela dim_operadoras extraindo dados unicos do CSV de despesas
-    trade-off: usamos 'ON CONFLICT DO NOTHING' para evitar erros de duplicaçao
+    popula a tabela dim_operadoras extraindo dados unicos do consolidado
+    idempotente: as operadoras vão para a staging e entram com INSERT ... ON CONFLICT DO UPDATE,
+    então rodar de novo só atualiza os dados cadastrais (nada de engolir o lote no 1º duplicado)
     """
     print("[LOAD] Carregando Dimensão Operadoras...")
     
     #aqui seleciona colunas unicas de operadoras
     #mapeia colunas do CSV -> Colunas do Banco
-    df_ops = df[['REG_ANS', 'CNPJ', 'RazaoSocial', 'UF', 'Modalidade']].drop_duplicates(subset=['REG_ANS'])
+    df_ops = df[['REG_ANS', 'CNPJ', 'RazaoSocial', 'UF', 'Modalidade']].drop_duplicates(subset=['REG_ANS'], keep='last')
     
     #renomeia para bater com o banco
     df_ops = df_ops.rename(columns={
@@ -40,44 +111,353 @@ def load_dimensao_operadoras(df, engine):
         'Modalidade': 'modalidade'
     })
     
-    #inserção
-    try:
-        df_ops.to_sql('dim_operadoras', engine, if_exists='append', index=False, method='multi', chunksize=1000)
-        print(f"   [SUCESSO] {len(df_ops)} operadoras inseridas.")
-    except Exception as e:
-        #se der erro (por ex: chave duplicada), assumimos que já foi carregado
-        print(f"   [INFO] Tabela já populada ou erro de integridade ignorável: {e}")
+    #staging + merge numa transação só
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE stg_operadoras"))
+        write_staging(conn, 'stg_operadoras', OPERADORA_COLUMNS, [df_ops])
+        result = conn.execute(text("""
+            INSERT INTO dim_operadoras (registro_ans, cnpj, razao_social, uf, modalidade)
+            SELECT DISTINCT ON (registro_ans) registro_ans, cnpj, razao_social, uf, modalidade
+            FROM stg_operadoras
+            WHERE registro_ans IS NOT NULL
+            ORDER BY registro_ans
+            ON CONFLICT (registro_ans) DO UPDATE SET
+                cnpj = EXCLUDED.cnpj,
+                razao_social = EXCLUDED.razao_social,
+                uf = EXCLUDED.uf,
+                modalidade = EXCLUDED.modalidade
+        """))
+        conn.execute(text("TRUNCATE stg_operadoras"))
+    print(f"   [SUCESSO] {result.rowcount} operadoras inseridas/atualizadas.")
+
+def format_copy_chunk(df, columns):
+    """
+    serializa um DataFrame no formato CSV do COPY: sem header, campo vazio (sem aspas) = NULL
+    textos com vírgula/aspas/quebra de linha saem entre aspas pelo próprio to_csv
+    """
+    buf = io.StringIO()
+    df[columns].to_csv(buf, header=False, index=False, na_rep='', lineterminator='\n')
+    return buf.getvalue()
+
+class CopyStream(io.TextIOBase):
+    """
+    arquivo "virtual" que o copy_expert lê: gera o texto do COPY sob demanda a partir de
+    um iterável de DataFrames, então só um lote por vez existe em memória
+    """
+    def __init__(self, frames, columns):
+        self._frames = iter(frames)
+        self._columns = columns
+        self._buffer = ''
+        self._pos = 0
+        self.rows = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        # só gera o próximo lote quando o que sobrou do atual não cobre o pedido
+        while size < 0 or len(self._buffer) - self._pos < size:
+            try:
+                df = next(self._frames)
+            except StopIteration:
+                break
+            self._buffer = self._buffer[self._pos:] + format_copy_chunk(df, self._columns)
+            self._pos = 0
+            self.rows += len(df)
+
+        end = len(self._buffer) if size < 0 else self._pos + size
+        data = self._buffer[self._pos:end]
+        self._pos = min(end, len(self._buffer))
+        return data
+
+def to_fato_frame(df):
+    return df.rename(columns=FATO_RENAME)[FATO_COLUMNS]
+
+def copy_frames(conn, table, columns, frames):
+    """
+    COPY table (columns) FROM STDIN via psycopg2 (copy_expert) dentro da transação de 'conn'
+    retorna o número de linhas enviadas
+    """
+    stream = CopyStream(frames, columns)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(sql, stream, size=COPY_READ_SIZE)
+    return stream.rows
+
+@metrics.instrument(rows_out=lambda rows: rows)
+def write_staging(conn, table, columns, frames):
+    """preenche uma tabela de staging pelo motor configurado (COPY ou o to_sql antigo)"""
+    if LOAD_ENGINE == 'to_sql':
+        rows = 0
+        for frame in frames:
+            frame[columns].to_sql(table, conn, if_exists='append', index=False, method='multi', chunksize=5000)
+            rows += len(frame)
+        return rows
+    # COPY manda as linhas como um fluxo só, sem montar INSERTs gigantes parametrizados
+    return copy_frames(conn, table, columns, frames)
+
+def drop_table_indexes(engine, table):
+    """
+    derruba os índices secundários (não PK/unique) da tabela e devolve os CREATE INDEX
+    para recriar depois da carga (manter índice atualizado linha a linha custa caro)
+    """
+    # a tabela é resolvida pelo oid no schema public (o init.sql cria tudo lá): uma tabela
+    # com o mesmo nome em outro schema do search_path não entra
+    sql = text("""
+        SELECT n.nspname, c.relname, pg_get_indexdef(x.indexrelid)
+        FROM pg_index x
+        JOIN pg_class c ON c.oid = x.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE x.indrelid = to_regclass(:table) AND NOT x.indisprimary AND NOT x.indisunique
+    """)
+    with engine.begin() as conn:
+        indexes = conn.execute(sql, {'table': f"public.{table}"}).all()
+        for schema_name, name, _ in indexes:
+            conn.execute(text(f'DROP INDEX IF EXISTS "{schema_name}"."{name}"'))
+    return [definition for _, _, definition in indexes]
+
+def create_indexes(engine, definitions):
+    with engine.begin() as conn:
+        for definition in definitions:
+            conn.execute(text(definition))
+
+def load_fato_periodos(conn, frames, periodos):
+    """
+    troca os 'periodos' [(ano, trimestre), ...] da fato pelo conteúdo de 'frames', dentro da transação de 'conn':
+    staging -> (fato particionada) partição nova por período + DETACH/ATTACH, ou (fato antiga) DELETE + INSERT
+    se algo falhar, o rollback deixa a fato exatamente como estava (nada de carga pela metade)
+    """
+    conn.execute(text("TRUNCATE stg_fato_despesas"))
+    rows = write_staging(conn, 'stg_fato_despesas', FATO_COLUMNS, (to_fato_frame(f) for f in frames))
+    if is_partitioned(conn):
+        for ano, trimestre in periodos:
+            replace_partition(conn, ano, trimestre)
+    else:
+        delete_periodos(conn, periodos)
+        conn.execute(text(f"""
+            INSERT INTO fato_despesas ({', '.join(FATO_COLUMNS)})
+            SELECT {', '.join(FATO_COLUMNS)} FROM stg_fato_despesas
+        """))
+    # série trimestral troca na mesma transação (gráfico nunca fica fora de sincronia com a fato)
+    refresh_serie_trimestral(conn, periodos=periodos)
+    conn.execute(text("TRUNCATE stg_fato_despesas"))
+    return rows
+
+# --- fato particionada ---
+# fato_despesas (RANGE ano) -> fato_despesas_<ano> (LIST trimestre) -> fato_despesas_<ano>_<trimestre>
+# cada trimestre é carregado numa tabela nova e entra no lugar da antiga com DETACH/ATTACH
+
+def is_partitioned(conn):
+    """a fato foi criada com o init.sql novo (ou convertida pela migration_003)?"""
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('fato_despesas')")).scalar() == 'p'
+
+def partition_names(ano, trimestre):
+    # os nomes entram no DDL, então só aceita o formato esperado ('2024', '1T')
+    if not re.fullmatch(r'[0-9A-Za-z]+', str(trimestre)):
+        raise ValueError(f"Trimestre inválido para nome de partição: {trimestre!r}")
+    ano = int(ano)
+    return f"fato_despesas_{ano}", f"fato_despesas_{ano}_{str(trimestre).lower()}"
 
-def load_fato_despesas(df, engine):
+def ensure_year_partition(conn, ano):
+    year_table, _ = partition_names(ano, '0')
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {year_table} PARTITION OF fato_despesas
+        FOR VALUES FROM ({int(ano)}) TO ({int(ano) + 1}) PARTITION BY LIST (trimestre)
+    """))
+    return year_table
+
+def drop_partition(conn, ano, trimestre):
+    """aposenta um trimestre: DETACH + DROP (só mexe nos arquivos da partição, sem DELETE linha a linha)"""
+    year_table, quarter_table = partition_names(ano, trimestre)
+    if conn.execute(text("SELECT to_regclass(:t)"), {'t': quarter_table}).scalar() is None:
+        return
+    conn.execute(text(f"ALTER TABLE {year_table} DETACH PARTITION {quarter_table}"))
+    conn.execute(text(f"DROP TABLE {quarter_table}"))
+
+def replace_partition(conn, ano, trimestre):
     """
-    carrega a tabela fato_despesas.
+    monta o trimestre numa tabela avulsa a partir da staging e troca pela partição atual
+    o CHECK com os valores da partição deixa o ATTACH pular a varredura de validação
+    """
+    year_table = ensure_year_partition(conn, ano)
+    _, quarter_table = partition_names(ano, trimestre)
+    new_table = f"{quarter_table}_novo"
+    ano, trimestre = int(ano), str(trimestre)
+
+    conn.execute(text(f"DROP TABLE IF EXISTS {new_table}"))
+    conn.execute(text(f"CREATE TABLE {new_table} (LIKE fato_despesas INCLUDING DEFAULTS)"))
+    conn.execute(text(f"ALTER TABLE {new_table} ADD CONSTRAINT {new_table}_periodo CHECK (ano = {ano} AND trimestre = '{trimestre}')"))
+    rows = conn.execute(text(f"""
+        INSERT INTO {new_table} ({', '.join(FATO_COLUMNS)})
+        SELECT {', '.join(FATO_COLUMNS)} FROM stg_fato_despesas WHERE ano = :ano AND trimestre = :tri
+    """), {'ano': ano, 'tri': trimestre}).rowcount
+
+    drop_partition(conn, ano, trimestre)
+    if rows == 0:
+        # trimestre reprocessado que veio vazio: só some da fato
+        conn.execute(text(f"DROP TABLE {new_table}"))
+        return 0
+    conn.execute(text(f"ALTER TABLE {new_table} RENAME TO {quarter_table}"))
+    conn.execute(text(f"ALTER TABLE {year_table} ATTACH PARTITION {quarter_table} FOR VALUES IN ('{trimestre}')"))
+    conn.execute(text(f"ALTER TABLE {quarter_table} DROP CONSTRAINT {new_table}_periodo"))
+    return rows
+
+def periodos_no_banco(conn):
+    """
+    (ano, trimestre) que estão carregados hoje: os da serie_trimestral (um conjunto pequeno, refeito
+    junto com cada trimestre da fato) e, na fato particionada, os das partições de trimestre
+    (só tabelas: os índices filhos dos índices particionados, ex: fato_despesas_2021_pkey, também são partições)
+    """
+    periodos = {(int(a), t) for a, t in conn.execute(text("SELECT DISTINCT ano, trimestre FROM serie_trimestral"))}
+    if is_partitioned(conn):
+        nomes = conn.execute(text("""
+            SELECT relname FROM pg_class
+            WHERE relispartition AND relkind IN ('r', 'p') AND relname ~ '^fato_despesas_[0-9]+_[0-9a-z]+$'
+        """))
+        for nome in nomes.scalars():
+            ano, trimestre = nome.rsplit('_', 2)[1:]
+            periodos.add((int(ano), trimestre.upper()))
+    return periodos
+
+def retire_periodos(conn, periodos):
+    """tira os períodos da fato: DROP das partições (fato particionada) ou DELETE (fato antiga)"""
+    if is_partitioned(conn):
+        for ano, trimestre in periodos:
+            drop_partition(conn, ano, trimestre)
+    else:
+        delete_periodos(conn, periodos)
+
+@metrics.instrument()
+def refresh_serie_trimestral(conn, source='stg_fato_despesas', periodos=None):
+    """
+    (re)calcula a serie_trimestral a partir de 'source'; na carga normal vem da staging, que tem
+    exatamente as linhas dos períodos trocados (não depende dos índices da fato)
+    o total segue a regra do remove_accounting_duplication (3_aggregator.py): em cada operadora/trimestre
+    entra a conta que não tem conta-mãe (prefixo próprio, ex: '41' de '411') informada no mesmo trimestre,
+    pra não somar a conta '4' com as '41', '411'... (dupla contagem)
+    antes da regra saem os lançamentos negativos (ou sem valor), igual ao clean_data do agregador
+    """
+    if periodos is not None:
+        delete_periodos(conn, periodos, table='serie_trimestral')
+    conn.execute(text(f"""
+        WITH contas AS (
+            SELECT registro_ans, ano, trimestre, conta, SUM(valor) AS valor, COUNT(*) AS lancamentos
+            FROM {source}
+            WHERE registro_ans IS NOT NULL AND conta IS NOT NULL AND valor >= 0
+            GROUP BY registro_ans, ano, trimestre, conta
+        ),
+        -- cada prefixo próprio de cada conta ('411' -> '4', '41'); as que têm um deles informado
+        -- no mesmo trimestre são descendentes (junção por igualdade, sem comparar conta com conta)
+        prefixos AS MATERIALIZED (
+            SELECT registro_ans, ano, trimestre, conta, left(conta, nivel) AS mae
+            FROM contas, generate_series(1, length(conta) - 1) AS nivel
+        ),
+        descendentes AS (
+            SELECT DISTINCT p.registro_ans, p.ano, p.trimestre, p.conta
+            FROM prefixos p
+            JOIN contas m ON m.registro_ans = p.registro_ans AND m.ano = p.ano
+                         AND m.trimestre = p.trimestre AND m.conta = p.mae
+        )
+        INSERT INTO serie_trimestral (registro_ans, ano, trimestre, total, qtd_lancamentos, grupos)
+        SELECT registro_ans, ano, trimestre,
+               SUM(valor) FILTER (WHERE NOT tem_mae),
+               SUM(lancamentos),
+               COALESCE(jsonb_object_agg(conta, valor) FILTER (WHERE length(conta) = 2), '{{}}')
+        FROM (
+            SELECT c.*, d.conta IS NOT NULL AS tem_mae
+            FROM contas c
+            LEFT JOIN descendentes d USING (registro_ans, ano, trimestre, conta)
+        ) contas
+        GROUP BY registro_ans, ano, trimestre
+    """))
+
+def delete_periodos(conn, periodos, table='fato_despesas'):
+    # usa o índice (ano, trimestre); nunca um TRUNCATE da fato inteira
+    conn.execute(text(f"""
+        DELETE FROM {table}
+        WHERE (ano, trimestre) IN (
+            SELECT * FROM unnest(CAST(:anos AS INTEGER[]), CAST(:tris AS VARCHAR[]))
+        )
+    """), {'anos': [int(a) for a, _ in periodos], 'tris': [t for _, t in periodos]})
+
+@metrics.instrument()
+def load_fato_despesas(engine, quarters, removed=()):
+    """
+    carrega a tabela fato_despesas trimestre a trimestre (idempotente)
+    cada (ano, trimestre) é uma transação: recarregar um trimestre custa só o tamanho dele
+    no csv (sem partições) o arquivo é lido uma vez e todos os períodos trocam numa transação
     """
     print("[LOAD] Carregando Fato Despesas (isso pode demorar um pouquinho)...")
     
-    #prepara o DataFrame
-    df_fato = df.copy()
-    
-    # ajusta nomes
-    df_fato = df_fato.rename(columns={
-        'REG_ANS': 'registro_ans',
-        'Ano': 'ano',
-        'Trimestre': 'trimestre',
-        'CONTA': 'conta',
-        'VALOR': 'valor'
-    })
-    
-    #seleciona apenas colunas que existem na tabela fato
-    cols_banco = ['registro_ans', 'ano', 'trimestre', 'conta', 'valor']
-    df_fato = df_fato[cols_banco]
-    
-    #o bulk Insert
-    #chunksize=10000 é um bom meio termo entre memória e performance
     start = time.time()
-    df_fato.to_sql('fato_despesas', engine, if_exists='append', index=False, method='multi', chunksize=5000)
+    rows = 0
+    with engine.connect() as conn:
+        partitioned = is_partitioned(conn)
+    # na fato particionada não precisa: cada partição nova é preenchida sem índice e ganha os índices no ATTACH
+    index_defs = drop_table_indexes(engine, 'fato_despesas') if REBUILD_INDEXES and not partitioned else []
+    try:
+        if removed:
+            print(f"   [REMOVE] {removed}")
+            with engine.begin() as conn:
+                retire_periodos(conn, removed)
+                delete_periodos(conn, removed, table='serie_trimestral')
+
+        if storage.DATA_FORMAT == 'parquet':
+            for ano, trimestre in quarters:
+                filters = [('Ano', '=', int(ano)), ('Trimestre', '=', trimestre)]
+                lotes = storage.iter_consolidado(columns=list(FATO_RENAME), batch_rows=COPY_BATCH_ROWS, filters=filters)
+                with engine.begin() as conn:
+                    n = load_fato_periodos(conn, lotes, [(ano, trimestre)])
+                print(f"   [TRIMESTRE] {ano}/{trimestre}: {n} linhas")
+                rows += n
+        elif quarters:
+            lotes = storage.iter_consolidado(columns=list(FATO_RENAME), batch_rows=COPY_BATCH_ROWS)
+            with engine.begin() as conn:
+                rows = load_fato_periodos(conn, lotes, quarters)
+    finally:
+        if index_defs:
+            print(f"   [INDEX] Recriando {len(index_defs)} índices...")
+            create_indexes(engine, index_defs)
     end = time.time()
     
-    print(f"   [SUCESSO] Despesas carregadas em {end - start:.2f} segundos.")
+    elapsed = max(end - start, 1e-9)
+    print(f"   [SUCESSO] {rows} despesas carregadas em {elapsed:.2f} segundos ({rows / elapsed:,.0f} linhas/s).")
+    return rows
+
+def plan_fato_load(ledger, no_banco=()):
+    """
+    com o ledger (parquet), só os trimestres novos/alterados desde a última carga;
+    sem ledger, todos os períodos do consolidado (cada um trocado de forma idempotente)
+    removidos = o que está no banco ('no_banco', ver periodos_no_banco) ou no ledger e saiu do consolidado
+    retorna (períodos a carregar, períodos a remover)
+    """
+    no_banco = {(int(a), t) for a, t in no_banco}
+    if ledger is None or not ledger['quarters'] or not state.INCREMENTAL:
+        quarters = storage.list_quarters()
+        return quarters, sorted(no_banco - set(quarters))
+
+    quarters, loaded = ledger['quarters'], ledger.get('loaded', {})
+    if ledger.get('loaded_with') != load_stamp(ledger):
+        # cadastro ou regra trocados: os zips são os mesmos, mas dim_operadoras/serie ficaram com os dados antigos
+        loaded = {}
+    pending = sorted({(int(q['ano']), q['trimestre']) for name, q in quarters.items() if loaded.get(name) != q['sha256']})
+    vivos = {(int(q['ano']), q['trimestre']) for q in quarters.values()}
+    no_ledger = {tuple(p) for name, p in ledger.get('loaded_periods', {}).items() if name not in quarters}
+    removed = sorted((no_ledger | no_banco) - vivos)
+    return pending, removed
+
+def load_stamp(ledger):
+    # além dos zips, o que já está no banco depende do cadastro usado no enriquecimento
+    # e da regra de dedup da serie_trimestral
+    return {'cadastro': ledger.get('cadastro'), 'regra': state.DEDUP_RULE_VERSION}
+
+def record_load(ledger):
+    ledger['loaded'] = {name: q['sha256'] for name, q in ledger['quarters'].items()}
+    ledger['loaded_with'] = load_stamp(ledger)
+    ledger['loaded_periods'] = {name: [int(q['ano']), q['trimestre']] for name, q in ledger['quarters'].items()}
+    state.save_state(ledger)
 
+@metrics.instrument()
 def load_analise_agregada(engine):
     """
     carrega a tabela analise_agregada.
@@ -87,7 +467,7 @@ def load_analise_agregada(engine):
         return
 
     print("[LOAD] Carregando Análise Agregada...")
-    df = pd.read_csv(AGREGADO_FILE)
+    df = storage.read_agregado()
     
     #renomeia
     df = df.rename(columns={
@@ -99,14 +479,18 @@ def load_analise_agregada(engine):
         'Qtd_Trimestres': 'qtd_trimestres'
     })
     
-    df.to_sql('analise_agregada', engine, if_exists='replace', index=False) # Replace recria a tabela analítica
+    with metrics.measure('analise_agregada.to_sql', rows_in=len(df)):
+        df.to_sql('analise_agregada', engine, if_exists='replace', index=False) # Replace recria a tabela analítica
+    # o replace derruba os índices junto com a tabela; recria o do top 10 (sql/migration_002)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_agregada_valor_total ON analise_agregada (valor_total DESC)"))
     print("   [SUCESSO] Tabela de análise atualizada.")
 
 def main():
     print("=== Iniciando Carga no Banco de Dados ===")
     
     if not CONSOLIDADO_FILE.exists():
-        print("[ERRO] CSV consolidado não encontrado.")
+        print(f"[ERRO] Consolidado não encontrado: {CONSOLIDADO_FILE}")
         return
 
     engine = get_engine()
@@ -116,30 +500,40 @@ def main():
         with engine.connect() as conn:
             print("[CONEXÃO] Banco de dados conectado com sucesso!")
             
-            # limpa tabelas para evitar duplicaçao em testes repetidos (Opcional mas é muito bom em ambiente dev)
-            # conn.execute(text("TRUNCATE TABLE fato_despesas CASCADE;"))
-            # conn.execute(text("TRUNCATE TABLE dim_operadoras CASCADE;"))
-            # conn.commit()
-            
     except Exception as e:
         print(f"[ERRO] Falha ao conectar no Docker: {e}")
         print("Dica: Verifique se rodou 'docker-compose up -d'")
         return
 
-    # le o CSV
-    print("[LENDO] Carregando CSV em memória...")
-    df_consolidado = pd.read_csv(CONSOLIDADO_FILE, dtype={'REG_ANS': str, 'CNPJ': str, 'CONTA': str})
-    
-    #1.carrega dimensão (Operadoras)
-    load_dimensao_operadoras(df_consolidado, engine)
+    ensure_staging_tables(engine)
+    ledger = state.load_state() if storage.DATA_FORMAT == 'parquet' else None
+    with engine.connect() as conn:
+        no_banco = periodos_no_banco(conn)
+    quarters, removed = plan_fato_load(ledger, no_banco)
+    print(f"[PLANO] {len(quarters)} trimestres para carregar, {len(removed)} para remover.")
+
+    # le o consolidado (a dimensão só precisa das colunas cadastrais, e só dos trimestres a carregar)
+    if quarters:
+        print("[LENDO] Carregando dados cadastrais do consolidado...")
+        filters = [[('Ano', '=', int(a)), ('Trimestre', '=', t)] for a, t in quarters] if ledger else None
+        df_operadoras = storage.read_consolidado(columns=['REG_ANS', 'CNPJ', 'RazaoSocial', 'UF', 'Modalidade'], filters=filters)
+        
+        #1.carrega dimensão (Operadoras)
+        load_dimensao_operadoras(df_operadoras, engine)
+        del df_operadoras
     
-    # 2. carrega fato (Despesas)
-    load_fato_despesas(df_consolidado, engine)
+    # 2. carrega fato (Despesas) em lotes direto do arquivo, um trimestre por transação
+    load_fato_despesas(engine, quarters, removed)
+    if ledger is not None:
+        record_load(ledger)
     
     # 3 carrega tabela agregada (Data Mart)
     load_analise_agregada(engine)
+
+    # 4. carimba a versão (invalida o cache da API)
+    stamp_data_version(engine)
     
     print("\n=== Carga Finalizada ===")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    metrics.run_stage("4_loader", main)
\ No newline at end of file
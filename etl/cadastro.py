@@ -0,0 +1,291 @@
+"""
+cadastro das operadoras (Relatorio_cadop.csv da ANS) guardado localmente em snapshots versionados
+
+- refresh(): GET condicional (If-None-Match/If-Modified-Since, igual ao manifesto do crawler);
+  304, rede fora ou ANS_CADASTRO_OFFLINE=1 = segue com o último snapshot, sem baixar nem parsear nada.
+  dentro de ANS_CADASTRO_MAX_AGE_HOURS desde a última consulta nem pergunta pra ANS
+- cada conteúdo novo vira um snapshot data/cache/cadastro/cadop_<sha>.parquet já no formato do
+  lookup (REG_ANS normalizado + CADOP_FIELDS), ordenado por REG_ANS; o cadastro.json guarda as versões
+- load_lookup(): lê o snapshot do disco uma vez por processo e devolve o frame indexado por REG_ANS
+  (o enriquecimento do processor é um get_indexer nesse índice);
+  find_by_cnpj() usa um segundo índice ordenado por CNPJ (busca binária), montado só quando alguém pede
+- lookup_for_period(): snapshot vigente no fim de um trimestre (enriquecimento histórico, ANS_CADASTRO_HISTORICO=1);
+  trimestre fora do padrão usa o snapshot atual
+"""
+import os
+import io
+import json
+import hashlib
+import calendar
+from datetime import datetime, timezone, date
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+import storage
+
+CADASTRO_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude_ativas/Relatorio_cadop.csv"
+CADASTRO_DIR = Path(os.getenv("ANS_CADASTRO_DIR", "data/cache/cadastro"))
+MANIFEST_FILE = "cadastro.json"
+# snapshot consultado há menos que isso é usado direto, sem nem o GET condicional
+MAX_AGE_HOURS = float(os.getenv("ANS_CADASTRO_MAX_AGE_HOURS", "24"))
+OFFLINE = os.getenv("ANS_CADASTRO_OFFLINE", "0") == "1"
+# enriquece cada trimestre com o snapshot vigente no fim dele (padrão: o mais recente pra tudo)
+HISTORICAL = os.getenv("ANS_CADASTRO_HISTORICO", "0") == "1"
+TIMEOUT = 30
+SNAPSHOT_FORMAT = 'parquet' if storage.HAS_PYARROW else 'csv'
+
+CADOP_FIELDS = ['CNPJ', 'RazaoSocial', 'UF', 'Modalidade']
+QUARTER_END_MONTH = {'1T': 3, '2T': 6, '3T': 9, '4T': 12}
+
+# snapshots já lidos neste processo: arquivo -> lookup (e o índice por CNPJ, se pedido)
+_loaded = {}
+_by_cnpj = {}
+
+
+def normalize_reg_ans(series):
+    """chave de junção do REG_ANS: sem espaços e sem zeros à esquerda ('00123 ' -> '123')"""
+    return series.astype(str).str.strip().str.lstrip('0')
+
+
+def normalize_cnpj(series):
+    """só os dígitos do CNPJ ('12.345.678/0001-90' -> '12345678000190')"""
+    return series.astype(str).str.replace(r'\D', '', regex=True)
+
+
+def build_cadop_frame(df_cadop):
+    """
+    monta a tabela de lookup do cadastro: um DataFrame indexado pela chave normalizada do REG_ANS
+    com as colunas CADOP_FIELDS, pronto pra ser usado num join vetorizado (sem iterrows)
+    """
+    df_cadop.columns = [c.upper().replace('_', '') for c in df_cadop.columns]
+
+    # udentificacao dinâmica das colunas
+    reg_col = next((c for c in df_cadop.columns if 'REGISTRO' in c), None)
+    cnpj_col = next((c for c in df_cadop.columns if 'CNPJ' in c), None)
+    razao_col = next((c for c in df_cadop.columns if 'RAZAO' in c), None)
+    uf_col = next((c for c in df_cadop.columns if 'UF' in c), None)
+    mod_col = next((c for c in df_cadop.columns if 'MODALIDADE' in c), None)
+
+    if not (reg_col and cnpj_col and razao_col):
+        print(f"[ERRO] Colunas chave não encontradas. Disp: {df_cadop.columns}")
+        return empty_cadop_frame()
+
+    lookup = pd.DataFrame({
+        'CNPJ': df_cadop[cnpj_col],
+        'RazaoSocial': df_cadop[razao_col],
+        'UF': df_cadop[uf_col] if uf_col else 'ND',
+        'Modalidade': df_cadop[mod_col] if mod_col else 'ND'
+    })
+    lookup.index = pd.Index(normalize_reg_ans(df_cadop[reg_col]), name='REG_ANS')
+
+    # registro repetido: vale o último, igual ao comportamento antigo do dicionário
+    return lookup[~lookup.index.duplicated(keep='last')]
+
+
+def empty_cadop_frame():
+    return pd.DataFrame(columns=CADOP_FIELDS, index=pd.Index([], name='REG_ANS'), dtype=object)
+
+
+def parse_cadop(content):
+    """bytes do Relatorio_cadop -> lookup (utf-8, com fallback pra latin-1)"""
+    try:
+        text = content.decode('utf-8-sig')
+        print("[CADASTRO] Detectado UTF-8.")
+    except UnicodeDecodeError:
+        print("[CADASTRO] Fallback para Latin-1.")
+        text = content.decode('latin-1')
+    return build_cadop_frame(pd.read_csv(io.StringIO(text), sep=';', dtype=str))
+
+
+def load_manifest(base_dir=None):
+    path = Path(base_dir or CADASTRO_DIR) / MANIFEST_FILE
+    if not path.exists():
+        return {"atual": None, "versoes": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, base_dir=None):
+    # grava num temporário e renomeia: o manifesto nunca fica pela metade
+    path = Path(base_dir or CADASTRO_DIR) / MANIFEST_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def snapshot_path(versao, base_dir=None):
+    return Path(base_dir or CADASTRO_DIR) / f"cadop_{versao}.{SNAPSHOT_FORMAT}"
+
+
+def write_snapshot(lookup, versao, base_dir=None):
+    """grava o lookup ordenado por REG_ANS (busca binária no índice depois de lido)"""
+    path = snapshot_path(versao, base_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    frame = lookup.sort_index().reset_index()
+    if SNAPSHOT_FORMAT == 'parquet':
+        frame.to_parquet(tmp_path, index=False)
+    else:
+        frame.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _valid_from(response, now):
+    # o cadastro vale a partir do Last-Modified da ANS; sem o cabeçalho, a partir do download
+    try:
+        return parsedate_to_datetime(response.headers['Last-Modified']).date().isoformat()
+    except (KeyError, TypeError, ValueError):
+        return now.date().isoformat()
+
+
+def refresh(url=CADASTRO_URL, session=None, base_dir=None, offline=None, max_age_hours=None):
+    """
+    garante um snapshot local atualizado e devolve a versão atual (None se nunca houve download)
+    só baixa e parseia o arquivo quando a ANS responde 200 com conteúdo diferente do que já temos
+    """
+    offline = OFFLINE if offline is None else offline
+    max_age_hours = MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    manifest = load_manifest(base_dir)
+    current = manifest['atual']
+    now = _utcnow()
+
+    if current and offline:
+        print(f"[CADASTRO] Offline: usando snapshot {current}.")
+        return current
+    checked = manifest.get('verificado_em')
+    if current and checked and (now - datetime.fromisoformat(checked)).total_seconds() < max_age_hours * 3600:
+        print(f"[CADASTRO] Snapshot {current} consultado há menos de {max_age_hours:g}h, sem consultar a ANS.")
+        return current
+    if offline:
+        print("[ERRO] Modo offline e nenhum snapshot do cadastro salvo.")
+        return None
+
+    headers = {}
+    if current:
+        if manifest.get('etag'):
+            headers['If-None-Match'] = manifest['etag']
+        if manifest.get('last_modified'):
+            headers['If-Modified-Since'] = manifest['last_modified']
+
+    http = session or requests
+    try:
+        r = http.get(url, headers=headers, timeout=TIMEOUT)
+        if r.status_code == 304:
+            print(f"[CADASTRO] 304: cadastro não mudou, snapshot {current}.")
+            manifest['verificado_em'] = now.isoformat()
+            save_manifest(manifest, base_dir)
+            return current
+        r.raise_for_status()
+    except requests.RequestException as e:
+        if current:
+            print(f"[WARN] Falha ao consultar o cadastro ({e}), usando snapshot {current}.")
+        else:
+            print(f"[ERRO] Falha no cadastro e nenhum snapshot salvo: {e}")
+        return current
+
+    versao = hashlib.sha256(r.content).hexdigest()[:16]
+    if versao != current and not any(v['versao'] == versao for v in manifest['versoes']):
+        lookup = parse_cadop(r.content)
+        if lookup.empty:
+            # arquivo fora do formato esperado: não substitui um snapshot bom
+            return current
+        write_snapshot(lookup, versao, base_dir)
+        manifest['versoes'].append({
+            'versao': versao,
+            'valido_desde': _valid_from(r, now),
+            'baixado_em': now.isoformat(),
+            'operadoras': len(lookup),
+        })
+        print(f"[CADASTRO] Novo snapshot {versao}: {len(lookup)} operadoras.")
+
+    manifest.update({
+        'atual': versao,
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+        'verificado_em': now.isoformat(),
+    })
+    save_manifest(manifest, base_dir)
+    return versao
+
+
+def load_lookup(versao=None, base_dir=None):
+    """lookup indexado por REG_ANS do snapshot (o atual se versao=None); lido do disco uma vez por processo"""
+    versao = versao or load_manifest(base_dir)['atual']
+    if versao is None:
+        return empty_cadop_frame()
+    path = snapshot_path(versao, base_dir)
+    if not path.exists():
+        # versão listada no cadastro.json mas sem o arquivo (apagado à mão, disco trocado...)
+        atual = load_manifest(base_dir)['atual']
+        if atual is None or atual == versao or not snapshot_path(atual, base_dir).exists():
+            raise FileNotFoundError(f"snapshot {versao} do cadastro não encontrado em {path}; "
+                                    f"apague {MANIFEST_FILE} pra baixar o cadastro de novo")
+        print(f"[WARN] Snapshot {versao} do cadastro não encontrado, usando o atual ({atual}).")
+        return load_lookup(atual, base_dir)
+    if path not in _loaded:
+        if SNAPSHOT_FORMAT == 'parquet':
+            frame = pd.read_parquet(path)
+        else:
+            # NA padrão: CNPJ/UF ausente continua ausente, igual ao snapshot em parquet
+            frame = pd.read_csv(path, dtype=str)
+        _loaded[path] = frame.set_index('REG_ANS')[CADOP_FIELDS]
+    return _loaded[path]
+
+
+def find_by_cnpj(cnpj, versao=None, base_dir=None):
+    """linhas do cadastro (REG_ANS + CADOP_FIELDS) com esse CNPJ, com ou sem pontuação"""
+    versao = versao or load_manifest(base_dir)['atual']
+    lookup = load_lookup(versao, base_dir)
+    # chave = arquivo do snapshot de fato carregado (o load_lookup pode ter caído no atual)
+    path = next((p for p, frame in _loaded.items() if frame is lookup), None)
+    index = _by_cnpj.get(path) if path is not None else None
+    if index is None:
+        index = lookup[lookup['CNPJ'].notna()].reset_index()
+        index.index = pd.Index(normalize_cnpj(index['CNPJ']), name='CNPJ_DIGITOS')
+        index = index.sort_index()
+        if path is not None:
+            _by_cnpj[path] = index
+    digits = normalize_cnpj(pd.Series([cnpj])).iloc[0]
+    if not digits:
+        return index.iloc[0:0].reset_index(drop=True)
+    # índice ordenado: busca binária em vez de comparar o CNPJ com todas as linhas
+    start, stop = index.index.searchsorted(digits, 'left'), index.index.searchsorted(digits, 'right')
+    return index.iloc[start:stop].reset_index(drop=True)
+
+
+def quarter_end(ano, trimestre):
+    month = QUARTER_END_MONTH[trimestre]
+    return date(int(ano), month, calendar.monthrange(int(ano), month)[1])
+
+
+def version_for_period(ano, trimestre, base_dir=None):
+    """
+    versão vigente no fim do trimestre: a última com valido_desde até essa data
+    (trimestre anterior ao primeiro snapshot usa o mais antigo que temos)
+    """
+    manifest = load_manifest(base_dir)
+    versoes = sorted(manifest['versoes'], key=lambda v: v['valido_desde'])
+    if not versoes:
+        return None
+    try:
+        fim = quarter_end(ano, trimestre).isoformat()
+    except (KeyError, ValueError):
+        # nome de zip fora do padrão (parse_quarter_name devolve '0000', '0T'): fica o atual
+        print(f"[WARN] Trimestre desconhecido ({ano}, {trimestre}), usando o snapshot atual do cadastro.")
+        return manifest['atual']
+    vigentes = [v for v in versoes if v['valido_desde'] <= fim]
+    return (vigentes[-1] if vigentes else versoes[0])['versao']
+
+
+def lookup_for_period(ano, trimestre, base_dir=None):
+    return load_lookup(version_for_period(ano, trimestre, base_dir), base_dir)
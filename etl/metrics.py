@@ -0,0 +1,341 @@
+"""
+instrumentação compartilhada das etapas do ETL
+
+- @metrics.instrument() nas funções importantes: cada chamada mede tempo, linhas de entrada/saída
+  (len do primeiro DataFrame recebido e do DataFrame devolvido), bytes lidos/escritos pelo processo
+  (/proc/self/io) e o pico de RSS durante a chamada
+- metrics.run_stage("2_processor", main) no __main__ de cada etapa: no fim grava um resumo por função
+  em JSON lines (ANS_METRICS_LOG) e, se configurado, um arquivo .prom no formato texto do Prometheus
+  (ANS_METRICS_PROM_DIR, pro textfile collector do node_exporter)
+- ANS_PROFILE=<etapa> roda só aquela etapa sob cProfile (ou pyinstrument com ANS_PROFILER=pyinstrument)
+
+os prints de progresso continuam; as métricas são o registro estruturado ao lado deles.
+em processos filhos (ProcessPool do processor) as chamadas são medidas mas ficam no processo filho
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import inspect
+import threading
+import functools
+from pathlib import Path
+from datetime import datetime, timezone
+
+import pandas as pd
+
+METRICS_LOG = os.getenv("ANS_METRICS_LOG", "data/logs/etl_metrics.jsonl") # vazio desliga
+PROM_DIR = os.getenv("ANS_METRICS_PROM_DIR", "") # ex: /var/lib/node_exporter/textfile
+VERBOSE = os.getenv("ANS_METRICS_VERBOSE", "0") == "1" # uma linha JSON por chamada (além do resumo)
+PROFILE_STAGE = os.getenv("ANS_PROFILE", "")
+PROFILER = os.getenv("ANS_PROFILER", "cprofile") # 'cprofile' ou 'pyinstrument'
+PROFILE_DIR = Path(os.getenv("ANS_PROFILE_DIR", "data/logs/profiles"))
+SAMPLE_INTERVAL = 0.01 # segundos entre amostras de RSS
+
+RUN_ID = uuid.uuid4().hex[:12]
+_stage = Path(sys.argv[0]).stem or "etl"
+_summary = {}
+_summary_lock = threading.Lock()
+
+
+# --- memória e I/O do processo ---
+
+def current_rss():
+    """RSS atual em bytes (Linux: /proc; nos outros POSIX, o pico do processo via getrusage; no Windows, 0)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource # só existe em POSIX
+    except ImportError:
+        return 0
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def io_counters():
+    """(bytes lidos, bytes escritos) pelo processo até agora; (None, None) fora do Linux"""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class _Sampler:
+    """
+    uma thread só amostra o RSS e atualiza o pico de todas as medições abertas
+    (evita subir uma thread por chamada em funções chamadas a cada chunk)
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss()
+            with self._lock:
+                for key in self._windows:
+                    self._windows[key] = max(self._windows[key], rss)
+
+    def open(self):
+        key = object()
+        with self._lock:
+            self._windows[key] = current_rss()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-rss", daemon=True)
+                self._thread.start()
+        return key
+
+    def close(self, key):
+        with self._lock:
+            return max(self._windows.pop(key), current_rss())
+
+
+_sampler = _Sampler()
+
+
+class PeakRSS:
+    """context manager: pico de RSS (bytes) enquanto o bloco roda"""
+
+    def __enter__(self):
+        self._key = _sampler.open()
+        self.peak = None
+        return self
+
+    def __exit__(self, *exc):
+        self.peak = _sampler.close(self._key)
+
+
+# --- medição ---
+
+def _rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+def _first_frame_rows(args, kwargs):
+    for value in list(args) + list(kwargs.values()):
+        rows = _rows(value)
+        if rows is not None:
+            return rows
+    return None
+
+
+class Measurement:
+    """uma chamada medida; rows_in/rows_out/bytes podem ser ajustados dentro do bloco"""
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_read = None
+        self.bytes_written = None
+
+    def __enter__(self):
+        self._io = io_counters()
+        self._rss = PeakRSS().__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        self._rss.__exit__()
+        read, written = io_counters()
+        if read is not None and self._io[0] is not None:
+            self.bytes_read = self.bytes_read if self.bytes_read is not None else read - self._io[0]
+            self.bytes_written = self.bytes_written if self.bytes_written is not None else written - self._io[1]
+        # GeneratorExit = quem consumia o gerador parou antes do fim, não é erro
+        failed = exc_type is not None and exc_type is not GeneratorExit
+        record(self, error=exc_type.__name__ if failed else None)
+
+
+def measure(name, rows_in=None):
+    """context manager para medir um trecho que não é uma função inteira"""
+    return Measurement(name, rows_in)
+
+
+def instrument(name=None, rows_out=_rows):
+    """
+    decorator: mede cada chamada da função (também funciona em geradores: mede a iteração
+    inteira e soma as linhas dos DataFrames produzidos). rows_out extrai as linhas do retorno
+    """
+    def decorator(func):
+        label = name or func.__name__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                with Measurement(label, _first_frame_rows(args, kwargs)) as m:
+                    m.rows_out = 0
+                    for item in func(*args, **kwargs):
+                        m.rows_out += rows_out(item) or 0
+                        yield item
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Measurement(label, _first_frame_rows(args, kwargs)) as m:
+                result = func(*args, **kwargs)
+                m.rows_out = rows_out(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+
+def record(m, error=None):
+    """acumula a chamada no resumo da etapa (e emite a linha JSON dela no modo verboso)"""
+    with _summary_lock:
+        s = _summary.setdefault(m.name, {
+            "calls": 0, "errors": 0, "seconds": 0.0, "rows_in": 0, "rows_out": 0,
+            "bytes_read": 0, "bytes_written": 0, "peak_rss_bytes": 0,
+        })
+        s["calls"] += 1
+        s["errors"] += 1 if error else 0
+        s["seconds"] += m.seconds
+        s["rows_in"] += m.rows_in or 0
+        s["rows_out"] += m.rows_out or 0
+        s["bytes_read"] += m.bytes_read or 0
+        s["bytes_written"] += m.bytes_written or 0
+        s["peak_rss_bytes"] = max(s["peak_rss_bytes"], m._rss.peak or 0)
+    if VERBOSE:
+        emit({
+            "event": "call", "function": m.name, "seconds": round(m.seconds, 6),
+            "rows_in": m.rows_in, "rows_out": m.rows_out, "bytes_read": m.bytes_read,
+            "bytes_written": m.bytes_written, "peak_rss_bytes": m._rss.peak, "error": error,
+        })
+
+
+def summary():
+    with _summary_lock:
+        return {name: dict(values) for name, values in _summary.items()}
+
+
+def reset():
+    with _summary_lock:
+        _summary.clear()
+
+
+# --- saída ---
+
+def emit(event, path=None):
+    """uma linha JSON no log de métricas (append; cada etapa/processo escreve as suas)"""
+    path = path if path is not None else METRICS_LOG
+    if not path:
+        return
+    line = {"ts": _now(), "run_id": RUN_ID, "stage": _stage, **event}
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+
+
+PROM_METRICS = [
+    # (nome, campo do resumo, tipo, ajuda)
+    ("ans_etl_function_calls_total", "calls", "counter", "Chamadas da função na última execução"),
+    ("ans_etl_function_errors_total", "errors", "counter", "Chamadas que terminaram com exceção"),
+    ("ans_etl_function_seconds_total", "seconds", "counter", "Tempo total gasto na função (s)"),
+    ("ans_etl_function_rows_in_total", "rows_in", "counter", "Linhas recebidas"),
+    ("ans_etl_function_rows_out_total", "rows_out", "counter", "Linhas devolvidas"),
+    ("ans_etl_function_bytes_read_total", "bytes_read", "counter", "Bytes lidos pelo processo durante a função"),
+    ("ans_etl_function_bytes_written_total", "bytes_written", "counter", "Bytes escritos pelo processo durante a função"),
+    ("ans_etl_function_peak_rss_bytes", "peak_rss_bytes", "gauge", "Pico de RSS do processo durante a função"),
+]
+
+
+def prometheus_text(stage, functions, stage_seconds, success):
+    lines = []
+    for metric, field, kind, help_text in PROM_METRICS:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for function, values in sorted(functions.items()):
+            lines.append(f'{metric}{{stage="{stage}",function="{function}"}} {values[field]}')
+    lines += [
+        "# HELP ans_etl_stage_seconds Duração da última execução da etapa",
+        "# TYPE ans_etl_stage_seconds gauge",
+        f'ans_etl_stage_seconds{{stage="{stage}"}} {stage_seconds:.6f}',
+        "# HELP ans_etl_stage_success 1 se a última execução terminou sem exceção",
+        "# TYPE ans_etl_stage_success gauge",
+        f'ans_etl_stage_success{{stage="{stage}"}} {int(success)}',
+        "# HELP ans_etl_stage_last_run_timestamp_seconds Fim da última execução (epoch)",
+        "# TYPE ans_etl_stage_last_run_timestamp_seconds gauge",
+        f'ans_etl_stage_last_run_timestamp_seconds{{stage="{stage}"}} {time.time():.0f}',
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(stage, functions, stage_seconds, success, prom_dir=None):
+    prom_dir = prom_dir if prom_dir is not None else PROM_DIR
+    if not prom_dir:
+        return None
+    target = Path(prom_dir) / f"ans_etl_{stage}.prom"
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # temporário + rename: o node_exporter nunca lê um arquivo pela metade
+    tmp = target.with_name(target.name + ".tmp")
+    tmp.write_text(prometheus_text(stage, functions, stage_seconds, success), encoding="utf-8")
+    os.replace(tmp, target)
+    return target
+
+
+# --- execução de uma etapa ---
+
+def _profiled(stage, func):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    if PROFILER == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return func()
+        finally:
+            profiler.stop()
+            target = PROFILE_DIR / f"{stage}.html"
+            target.write_text(profiler.output_html(), encoding="utf-8")
+            print(f"[PROFILE] {target}")
+
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func)
+    finally:
+        target = PROFILE_DIR / f"{stage}.prof"
+        profiler.dump_stats(target)
+        print(f"[PROFILE] {target} (top 15 por tempo acumulado)")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+
+def run_stage(stage, func):
+    """roda o main() de uma etapa e publica o resumo das métricas (JSON + Prometheus opcional)"""
+    global _stage
+    _stage = stage
+    reset()
+    emit({"event": "stage_start"})
+    success = False
+    total = Measurement(stage)
+    try:
+        with total:
+            result = _profiled(stage, func) if PROFILE_STAGE == stage else func()
+        success = True
+        return result
+    finally:
+        # o resumo sai mesmo se a etapa quebrar (é quando mais interessa)
+        functions = summary()
+        for function, values in functions.items():
+            emit({"event": "function_summary", "function": function, **values})
+        emit({"event": "stage_end", "seconds": round(total.seconds, 6), "success": success,
+              "peak_rss_bytes": total._rss.peak})
+        write_prometheus(stage, functions, total.seconds, success)
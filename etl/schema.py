@@ -0,0 +1,70 @@
+"""
+representação tipada do consolidado em memória, a mesma para as etapas 2, 3 e 4
+
+no arquivo (parquet/csv) as colunas continuam texto + VALOR decimal, que é o que o banco,
+o DuckDB e quem abre o csv esperam. em memória:
+- textos repetidos em todas as linhas (REG_ANS, CNPJ, RazaoSocial, UF, Modalidade, CONTA,
+  Trimestre) viram categóricas: um código inteiro por linha + o dicionário de valores
+  (na prática o par fato + dimensão, sem precisar de join)
+- Ano em int16
+- VALOR em float64; somas exatas passam por centavos inteiros (to_cents/from_cents)
+
+REG_ANS/CNPJ ficam como códigos de dicionário e não como inteiro puro pra não perder zero à esquerda
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+CONSOLIDADO_COLUMNS = ['REG_ANS', 'CNPJ', 'RazaoSocial', 'UF', 'Modalidade', 'Trimestre', 'Ano', 'VALOR', 'CONTA']
+PARTITION_COLUMNS = ['Ano', 'Trimestre']
+
+DTYPES = {
+    'REG_ANS': 'category',
+    'CNPJ': 'category',
+    'RazaoSocial': 'category',
+    'UF': 'category',
+    'Modalidade': 'category',
+    'Trimestre': 'category',
+    'CONTA': 'category',
+    'Ano': 'int16',
+    'VALOR': 'float64',
+}
+CATEGORICAL_COLUMNS = [col for col, dtype in DTYPES.items() if dtype == 'category']
+# colunas de texto: lidas como texto do csv e como dictionary do parquet (sem materializar as strings)
+TEXT_COLUMNS = [col for col in CATEGORICAL_COLUMNS if col not in PARTITION_COLUMNS]
+
+
+def compact(df):
+    """aplica os tipos compactos nas colunas presentes (in place; devolve o próprio df)"""
+    for col, dtype in DTYPES.items():
+        if col in df.columns and df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def concat(frames):
+    """
+    pd.concat que mantém as categóricas: blocos com dicionários diferentes (REG_ANS/CONTA de cada
+    trimestre) viram a união dos dicionários, sem passar por uma coluna de texto no meio
+    """
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return pd.DataFrame()
+    columns = {}
+    for col in frames[0].columns:
+        parts = [f[col] for f in frames]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            columns[col] = pd.Series(union_categoricals(parts))
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def to_cents(values):
+    """VALOR em reais -> centavos int64 (NaN conta como 0, como no sum do pandas)"""
+    values = np.asarray(values, dtype='float64')
+    return np.rint(np.nan_to_num(values) * 100).astype(np.int64)
+
+
+def from_cents(cents):
+    return np.asarray(cents, dtype=np.int64) / 100
@@ -0,0 +1,70 @@
+"""
+ledger de estado do ETL incremental (JSON em data/processed/etl_state.json)
+
+formato:
+{
+  "cadastro": "<fingerprint do lookup usado no enriquecimento>",
+  "quarters": {"2024_1T.zip": {"sha256": ..., "ano": "2024", "trimestre": "1T", "partition": "Ano=2024/Trimestre=1T/2024_1T.parquet"}},
+  "aggregated": {"2024_1T.zip": "<sha256 do zip já somado nas estatísticas>"},
+  "aggregated_with": {"cadastro": "<fingerprint do cadastro com que os totais do aggregated foram somados>",
+                      "regra": <DEDUP_RULE_VERSION da regra de duplicidade contábil usada>}
+}
+o processor só reprocessa zips novos/alterados e o aggregator só aplica os trimestres
+cujo hash ainda não entrou nos momentos (ver 3_aggregator.py); se o aggregated_with não bate
+com o estado atual (cadastro trocado ou regra nova), os totais guardados ficaram velhos e a agregação é refeita inteira
+"""
+import os
+import json
+import hashlib
+
+import pandas as pd
+
+import storage
+
+STATE_FILE = storage.PROCESSED_DIR / "etl_state.json"
+# desliga com ANS_INCREMENTAL=0 (reprocessa tudo sempre, como antes)
+INCREMENTAL = os.getenv("ANS_INCREMENTAL", "1") == "1"
+# versão da regra de duplicidade contábil (3_aggregator.py e serie_trimestral do loader);
+# subir quando a regra mudar: totais guardados com a regra antiga são refeitos
+# 4 = a serie_trimestral também descarta VALOR negativo/vazio antes da regra, como o clean_data
+# 3 = conta sem conta-mãe informada, por REG_ANS/trimestre; 2 agrupava por CNPJ
+# (1 era o filtro global pela conta '4')
+DEDUP_RULE_VERSION = 4
+
+
+def empty_state():
+    return {"cadastro": None, "quarters": {}, "aggregated": {}, "aggregated_with": {}}
+
+
+def load_state(path=STATE_FILE):
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return empty_state()
+    for key, value in empty_state().items():
+        state.setdefault(key, value)
+    return state
+
+
+def save_state(state, path=STATE_FILE):
+    # mesmo esquema do manifesto do crawler: temporário + rename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def frame_fingerprint(df):
+    """hash estável do conteúdo de um DataFrame (usado pro cadastro: mudou, reprocessa tudo)"""
+    hashed = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return hashlib.sha256(hashed.tobytes()).hexdigest()
@@ -0,0 +1,262 @@
+"""
+formato intermediário entre as etapas do ETL (processor -> aggregator -> loader)
+
+o consolidado pode ser gravado como:
+- 'parquet': dataset colunar particionado por Ano/Trimestre (data/processed/consolidado_despesas/Ano=2024/Trimestre=1T/...)
+  as etapas seguintes leem só as colunas e partições que precisam, sem re-inferir tipos
+- 'csv': o consolidado_despesas.csv de sempre (mantido para exportação/inspeção manual)
+"""
+import os
+import shutil
+import importlib.util
+from pathlib import Path
+
+import pandas as pd
+
+import schema
+
+PROCESSED_DIR = Path("data/processed")
+CONSOLIDADO_CSV = PROCESSED_DIR / "consolidado_despesas.csv"
+CONSOLIDADO_DATASET = PROCESSED_DIR / "consolidado_despesas"
+AGREGADO_CSV = PROCESSED_DIR / "despesas_agregadas.csv"
+AGREGADO_PARQUET = PROCESSED_DIR / "despesas_agregadas.parquet"
+# estado da agregação incremental: totais por operadora/trimestre e momentos por operadora
+TRIMESTRAIS_PARQUET = PROCESSED_DIR / "despesas_trimestrais.parquet"
+MOMENTOS_PARQUET = PROCESSED_DIR / "agregado_momentos.parquet"
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+# formato de troca entre as etapas: 'parquet' (padrão se o pyarrow estiver instalado) ou 'csv'
+DATA_FORMAT = os.getenv("ANS_DATA_FORMAT", "parquet" if HAS_PYARROW else "csv")
+
+# tipos em memória: etl/schema.py
+CONSOLIDADO_COLUMNS = schema.CONSOLIDADO_COLUMNS
+PARTITION_COLUMNS = schema.PARTITION_COLUMNS
+CATEGORICAL_COLUMNS = schema.CATEGORICAL_COLUMNS
+
+
+def _arrow_schema():
+    import pyarrow as pa
+    # Ano/Trimestre não vão dentro do arquivo, ficam no caminho da partição
+    return pa.schema([
+        ('REG_ANS', pa.string()),
+        ('CNPJ', pa.string()),
+        ('RazaoSocial', pa.string()),
+        ('UF', pa.string()),
+        ('Modalidade', pa.string()),
+        ('VALOR', pa.float64()),
+        ('CONTA', pa.string()),
+    ])
+
+
+def partition_path(base_dir, ano, trimestre):
+    return Path(base_dir) / f"Ano={ano}" / f"Trimestre={trimestre}"
+
+
+def write_partition(chunks, base_dir, ano, trimestre, part_name="part-0"):
+    """
+    grava um iterável de DataFrames (os chunks de um trimestre) como um arquivo parquet
+    dentro da partição Ano/Trimestre; cada chunk vira um row group, então a memória
+    continua limitada ao tamanho do chunk. retorna o número de linhas gravadas
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_schema = _arrow_schema()
+    target_dir = partition_path(base_dir, ano, trimestre)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    target = target_dir / f"{part_name}.parquet"
+    tmp_target = target.with_name(target.name + '.tmp')
+
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk[arrow_schema.names], schema=arrow_schema, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_target, arrow_schema, compression='snappy')
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if rows == 0:
+        if tmp_target.exists():
+            tmp_target.unlink()
+        if not any(target_dir.iterdir()):
+            target_dir.rmdir()
+        return 0
+
+    os.replace(tmp_target, target)
+    return rows
+
+
+def swap_dataset(staging_dir, final_dir):
+    """troca o dataset final pelo recém-gravado (renomeações, sem janela de dataset pela metade)"""
+    final_dir = Path(final_dir)
+    old_dir = final_dir.with_name(final_dir.name + '.old')
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    if final_dir.exists():
+        os.replace(final_dir, old_dir)
+    os.replace(staging_dir, final_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def partition_file(base_dir, ano, trimestre, part_name):
+    return partition_path(base_dir, ano, trimestre) / f"{part_name}.parquet"
+
+
+def remove_partition_file(base_dir, ano, trimestre, part_name):
+    target = partition_file(base_dir, ano, trimestre, part_name)
+    if target.exists():
+        target.unlink()
+    # limpa as pastas de partição que ficaram vazias
+    for folder in (target.parent, target.parent.parent):
+        if folder.exists() and not any(folder.iterdir()):
+            folder.rmdir()
+
+
+def merge_dataset(staging_dir, final_dir, replaced=()):
+    """
+    publicação incremental: move só os arquivos do staging para o dataset final,
+    mantendo as demais partições. 'replaced' lista (ano, trimestre, part_name) que
+    devem sair do dataset se não vierem no staging (trimestre reprocessado que agora veio vazio)
+    """
+    staging_dir, final_dir = Path(staging_dir), Path(final_dir)
+    moved = set()
+    for source in sorted(staging_dir.rglob('*.parquet')):
+        target = final_dir / source.relative_to(staging_dir)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, target)
+        moved.add(target)
+
+    for ano, trimestre, part_name in replaced:
+        if partition_file(final_dir, ano, trimestre, part_name) not in moved:
+            remove_partition_file(final_dir, ano, trimestre, part_name)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def apply_dtypes(df):
+    """tipos padronizados, iguais para os dois formatos (ver etl/schema.py)"""
+    return schema.compact(df)
+
+
+def consolidado_path(fmt=None):
+    fmt = fmt or DATA_FORMAT
+    return CONSOLIDADO_DATASET if fmt == 'parquet' else CONSOLIDADO_CSV
+
+
+def agregado_path(fmt=None):
+    fmt = fmt or DATA_FORMAT
+    return AGREGADO_PARQUET if fmt == 'parquet' else AGREGADO_CSV
+
+
+def read_consolidado(columns=None, filters=None, fmt=None, path=None):
+    """
+    lê o consolidado no formato configurado
+    columns: só as colunas necessárias (no parquet as outras nem são lidas do disco)
+    filters: filtros de partição no formato do pyarrow, ex: [('Ano', '=', 2024)]
+    """
+    fmt = fmt or DATA_FORMAT
+    path = path or consolidado_path(fmt)
+    if fmt == 'parquet':
+        # textos lidos direto como dictionary -> categórica: as strings de cada linha nunca existem em memória
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        dictionary = [c for c in schema.TEXT_COLUMNS if not columns or c in columns]
+        table = pq.read_table(path, columns=columns, filters=filters, read_dictionary=dictionary)
+        # self_destruct libera cada coluna do arrow assim que ela vira pandas (não ficam as duas cópias)
+        df = _from_parquet(table.to_pandas(self_destruct=True, split_blocks=True))
+        del table
+        # o alocador do arrow segura as páginas liberadas; devolve pro sistema depois da leitura grande
+        pa.default_memory_pool().release_unused()
+        return df
+
+    df = pd.read_csv(path, usecols=columns, dtype=_csv_dtypes(columns))
+    return apply_dtypes(df)
+
+
+def iter_consolidado(columns=None, batch_rows=100_000, filters=None, fmt=None, path=None):
+    """
+    mesmo conteúdo do read_consolidado, mas em lotes de até batch_rows linhas
+    (o arquivo/dataset nunca fica inteiro em memória)
+    """
+    fmt = fmt or DATA_FORMAT
+    path = path or consolidado_path(fmt)
+    if fmt == 'parquet':
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+        # mesmos tipos do read_consolidado: os textos já saem do arquivo como dictionary
+        dictionary = [c for c in schema.TEXT_COLUMNS if not columns or c in columns]
+        file_format = ds.ParquetFileFormat(read_options={'dictionary_columns': dictionary})
+        dataset = ds.dataset(path, format=file_format, partitioning='hive')
+        expression = pq.filters_to_expression(filters) if filters else None
+        for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_rows):
+            if batch.num_rows:
+                yield _from_parquet(batch.to_pandas())
+        return
+
+    for chunk in pd.read_csv(path, usecols=columns, dtype=_csv_dtypes(columns), chunksize=batch_rows):
+        chunk = apply_dtypes(chunk)
+        for col, _, value in filters or ():
+            chunk = chunk[chunk[col] == value]
+        if len(chunk):
+            yield chunk
+
+
+def list_quarters(fmt=None, path=None):
+    """pares (ano, trimestre) presentes no consolidado, em ordem"""
+    fmt = fmt or DATA_FORMAT
+    path = path or consolidado_path(fmt)
+    if fmt == 'parquet':
+        quarters = {
+            (int(t.parent.name.split('=', 1)[1]), t.name.split('=', 1)[1])
+            for t in Path(path).glob('Ano=*/Trimestre=*') if any(t.glob('*.parquet'))
+        }
+        return sorted(quarters)
+    df = pd.read_csv(path, usecols=PARTITION_COLUMNS, dtype={'Trimestre': str})
+    return sorted(set(zip(df['Ano'].astype(int), df['Trimestre'])))
+
+
+def _csv_dtypes(columns):
+    # o parser do csv já monta as categóricas (sem uma coluna de texto intermediária)
+    dtypes = {col: 'category' for col in schema.CATEGORICAL_COLUMNS}
+    return {k: v for k, v in dtypes.items() if not columns or k in columns}
+
+
+def _from_parquet(df):
+    # as colunas de partição chegam como dictionary (categórica de int32/texto); o schema converte direto
+    return apply_dtypes(df)
+
+
+def sample_consolidado(n=5, fmt=None, path=None):
+    """primeiras linhas do consolidado sem carregar o arquivo/dataset inteiro"""
+    fmt = fmt or DATA_FORMAT
+    path = path or consolidado_path(fmt)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        first = next(iter(sorted(Path(path).rglob('*.parquet'))), None)
+        if first is None:
+            return None
+        return pq.ParquetFile(first).read_row_group(0).to_pandas().head(n)
+    return pd.read_csv(path, nrows=n)
+
+
+def write_agregado(df, fmt=None):
+    fmt = fmt or DATA_FORMAT
+    AGREGADO_CSV.parent.mkdir(parents=True, exist_ok=True)
+    path = agregado_path(fmt)
+    if fmt == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False, float_format='%.2f')
+    return path
+
+
+def read_agregado(fmt=None):
+    fmt = fmt or DATA_FORMAT
+    path = agregado_path(fmt)
+    if not path.exists():
+        return None
+    return pd.read_parquet(path) if fmt == 'parquet' else pd.read_csv(path)
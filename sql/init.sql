@@ -15,20 +15,24 @@ CREATE TABLE IF NOT EXISTS dim_operadoras (
 
 CREATE INDEX idx_operadoras_uf ON dim_operadoras(uf);
 
+-- fato particionada (particionamento declarativo do postgres): RANGE por ano e, dentro de cada ano, LIST por trimestre
+-- fato_despesas -> fato_despesas_2024 -> fato_despesas_2024_1t
+-- as partições são criadas pelo 4_loader.py conforme os trimestres chegam; consultas por período só leem
+-- a partição do período (partition pruning) e aposentar um trimestre é um DETACH/DROP em vez de um DELETE enorme
 CREATE TABLE IF NOT EXISTS fato_despesas (
-    id SERIAL PRIMARY KEY,
-    registro_ans VARCHAR(10) REFERENCES dim_operadoras(registro_ans),
-    ano INTEGER,
-    trimestre VARCHAR(10),
+    id SERIAL,
+    registro_ans VARCHAR(10),
+    ano INTEGER NOT NULL,
+    trimestre VARCHAR(10) NOT NULL,
     conta VARCHAR(50),
     valor NUMERIC(18, 2), -- DECIMAL para precisao monetaria exata
     
-    -- constraint para garantir unicidade do registro se necessario
-    -- (aqui é opcional, dependendo da granularidade dos dados)
+    -- a PK de tabela particionada precisa conter as colunas de partição
+    PRIMARY KEY (id, ano, trimestre),
     CONSTRAINT fk_operadora FOREIGN KEY (registro_ans) REFERENCES dim_operadoras(registro_ans)
-);
+) PARTITION BY RANGE (ano);
 
--- indices para performance em queriees analiticas
+-- indices para performance em queriees analiticas (criados em cada partição automaticamente)
 CREATE INDEX idx_despesas_ano_trimestre ON fato_despesas(ano, trimestre);
 CREATE INDEX idx_despesas_conta ON fato_despesas(conta);
 
@@ -41,4 +45,48 @@ CREATE TABLE IF NOT EXISTS analise_agregada (
     media_trimestral NUMERIC(18, 2),
     desvio_padrao NUMERIC(18, 2),
     qtd_trimestres INTEGER
-);
\ No newline at end of file
+);
+
+-- série trimestral por operadora (Data Mart do gráfico de histórico)
+-- uma linha por operadora/trimestre em vez de todas as contas da fato; o 4_loader.py atualiza
+-- junto com a troca do trimestre na fato. total = soma das contas sem conta-mãe (prefixo próprio)
+-- informada no mesmo trimestre (a conta '4' quando existe; sem ela, '41' e '46' no lugar das filhas),
+-- mesmo critério do remove_accounting_duplication do aggregator
+-- grupos = subtotais das contas de 2 dígitos (41, 46, ...) quando informadas
+CREATE TABLE IF NOT EXISTS serie_trimestral (
+    registro_ans VARCHAR(10) NOT NULL,
+    ano INTEGER NOT NULL,
+    trimestre VARCHAR(10) NOT NULL,
+    total NUMERIC(18, 2),
+    qtd_lancamentos INTEGER,
+    grupos JSONB NOT NULL DEFAULT '{}',
+    -- INCLUDE (total): o gráfico é servido só pelo índice (index-only scan)
+    PRIMARY KEY (registro_ans, ano, trimestre) INCLUDE (total)
+);
+
+-- tabelas de staging da carga (4_loader.py)
+-- UNLOGGED: não passam pelo WAL, então o COPY nelas é bem mais rápido; o conteúdo é descartável
+-- cada trimestre entra aqui e depois troca de lugar com o da fato numa transação só
+CREATE UNLOGGED TABLE IF NOT EXISTS stg_operadoras (
+    registro_ans VARCHAR(10),
+    cnpj VARCHAR(20),
+    razao_social TEXT,
+    uf VARCHAR(2),
+    modalidade TEXT
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS stg_fato_despesas (
+    registro_ans VARCHAR(10),
+    ano INTEGER,
+    trimestre VARCHAR(10),
+    conta VARCHAR(50),
+    valor NUMERIC(18, 2)
+);
+
+-- versão dos dados: o 4_loader.py grava um carimbo novo a cada carga concluída
+-- a API usa isso pra invalidar o cache de respostas (backend/cache.py)
+CREATE TABLE IF NOT EXISTS etl_versao (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    versao TEXT NOT NULL,
+    carregado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+);
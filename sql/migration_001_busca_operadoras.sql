@@ -0,0 +1,11 @@
+-- migraçao 001: busca e paginaçao de /api/operadoras
+-- (roda depois do init.sql no docker; em banco já existente: psql -f sql/migration_001_busca_operadoras.sql)
+
+-- pg_trgm permite que ILIKE '%termo%' use índice GIN em vez de varrer a tabela inteira
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_operadoras_razao_trgm ON dim_operadoras USING gin (razao_social gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_operadoras_cnpj_trgm ON dim_operadoras USING gin (cnpj gin_trgm_ops);
+
+-- paginaçao keyset: ORDER BY razao_social, registro_ans + (razao_social, registro_ans) > (cursor)
+CREATE INDEX IF NOT EXISTS idx_operadoras_razao_registro ON dim_operadoras (razao_social, registro_ans);
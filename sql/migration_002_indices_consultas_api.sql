@@ -0,0 +1,15 @@
+-- migraçao 002: índices no formato das consultas da API
+-- (roda depois do init.sql no docker; em banco já existente: psql -f sql/migration_002_indices_consultas_api.sql)
+-- tests/test_query_plans.py confere via EXPLAIN que nenhuma rota cai em Seq Scan
+
+-- /api/operadoras/{reg}/despesas: WHERE registro_ans = :reg ORDER BY ano DESC, trimestre DESC
+-- o INCLUDE leva conta e valor junto, então a rota é respondida só pelo índice (index-only scan)
+CREATE INDEX IF NOT EXISTS idx_despesas_registro_periodo
+    ON fato_despesas (registro_ans, ano DESC, trimestre DESC) INCLUDE (conta, valor);
+
+-- /api/operadoras/{identificador}: WHERE registro_ans = :id OR cnpj = :id (antes o cnpj não tinha índice)
+CREATE INDEX IF NOT EXISTS idx_operadoras_cnpj ON dim_operadoras (cnpj);
+
+-- /api/estatisticas: ORDER BY valor_total DESC LIMIT 10
+-- obs: o 4_loader.py recria a analise_agregada a cada carga, então ele também recria este índice
+CREATE INDEX IF NOT EXISTS idx_agregada_valor_total ON analise_agregada (valor_total DESC);
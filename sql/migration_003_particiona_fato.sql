@@ -0,0 +1,62 @@
+-- migraçao 003: converte a fato_despesas antiga (uma tabela só) para a versão particionada do init.sql
+-- (roda depois do init.sql no docker; em banco já existente: psql -f sql/migration_003_particiona_fato.sql)
+-- se a fato já é particionada (banco criado com o init.sql novo) não faz nada
+-- os dados são copiados numa transação só; em base grande rode numa janela de manutenção
+
+DO $$
+DECLARE
+    periodo RECORD;
+    idx RECORD;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('fato_despesas')) IS DISTINCT FROM 'r' THEN
+        RAISE NOTICE 'fato_despesas já particionada (ou inexistente), nada a fazer';
+        RETURN;
+    END IF;
+
+    -- tabela antiga sai do caminho; os nomes dos índices são globais, então renomeia eles também
+    ALTER TABLE fato_despesas RENAME TO fato_despesas_legado;
+    FOR idx IN SELECT indexname FROM pg_indexes WHERE tablename = 'fato_despesas_legado' LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.indexname, idx.indexname || '_legado');
+    END LOOP;
+
+    -- mesma definição do init.sql (reaproveita a sequence do id antigo)
+    CREATE TABLE fato_despesas (
+        id INTEGER NOT NULL DEFAULT nextval('fato_despesas_id_seq'),
+        registro_ans VARCHAR(10),
+        ano INTEGER NOT NULL,
+        trimestre VARCHAR(10) NOT NULL,
+        conta VARCHAR(50),
+        valor NUMERIC(18, 2),
+        PRIMARY KEY (id, ano, trimestre),
+        CONSTRAINT fk_operadora FOREIGN KEY (registro_ans) REFERENCES dim_operadoras(registro_ans)
+    ) PARTITION BY RANGE (ano);
+    ALTER SEQUENCE fato_despesas_id_seq OWNED BY fato_despesas.id;
+
+    CREATE INDEX idx_despesas_ano_trimestre ON fato_despesas(ano, trimestre);
+    CREATE INDEX idx_despesas_conta ON fato_despesas(conta);
+    CREATE INDEX idx_despesas_registro_periodo
+        ON fato_despesas (registro_ans, ano DESC, trimestre DESC) INCLUDE (conta, valor);
+
+    -- mesmas partições que o 4_loader.py cria: fato_despesas_<ano> e fato_despesas_<ano>_<trimestre>
+    FOR periodo IN
+        SELECT DISTINCT ano, trimestre FROM fato_despesas_legado
+        WHERE ano IS NOT NULL AND trimestre IS NOT NULL ORDER BY ano, trimestre
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF fato_despesas FOR VALUES FROM (%s) TO (%s) PARTITION BY LIST (trimestre)',
+            'fato_despesas_' || periodo.ano, periodo.ano, periodo.ano + 1
+        );
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES IN (%L)',
+            'fato_despesas_' || periodo.ano || '_' || lower(periodo.trimestre), 'fato_despesas_' || periodo.ano, periodo.trimestre
+        );
+    END LOOP;
+
+    INSERT INTO fato_despesas (id, registro_ans, ano, trimestre, conta, valor)
+    SELECT id, registro_ans, ano, trimestre, conta, valor
+    FROM fato_despesas_legado
+    WHERE ano IS NOT NULL AND trimestre IS NOT NULL;
+
+    DROP TABLE fato_despesas_legado;
+END
+$$;
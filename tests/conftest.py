@@ -0,0 +1,28 @@
+import sys
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+ETL_DIR = Path(__file__).resolve().parent.parent / "etl"
+
+# os scripts do ETL rodam como "python etl/X.py", então os módulos compartilhados
+# são importados a partir da própria pasta etl/
+if str(ETL_DIR) not in sys.path:
+    sys.path.insert(0, str(ETL_DIR))
+
+
+def _load_stage(filename):
+    """carrega um script do ETL (ex: '1_downloader.py') como módulo, já que o nome começa com dígito"""
+    path = ETL_DIR / filename
+    spec = importlib.util.spec_from_file_location(f"etl_{path.stem}", path)
+    module = importlib.util.module_from_spec(spec)
+    # registrado em sys.modules pra funções do módulo poderem ser enviadas a um ProcessPool
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def etl_stage():
+    return _load_stage
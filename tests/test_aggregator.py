@@ -0,0 +1,84 @@
+import pandas as pd
+
+
+def test_dedup_por_operadora_e_trimestre(etl_stage):
+    aggregator = etl_stage("3_aggregator.py")
+    df = pd.DataFrame({
+        'REG_ANS': ['1'] * 4 + ['2'] * 4 + ['1'] * 2,
+        'CNPJ': ['A'] * 4 + ['B'] * 4 + ['A'] * 2,
+        'Ano': [2024] * 10,
+        'Trimestre': ['1T'] * 8 + ['2T'] * 2,
+        'CONTA': ['4', '41', '411', '46', '41', '411', '461', '31', '411', '4111'],
+        'VALOR': range(10),
+    })
+    out = aggregator.remove_accounting_duplication(df)
+
+    contas = out.groupby(['CNPJ', 'Trimestre'])['CONTA'].apply(sorted).to_dict()
+    # A/1T tem o total '4'; B só reportou analíticas e não some mais (fica a mais sintética de cada ramo)
+    assert contas == {('A', '1T'): ['4'], ('B', '1T'): ['41', '461'], ('A', '2T'): ['411']}
+
+
+def test_dedup_nao_mistura_registros_do_mesmo_cnpj(etl_stage):
+    aggregator = etl_stage("3_aggregator.py")
+    # dois registros ANS com o mesmo CNPJ: o '4' do 1 não derruba as analíticas do 2
+    df = pd.DataFrame({
+        'REG_ANS': ['1', '1', '2', '2'], 'CNPJ': 'A', 'Ano': 2024, 'Trimestre': '1T',
+        'CONTA': ['4', '41', '41', '46'], 'VALOR': [10.0, 6.0, 3.0, 2.0],
+    })
+    out = aggregator.remove_accounting_duplication(df)
+    assert out.groupby('REG_ANS')['VALOR'].sum().to_dict() == {'1': 10.0, '2': 5.0}
+
+
+def test_hierarquia_com_niveis_pulados(etl_stage):
+    aggregator = etl_stage("3_aggregator.py")
+    import numpy as np
+    group = np.array([0, 0, 0, 1, 1])
+    contas = np.array(['41', '41111', '46', '4111'], dtype=object)
+    codes = np.array([0, 1, 2, 1, 3])
+    # 41111 descende de 41 (grupo 0) e de 4111 (grupo 1), mesmo sem os níveis do meio
+    assert aggregator.has_ancestor_account(group, codes, contas).tolist() == [False, True, False, True, False]
+
+
+def test_serie_trimestral_usa_a_mesma_regra(etl_stage, tmp_path):
+    """o total da /serie (SQL do loader no Postgres e view do DuckDB) bate com o do aggregator"""
+    import pytest
+    import storage
+    from sqlalchemy import text
+    from backend import duckdb_store
+    duckdb = pytest.importorskip("duckdb")
+    aggregator = etl_stage("3_aggregator.py")
+    loader = etl_stage("4_loader.py")
+
+    contas = [('4', 10.5), ('41', 6.25), ('411', 3.0), ('46', 4.25),  # 1: só o '4'
+              ('41', 7.0), ('411', 2.5), ('461', 1.75)]                 # 2: '41' + '461'
+    df = pd.DataFrame({
+        'REG_ANS': ['1'] * 4 + ['2'] * 3, 'CNPJ': 'A', # mesmo CNPJ, registros diferentes
+        'RazaoSocial': 'OP', 'UF': 'SP', 'Modalidade': 'Cooperativa',
+        'Trimestre': '1T', 'Ano': 2099,
+        'CONTA': [c for c, _ in contas], 'VALOR': [v for _, v in contas],
+    })
+    esperado = aggregator.remove_accounting_duplication(df.copy()).groupby('REG_ANS')['VALOR'].sum().to_dict()
+    assert esperado == {'1': 10.5, '2': 8.75}
+
+    storage.write_partition([df], tmp_path / "consolidado_despesas", 2099, '1T')
+    pd.DataFrame(columns=['RazaoSocial', 'UF', 'Valor_Total', 'Media_Trimestral', 'Desvio_Padrao', 'Qtd_Trimestres']).to_parquet(tmp_path / "despesas_agregadas.parquet")
+    conn = duckdb.connect(":memory:")
+    duckdb_store.create_views(conn, tmp_path)
+    assert dict(conn.execute("SELECT registro_ans, total FROM serie_trimestral").fetchall()) == esperado
+
+    try:
+        pg = loader.get_engine().connect()
+    except Exception:
+        return # sem Postgres: só a view do DuckDB
+    with pg:
+        tx = pg.begin()
+        try:
+            pg.execute(text("CREATE TEMP TABLE fato_regra (registro_ans VARCHAR, ano INT, trimestre VARCHAR, conta VARCHAR, valor NUMERIC)"))
+            for _, row in df.iterrows():
+                pg.execute(text("INSERT INTO fato_regra VALUES (:r, 2099, '1T', :c, :v)"),
+                           {'r': row['REG_ANS'], 'c': row['CONTA'], 'v': row['VALOR']})
+            loader.refresh_serie_trimestral(pg, source='fato_regra', periodos=[(2099, '1T')])
+            totais = pg.execute(text("SELECT registro_ans, total FROM serie_trimestral WHERE ano = 2099")).all()
+            assert {reg: float(total) for reg, total in totais} == esperado
+        finally:
+            tx.rollback()
@@ -1,8 +1,16 @@
+import json
+import pytest
 from fastapi.testclient import TestClient
 from backend.main import app
 
 client = TestClient(app)
 
+@pytest.fixture(scope="module", autouse=True)
+def event_loop_unico():
+    """mantém um único event loop para o módulo (o pool async do asyncpg fica preso ao loop que o criou)"""
+    with client:
+        yield
+
 def test_read_main():
     """teste pra verificar se a API inicia e a documentação tá acessível!"""
     response = client.get("/docs")
@@ -29,4 +37,95 @@ def test_busca_inexistente():
     """Testa busca por algo que nao existe (deve retornar lista vazia, e nao um erro)"""
     response = client.get("/api/operadoras?search=XPTO_NAO_EXISTE")
     assert response.status_code == 200
-    assert len(response.json()["data"]) == 0
\ No newline at end of file
+    assert len(response.json()["data"]) == 0
+
+def test_paginacao_por_cursor():
+    """percorre a listagem via next_cursor e confere que bate com a paginação por página"""
+    por_pagina = client.get("/api/operadoras?page=1&limit=4").json()["data"]
+
+    primeira = client.get("/api/operadoras?limit=2&count=none").json()
+    assert primeira["total"] is None
+    vistos = primeira["data"]
+    if primeira["next_cursor"]:
+        segunda = client.get(f"/api/operadoras?limit=2&cursor={primeira['next_cursor']}").json()
+        vistos += segunda["data"]
+
+    assert [o["registro_ans"] for o in vistos] == [o["registro_ans"] for o in por_pagina]
+
+def test_contagem_estimada():
+    response = client.get("/api/operadoras?limit=5&count=estimated")
+    assert response.status_code == 200
+    json_data = response.json()
+    assert json_data["total_estimado"] is True
+    assert isinstance(json_data["total"], int)
+
+def test_cursor_invalido():
+    response = client.get("/api/operadoras?cursor=nao-e-um-cursor")
+    assert response.status_code == 400
+
+def test_estatisticas_cache_etag():
+    """segunda chamada com If-None-Match da ETag recebida deve voltar 304 sem corpo"""
+    primeira = client.get("/api/estatisticas")
+    etag = primeira.headers["etag"]
+    assert "max-age" in primeira.headers["cache-control"]
+
+    revalidada = client.get("/api/estatisticas", headers={"If-None-Match": etag})
+    assert revalidada.status_code == 304
+    assert revalidada.content == b""
+
+def test_cache_nao_guarda_erro():
+    """404 passa direto (sem ETag) e não fica no cache"""
+    response = client.get("/api/operadoras/XPTO_NAO_EXISTE")
+    assert response.status_code == 404
+    assert "etag" not in response.headers
+
+def test_serie_trimestral():
+    """série do gráfico: no máximo uma linha por trimestre, mais recente primeiro"""
+    operadoras = client.get("/api/operadoras?limit=1").json()["data"]
+    if not operadoras:
+        pytest.skip("banco sem operadoras carregadas")
+    reg = operadoras[0]["registro_ans"]
+
+    serie = client.get(f"/api/operadoras/{reg}/serie").json()
+    periodos = [(p["ano"], p["trimestre"]) for p in serie]
+    assert len(periodos) == len(set(periodos))
+    assert periodos == sorted(periodos, reverse=True)
+
+    com_grupos = client.get(f"/api/operadoras/{reg}/serie?grupos=true").json()
+    assert all(isinstance(p["grupos"], dict) for p in com_grupos)
+
+def test_export_ndjson():
+    response = client.get("/api/export/despesas?ano=2024")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    linhas = [json.loads(l) for l in response.text.splitlines()]
+    assert all(l["ano"] == 2024 for l in linhas)
+    assert all(isinstance(l["valor"], (int, float)) or l["valor"] is None for l in linhas)
+
+def test_export_csv_com_filtro_vazio():
+    """filtro sem resultado ainda devolve o cabeçalho do csv"""
+    response = client.get("/api/export/despesas?formato=csv&ano=1900")
+    assert response.status_code == 200
+    assert response.text.splitlines() == ["registro_ans,cnpj,razao_social,uf,modalidade,ano,trimestre,conta,valor"]
+
+def test_operadoras_em_lote():
+    """mistura registro e CNPJ; o que não existe volta explícito como null"""
+    operadora = client.get("/api/operadoras?limit=1").json()["data"]
+    if not operadora:
+        pytest.skip("banco sem operadoras carregadas")
+    op = operadora[0]
+    ids = [op["registro_ans"], "XPTO_NAO_EXISTE"] + ([op["cnpj"]] if op["cnpj"] else [])
+
+    response = client.post("/api/operadoras/batch", json={"ids": ids, "incluir_ultimo_trimestre": True})
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body["operadoras"]) == set(ids)
+    assert body["operadoras"][op["registro_ans"]]["registro_ans"] == op["registro_ans"]
+    assert body["operadoras"]["XPTO_NAO_EXISTE"] is None
+    assert body["nao_encontrados"] == ["XPTO_NAO_EXISTE"]
+    if op["cnpj"]:
+        assert body["operadoras"][op["cnpj"]]["registro_ans"] == op["registro_ans"]
+
+def test_operadoras_em_lote_limite():
+    response = client.post("/api/operadoras/batch", json={"ids": [str(i) for i in range(1001)]})
+    assert response.status_code == 422
@@ -0,0 +1,38 @@
+import asyncio
+
+from backend.cache import TTLCache, DataVersion
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_lru_e_expiracao():
+    clock = FakeClock()
+    cache = TTLCache(max_entries=2, ttl=10, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1 # 'a' vira o mais recente
+    cache.set('c', 3) # expulsa 'b' (o menos usado)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    clock.now = 11
+    assert cache.get('a') is None
+    assert len(cache) == 1
+
+
+def test_versao_consultada_no_maximo_por_intervalo():
+    clock = FakeClock()
+    leituras = iter(['v1', 'v2'])
+    version = DataVersion(lambda: next(leituras), interval=5, clock=clock)
+
+    assert asyncio.run(version.current()) == 'v1'
+    clock.now = 4
+    assert asyncio.run(version.current()) == 'v1' # ainda dentro do intervalo, não vai no banco
+    clock.now = 5
+    assert asyncio.run(version.current()) == 'v2'
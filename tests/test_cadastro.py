@@ -0,0 +1,138 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import cadastro
+
+CSV_V1 = "Registro_ANS;CNPJ;Razao_Social;UF;Modalidade\n000789;22.222.222/0001-22;OP B;RJ;Autogestão\n123456;111;OP A;SP;Cooperativa\n"
+CSV_V2 = "Registro_ANS;CNPJ;Razao_Social;UF;Modalidade\n123456;111;OP A NOVA;MG;Cooperativa\n"
+
+
+class CadopHandler(BaseHTTPRequestHandler):
+    """stand-in do dadosabertos: serve o Relatorio_cadop em latin-1 com ETag/Last-Modified"""
+    body = CSV_V1
+    last_modified = "Mon, 01 Jan 2024 00:00:00 GMT"
+    statuses = []
+
+    def do_GET(self):
+        etag = f'"{hash(CadopHandler.body)}"'
+        if self.headers.get('If-None-Match') == etag:
+            CadopHandler.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        CadopHandler.statuses.append(200)
+        data = CadopHandler.body.encode('latin-1')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', CadopHandler.last_modified)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    CadopHandler.body, CadopHandler.statuses = CSV_V1, []
+    CadopHandler.last_modified = "Mon, 01 Jan 2024 00:00:00 GMT"
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), CadopHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}/Relatorio_cadop.csv"
+    httpd.shutdown()
+
+
+def test_snapshot_reaproveitado_com_304(server, tmp_path):
+    versao = cadastro.refresh(server, base_dir=tmp_path, max_age_hours=0)
+    assert cadastro.snapshot_path(versao, tmp_path).exists()
+
+    # dentro do max_age nem consulta; depois dele, GET condicional -> 304 e mesma versão
+    assert cadastro.refresh(server, base_dir=tmp_path, max_age_hours=1) == versao
+    assert cadastro.refresh(server, base_dir=tmp_path, max_age_hours=0) == versao
+    assert CadopHandler.statuses == [200, 304]
+
+    lookup = cadastro.load_lookup(versao, base_dir=tmp_path)
+    assert list(lookup.index) == ['123456', '789']
+    assert lookup.loc['789', 'Modalidade'] == 'Autogestão'
+    achado = cadastro.find_by_cnpj('22222222000122', versao, base_dir=tmp_path)
+    assert list(achado['REG_ANS']) == ['789']
+
+
+def test_sem_rede_usa_ultimo_snapshot(server, tmp_path, capsys):
+    versao = cadastro.refresh(server, base_dir=tmp_path)
+    assert cadastro.refresh("http://127.0.0.1:1/x.csv", base_dir=tmp_path, max_age_hours=0) == versao
+    assert "usando snapshot" in capsys.readouterr().out
+    assert cadastro.refresh(server, base_dir=tmp_path, offline=True) == versao
+
+    vazio = tmp_path / "vazio"
+    assert cadastro.refresh(server, base_dir=vazio, offline=True) is None
+    assert cadastro.load_lookup(None, base_dir=vazio).empty
+
+
+def test_versao_vigente_por_trimestre(server, tmp_path):
+    v1 = cadastro.refresh(server, base_dir=tmp_path)
+    CadopHandler.body, CadopHandler.last_modified = CSV_V2, "Mon, 01 Jul 2024 00:00:00 GMT"
+    v2 = cadastro.refresh(server, base_dir=tmp_path, max_age_hours=0)
+
+    assert v2 != v1 and cadastro.load_manifest(tmp_path)['atual'] == v2
+    assert cadastro.version_for_period(2023, '4T', tmp_path) == v1  # antes do primeiro snapshot: o mais antigo
+    assert cadastro.version_for_period(2024, '2T', tmp_path) == v1
+    assert cadastro.version_for_period(2024, '3T', tmp_path) == v2
+    assert cadastro.lookup_for_period(2024, '1T', tmp_path).loc['123456', 'UF'] == 'SP'
+    # zip com nome fora do padrão (parse_quarter_name devolve '0000', '0T'): snapshot atual
+    assert cadastro.version_for_period("0000", '0T', tmp_path) == v2
+
+
+def test_snapshot_sumido_do_disco(server, tmp_path, capsys):
+    v1 = cadastro.refresh(server, base_dir=tmp_path)
+    CadopHandler.body, CadopHandler.last_modified = CSV_V2, "Mon, 01 Jul 2024 00:00:00 GMT"
+    v2 = cadastro.refresh(server, base_dir=tmp_path, max_age_hours=0)
+
+    # versão antiga sem arquivo: cai no snapshot atual
+    cadastro.snapshot_path(v1, tmp_path).unlink()
+    assert cadastro.load_lookup(v1, base_dir=tmp_path).loc['123456', 'RazaoSocial'] == 'OP A NOVA'
+    assert f"Snapshot {v1} do cadastro não encontrado" in capsys.readouterr().out
+
+    # sem o atual não tem pra onde cair: erro dizendo o que fazer
+    cadastro.snapshot_path(v2, tmp_path).unlink()
+    with pytest.raises(FileNotFoundError, match="cadastro.json"):
+        cadastro.load_lookup(v2, base_dir=tmp_path)
+
+
+def test_processor_enriquece_pelo_snapshot(etl_stage, server, tmp_path, monkeypatch):
+    processor = etl_stage("2_processor.py")
+    monkeypatch.setattr(cadastro, "CADASTRO_DIR", tmp_path)
+    monkeypatch.setattr(processor, "CADASTRO_URL", server)
+    cadastro.refresh(server)
+    CadopHandler.body, CadopHandler.last_modified = CSV_V2, "Mon, 01 Jul 2024 00:00:00 GMT"
+    cadastro.refresh(server, max_age_hours=0)
+
+    # offline: startup sem rede, direto do snapshot atual
+    monkeypatch.setattr(cadastro, "OFFLINE", True)
+    cadop_map = processor.get_cadop_map()
+    assert cadop_map.loc['123456', 'RazaoSocial'] == 'OP A NOVA'
+    assert CadopHandler.statuses == [200, 200]
+
+    df = pd.DataFrame({'REG_ANS': ['123456'], 'VALOR': ['1']})
+    assert processor.cadop_for_quarter(cadop_map, 2024, '1T') is cadop_map
+    monkeypatch.setattr(cadastro, "HISTORICAL", True)
+    antigo = processor.cadop_for_quarter(cadop_map, 2024, '1T')
+    assert processor.enrich_with_cadastro(df, antigo).loc[0, 'RazaoSocial'] == 'OP A'
+
+
+def test_snapshot_csv_mantem_cnpj_ausente(tmp_path, monkeypatch):
+    monkeypatch.setattr(cadastro, "SNAPSHOT_FORMAT", "csv")
+    lookup = cadastro.parse_cadop("Registro_ANS;CNPJ;Razao_Social;UF\n1;;SEM CNPJ;SP\n2;33.333.333/0001-33;OP C;\n".encode())
+    cadastro.write_snapshot(lookup, "v1", tmp_path)
+
+    lido = cadastro.load_lookup("v1", base_dir=tmp_path)
+    assert lido['CNPJ'].isna().tolist() == [True, False]
+    assert pd.isna(lido.loc['2', 'UF'])
+    assert cadastro.find_by_cnpj('', "v1", base_dir=tmp_path).empty
+    assert cadastro.find_by_cnpj('44444444000144', "v1", base_dir=tmp_path).empty
+    assert list(cadastro.find_by_cnpj('33.333.333/0001-33', "v1", base_dir=tmp_path)['REG_ANS']) == ['2']
@@ -0,0 +1,85 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+PAGES = {
+    "/": '<a href="2023/">2023/</a><a href="2024/">2024/</a><a href="leia.txt">leia</a>',
+    "/2024/": '<a href="1T2024.zip">1T2024.zip</a><a href="2T2024.zip">2T2024.zip</a>',
+    "/2023/": '<a href="4T/">4T/</a><a href="3T/">3T/</a>',
+}
+
+
+class IndexHandler(BaseHTTPRequestHandler):
+    """stand-in local do FTP da ANS: serve os índices com ETag e responde 304 quando nada mudou"""
+    statuses = []
+
+    def do_GET(self):
+        body = PAGES.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = f'"{hash(body)}"'
+        if self.headers.get('If-None-Match') == etag:
+            IndexHandler.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        IndexHandler.statuses.append(200)
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    IndexHandler.statuses = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), IndexHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}/"
+    httpd.shutdown()
+
+
+def test_segunda_execucao_usa_304(etl_stage, server, tmp_path):
+    downloader = etl_stage("1_downloader.py")
+    manifest_path = tmp_path / "manifest.json"
+
+    manifest = downloader.load_manifest(manifest_path)
+    primeira = downloader.find_latest_quarters(server, limit=3, manifest=manifest)
+    downloader.save_manifest(manifest, manifest_path)
+    assert IndexHandler.statuses == [200, 200, 200]
+
+    IndexHandler.statuses = []
+    manifest = downloader.load_manifest(manifest_path)
+    segunda = downloader.find_latest_quarters(server, limit=3, manifest=manifest)
+
+    assert IndexHandler.statuses == [304, 304, 304]
+    assert segunda == primeira
+    assert [(q['ano'], q['trimestre'], q['type']) for q in segunda] == [
+        ('2024', '2T', 'file'), ('2024', '1T', 'file'), ('2023', '4T', 'folder')
+    ]
+
+
+def test_pagina_alterada_e_reparseada(etl_stage, server, tmp_path):
+    downloader = etl_stage("1_downloader.py")
+    manifest = {}
+    downloader.get_links(server + "2024/", manifest=manifest)
+
+    PAGES["/2024/"] += '<a href="3T2024.zip">3T2024.zip</a>'
+    try:
+        links = downloader.get_links(server + "2024/", manifest=manifest)
+    finally:
+        PAGES["/2024/"] = PAGES["/2024/"].replace('<a href="3T2024.zip">3T2024.zip</a>', '')
+
+    assert IndexHandler.statuses == [200, 200]
+    assert "3T2024.zip" in links
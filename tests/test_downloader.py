@@ -0,0 +1,78 @@
+import io
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def make_zip_bytes():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as z:
+        z.writestr("1T2024.csv", "REG_ANS;CD_CONTA_CONTABIL;VL_SALDO_FINAL\n" * 2000)
+    return buf.getvalue()
+
+
+PAYLOAD = make_zip_bytes()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """servidor local que imita o FTP da ANS servindo um zip com suporte a Range"""
+    requests_seen = []
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        RangeHandler.requests_seen.append(rng)
+        if rng:
+            start = int(rng.split('=')[1].split('-')[0])
+            body = PAYLOAD[start:]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}')
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    RangeHandler.requests_seen = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+def test_download_atomico(etl_stage, server, tmp_path):
+    """o arquivo final só aparece completo e sem sobrar o .part"""
+    downloader = etl_stage("1_downloader.py")
+    save_path = tmp_path / "2024_1T.zip"
+
+    assert downloader.download_file(f"{server}/1T2024.zip", save_path)
+    assert save_path.read_bytes() == PAYLOAD
+    assert not (tmp_path / "2024_1T.zip.part").exists()
+
+
+def test_download_retoma_com_range(etl_stage, server, tmp_path):
+    """um .part deixado por uma execução interrompida é completado via HTTP Range"""
+    downloader = etl_stage("1_downloader.py")
+    save_path = tmp_path / "2024_1T.zip"
+    (tmp_path / "2024_1T.zip.part").write_bytes(PAYLOAD[:1000])
+
+    assert downloader.download_file(f"{server}/1T2024.zip", save_path)
+    assert save_path.read_bytes() == PAYLOAD
+    assert RangeHandler.requests_seen == ['bytes=1000-']
+
+
+def test_zip_truncado_nao_conta_como_baixado(etl_stage, tmp_path):
+    downloader = etl_stage("1_downloader.py")
+    truncado = tmp_path / "2024_1T.zip"
+    truncado.write_bytes(PAYLOAD[:1000])
+
+    assert not downloader.is_complete(truncado)
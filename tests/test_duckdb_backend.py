@@ -0,0 +1,72 @@
+"""
+backend DuckDB (ANS_DB_BACKEND=duckdb): roda o tests/test_api.py inteiro contra os arquivos
+processados, num dataset pequeno montado com o próprio etl/storage.py
+(subprocesso porque o backend é escolhido na importação do backend.database)
+"""
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import storage
+
+ROOT = Path(__file__).resolve().parent.parent
+pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+
+def build_processed_dir(base):
+    operadoras = [
+        ('100001', '11111111000101', 'ALFA SAUDE', 'SP', 'Medicina de Grupo'),
+        ('100002', '22222222000102', 'BETA ODONTO', 'RJ', 'Odontologia de Grupo'),
+        ('100003', '33333333000103', 'GAMA COOPERATIVA', 'MG', 'Cooperativa Médica'),
+        ('100004', '44444444000104', 'DELTA AUTOGESTAO', 'SP', 'Autogestão'),
+        ('100005', None, 'EPSILON SEGUROS', 'PR', 'Seguradora'),
+    ]
+    linhas = []
+    for i, (reg, cnpj, razao, uf, modalidade) in enumerate(operadoras, start=1):
+        for trimestre in ('1T', '2T'):
+            for conta, valor in (('4', 1000.0 * i), ('41', 600.0 * i), ('46', 400.0 * i)):
+                linhas.append((reg, cnpj, razao, uf, modalidade, trimestre, 2024, valor, conta))
+    df = pd.DataFrame(linhas, columns=storage.CONSOLIDADO_COLUMNS)
+
+    dataset = base / "consolidado_despesas"
+    for trimestre, grupo in df.groupby('Trimestre'):
+        storage.write_partition([grupo], dataset, 2024, trimestre)
+
+    agregado = df[df['CONTA'] == '4'].groupby(['RazaoSocial', 'UF'], as_index=False)['VALOR'].agg(
+        Valor_Total='sum', Media_Trimestral='mean', Desvio_Padrao='std', Qtd_Trimestres='count'
+    )
+    agregado.to_parquet(base / "despesas_agregadas.parquet", index=False)
+
+
+def test_api_com_backend_duckdb(tmp_path):
+    build_processed_dir(tmp_path)
+    env = dict(os.environ, ANS_DB_BACKEND="duckdb", ANS_PROCESSED_DIR=str(tmp_path))
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "tests/test_api.py"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout[-3000:] + result.stderr[-2000:]
+    assert "skipped" not in result.stdout
+
+
+def test_dim_operadoras_materializada_e_refeita_com_dados_novos(tmp_path):
+    from backend import duckdb_store
+    build_processed_dir(tmp_path)
+    relogio = [0.0]
+    store = duckdb_store.DuckDBStore(tmp_path, interval=5, clock=lambda: relogio[0])
+    conn = store.connection()
+    assert conn.execute("SELECT table_name FROM duckdb_tables() WHERE table_name = 'dim_operadoras'").fetchall()
+    assert conn.execute("SELECT count(*) FROM dim_operadoras").fetchone()[0] == 5
+
+    novo = pd.DataFrame([('100006', '66666666000106', 'ZETA SAUDE', 'BA', 'Medicina de Grupo', '3T', 2024, 10.0, '4')],
+                        columns=storage.CONSOLIDADO_COLUMNS)
+    storage.write_partition([novo], tmp_path / "consolidado_despesas", 2024, '3T')
+    # dentro do intervalo: nem confere a versão
+    assert store.connection().execute("SELECT count(*) FROM dim_operadoras").fetchone()[0] == 5
+    relogio[0] = 5.0
+    assert store.connection().execute("SELECT count(*) FROM dim_operadoras").fetchone()[0] == 6
@@ -0,0 +1,170 @@
+import pandas as pd
+import pytest
+
+import cadastro
+
+from tests.test_processor import cadop_raw, write_quarter_zip
+
+
+@pytest.fixture
+def pipeline(etl_stage, tmp_path, monkeypatch):
+    # todos os caminhos do ETL são relativos (data/raw, data/processed)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "raw").mkdir(parents=True)
+    processor = etl_stage("2_processor.py")
+    aggregator = etl_stage("3_aggregator.py")
+    processor.OUTPUT_FORMAT = 'parquet'
+    processor.get_cadop_map = lambda: cadastro.build_cadop_frame(cadop_raw())
+    return processor, aggregator, tmp_path / "data" / "raw"
+
+
+def full_aggregate(aggregator):
+    import storage
+    df = storage.read_consolidado(columns=aggregator.INPUT_COLUMNS)
+    return aggregator.aggregate_data(aggregator.remove_accounting_duplication(aggregator.clean_data(df)))
+
+
+def test_novo_trimestre_processado_sozinho(pipeline, capsys):
+    import state
+    processor, aggregator, raw = pipeline
+    # operadora com UF vazia no cadastro: o incremental trata a chave vazia igual à agregação completa
+    sem_uf = pd.concat([cadop_raw(), pd.DataFrame({
+        'Registro_ANS': ['555'], 'CNPJ': ['444'], 'Razao_Social': ['OP SEM UF'], 'UF': [None], 'Modalidade': ['Cooperativa'],
+    })], ignore_index=True)
+    processor.get_cadop_map = lambda: cadastro.build_cadop_frame(sem_uf.copy())
+    write_quarter_zip(raw / "2024_1T.zip", [('123456', '4', '100,00'), ('789', '4', '50,00'), ('555', '4', '10,00')])
+    write_quarter_zip(raw / "2024_2T.zip", [('123456', '4', '300,00'), ('789', '4', '70,00'), ('555', '4', '20,00')])
+    processor.main()
+    aggregator.main()
+    assert set(state.load_state()['aggregated']) == {"2024_1T.zip", "2024_2T.zip"}
+
+    write_quarter_zip(raw / "2024_3T.zip", [('123456', '4', '200,00'), ('555', '4', '30,00')])
+    capsys.readouterr()
+    processor.main()
+    out = capsys.readouterr().out
+    assert "1 de 3 zips" in out
+    assert "2024_1T.zip" not in out
+
+    aggregator.main()
+    import storage
+    incremental = storage.read_agregado().set_index(['RazaoSocial', 'UF']).sort_index()
+    esperado = full_aggregate(aggregator).astype({'RazaoSocial': object, 'UF': object}).set_index(['RazaoSocial', 'UF']).sort_index()
+
+    assert incremental.index.tolist() == esperado.index.tolist()
+    assert incremental['Qtd_Trimestres'].tolist() == esperado['Qtd_Trimestres'].tolist()
+    for col in ['Valor_Total', 'Media_Trimestral', 'Desvio_Padrao']:
+        assert incremental[col].tolist() == pytest.approx(esperado[col].tolist())
+
+
+def test_batch_atualiza_o_ledger(pipeline, capsys):
+    """o batch reescreve o dataset inteiro; o agregador seguinte não pode confiar num ledger velho"""
+    processor, aggregator, raw = pipeline
+    write_quarter_zip(raw / "2024_1T.zip", [('123456', '4', '100,00'), ('789', '4', '50,00')])
+    processor.main()
+    aggregator.main()
+
+    write_quarter_zip(raw / "2024_2T.zip", [('123456', '4', '300,00')])
+    processor.PROCESSING_MODE = 'batch'
+    processor.main()
+    capsys.readouterr()
+    aggregator.main()
+    assert "1 trimestres novos/alterados" in capsys.readouterr().out
+
+    import storage
+    row = storage.read_agregado().set_index('RazaoSocial').loc['OP A NOVA']
+    assert row['Qtd_Trimestres'] == 2
+    assert row['Valor_Total'] == pytest.approx(400.0)
+
+
+def test_execucao_sem_saida_nao_grava_o_ledger(pipeline, monkeypatch):
+    """sem nada gravado o dataset anterior fica, e os zips não podem ser marcados como processados"""
+    import zipfile
+    import state
+    processor, aggregator, raw = pipeline
+    write_quarter_zip(raw / "2024_1T.zip", [('123456', '4', '100,00')])
+    processor.main()
+    antes = state.load_state()['quarters']
+
+    # reenvio sem nenhum csv dentro, numa execução completa
+    with zipfile.ZipFile(raw / "2024_1T.zip", 'w') as z:
+        z.writestr("leiame.txt", "vazio")
+    monkeypatch.setattr(state, "INCREMENTAL", False)
+    processor.main()
+    assert state.load_state()['quarters'] == antes
+
+
+def test_trimestre_alterado_e_retirado_dos_momentos(pipeline):
+    processor, aggregator, raw = pipeline
+    write_quarter_zip(raw / "2024_1T.zip", [('123456', '4', '100,00')])
+    write_quarter_zip(raw / "2024_2T.zip", [('123456', '4', '300,00')])
+    processor.main()
+    aggregator.main()
+
+    # reenvio do 2T com valor corrigido e remoção do 1T
+    write_quarter_zip(raw / "2024_2T.zip", [('123456', '4', '500,00'), ('123456', '4', '20,00')])
+    (raw / "2024_1T.zip").unlink()
+    processor.main()
+    aggregator.main()
+
+    import storage
+    row = storage.read_agregado().iloc[0]
+    assert row['Qtd_Trimestres'] == 1
+    assert row['Valor_Total'] == pytest.approx(520.0)
+    assert row['Desvio_Padrao'] == 0
+    assert not (storage.CONSOLIDADO_DATASET / "Ano=2024" / "Trimestre=1T").exists()
+
+
+def test_cadastro_alterado_refaz_a_agregacao(pipeline, capsys):
+    processor, aggregator, raw = pipeline
+    write_quarter_zip(raw / "2024_1T.zip", [('123456', '4', '100,00')])
+    processor.main()
+    aggregator.main()
+
+    # mesmo zip, cadastro com a operadora renomeada
+    renomeado = cadop_raw()
+    renomeado.loc[2, 'Razao_Social'] = 'OP A NOVA RENOMEADA'
+    processor.get_cadop_map = lambda: cadastro.build_cadop_frame(renomeado)
+    processor.main()
+    capsys.readouterr()
+    aggregator.main()
+
+    import storage
+    assert "[SKIP]" not in capsys.readouterr().out
+    assert storage.read_agregado()['RazaoSocial'].tolist() == ['OP A NOVA RENOMEADA']
+    assert set(pd.read_parquet(storage.TRIMESTRAIS_PARQUET)['RazaoSocial']) == {'OP A NOVA RENOMEADA'}
+
+
+def test_estado_de_regra_antiga_refaz_a_agregacao(pipeline, capsys):
+    import state
+    processor, aggregator, raw = pipeline
+    write_quarter_zip(raw / "2024_1T.zip", [('123456', '4', '100,00')])
+    processor.main()
+    aggregator.main()
+
+    # totais guardados por uma versão anterior da regra de duplicidade contábil
+    ledger = state.load_state()
+    ledger['aggregated_with']['regra'] = state.DEDUP_RULE_VERSION - 1
+    state.save_state(ledger)
+    assert not aggregator.can_run_incremental(state.load_state())
+
+    capsys.readouterr()
+    aggregator.main()
+    assert "[SKIP]" not in capsys.readouterr().out
+    assert state.load_state()['aggregated_with']['regra'] == state.DEDUP_RULE_VERSION
+
+
+def test_merge_moments_ida_e_volta(etl_stage):
+    aggregator = etl_stage("3_aggregator.py")
+    totals = pd.DataFrame({
+        'RazaoSocial': ['A'] * 4 + ['B'] * 2, 'UF': ['SP'] * 4 + ['RJ'] * 2,
+        'VALOR': [10.0, 20.0, 35.0, 5.0, 7.0, 9.0]
+    })
+    parte1, parte2 = totals.iloc[[0, 1, 4]], totals.iloc[[2, 3, 5]]
+
+    tudo = aggregator.moments_from_totals(totals).set_index(['RazaoSocial', 'UF'])
+    junto = aggregator.merge_moments(aggregator.moments_from_totals(parte1), aggregator.moments_from_totals(parte2))
+    pd.testing.assert_frame_equal(junto.set_index(['RazaoSocial', 'UF']), tudo, check_dtype=False)
+
+    volta = aggregator.merge_moments(junto, aggregator.moments_from_totals(parte2), sign=-1)
+    esperado = aggregator.moments_from_totals(parte1).set_index(['RazaoSocial', 'UF'])
+    pd.testing.assert_frame_equal(volta.set_index(['RazaoSocial', 'UF']), esperado, check_dtype=False)
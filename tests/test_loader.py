@@ -0,0 +1,223 @@
+import pytest
+import pandas as pd
+from sqlalchemy import text
+
+
+def fato_frame():
+    return pd.DataFrame({
+        'REG_ANS': ['123456', '789'],
+        'Ano': [2024, 2024],
+        'Trimestre': pd.Categorical(['1T', '2T']),
+        'CONTA': ['4', '41'],
+        'VALOR': [1234.56, float('nan')],
+        'CNPJ': ['111', None],
+    })
+
+
+def test_formato_do_buffer_copy(etl_stage):
+    loader = etl_stage("4_loader.py")
+    texto = loader.format_copy_chunk(loader.to_fato_frame(fato_frame()), loader.FATO_COLUMNS)
+
+    # sem header, colunas na ordem da tabela e NaN como campo vazio (NULL no COPY csv)
+    assert texto == "123456,2024,1T,4,1234.56\n789,2024,2T,41,\n"
+
+
+def test_texto_com_virgula_e_aspas_e_escapado(etl_stage):
+    loader = etl_stage("4_loader.py")
+    df = pd.DataFrame({'registro_ans': ['1'], 'razao_social': ['ACME, "SAÚDE"\nLTDA']})
+    texto = loader.format_copy_chunk(df, ['registro_ans', 'razao_social'])
+    assert texto == '1,"ACME, ""SAÚDE""\nLTDA"\n'
+
+
+def test_copy_stream_em_lotes(etl_stage):
+    loader = etl_stage("4_loader.py")
+    lotes = [loader.to_fato_frame(fato_frame()) for _ in range(3)]
+    stream = loader.CopyStream(iter(lotes), loader.FATO_COLUMNS)
+
+    partes = []
+    while True:
+        parte = stream.read(7)
+        if not parte:
+            break
+        assert len(parte) <= 7
+        partes.append(parte)
+
+    esperado = loader.format_copy_chunk(lotes[0], loader.FATO_COLUMNS) * 3
+    assert "".join(partes) == esperado
+    assert stream.rows == 6
+
+
+def test_plano_de_carga_so_trimestres_alterados(etl_stage):
+    import state
+    loader = etl_stage("4_loader.py")
+    ledger = {
+        'cadastro': 'x',
+        'loaded_with': {'cadastro': 'x', 'regra': state.DEDUP_RULE_VERSION},
+        'quarters': {
+            '2024_1T.zip': {'sha256': 'a', 'ano': '2024', 'trimestre': '1T'},
+            '2024_2T.zip': {'sha256': 'b2', 'ano': '2024', 'trimestre': '2T'},
+            '2024_3T.zip': {'sha256': 'c', 'ano': '2024', 'trimestre': '3T'},
+        },
+        'loaded': {'2024_1T.zip': 'a', '2024_2T.zip': 'b', '2023_4T.zip': 'd'},
+        'loaded_periods': {'2024_1T.zip': [2024, '1T'], '2024_2T.zip': [2024, '2T'], '2023_4T.zip': [2023, '4T']},
+    }
+
+    pending, removed = loader.plan_fato_load(ledger)
+
+    assert pending == [(2024, '2T'), (2024, '3T')]
+    assert removed == [(2023, '4T')]
+
+
+def test_trimestre_apagado_sai_do_banco_sem_ledger(etl_stage, monkeypatch):
+    import state
+    import storage
+    loader = etl_stage("4_loader.py")
+    monkeypatch.setattr(storage, "list_quarters", lambda: [(2024, '1T'), (2024, '2T')])
+
+    # csv (sem ledger) ou ANS_INCREMENTAL=0: o que sai é o que está no banco e não no consolidado
+    assert loader.plan_fato_load(None, {(2023, '4T'), (2024, '1T')}) == ([(2024, '1T'), (2024, '2T')], [(2023, '4T')])
+    monkeypatch.setattr(state, "INCREMENTAL", False)
+    ledger = {'quarters': {'2024_1T.zip': {'sha256': 'a', 'ano': '2024', 'trimestre': '1T'}}}
+    assert loader.plan_fato_load(ledger, {(2023, '4T')})[1] == [(2023, '4T')]
+
+
+def test_periodos_no_banco(etl_stage):
+    loader = etl_stage("4_loader.py")
+    try:
+        conn = loader.get_engine().connect()
+    except Exception as e:
+        pytest.skip(f"banco indisponível: {e}")
+
+    with conn:
+        tx = conn.begin()
+        try:
+            conn.execute(text("INSERT INTO serie_trimestral (registro_ans, ano, trimestre, total, qtd_lancamentos) VALUES ('1', 2098, '2T', 1, 1)"))
+            if loader.is_partitioned(conn):
+                loader.ensure_year_partition(conn, 2099)
+                conn.execute(text("CREATE TABLE fato_despesas_2099_3t PARTITION OF fato_despesas_2099 FOR VALUES IN ('3T')"))
+            periodos = loader.periodos_no_banco(conn)
+            assert (2098, '2T') in periodos
+            assert ((2099, '3T') in periodos) == loader.is_partitioned(conn)
+        finally:
+            tx.rollback()
+
+
+def test_periodos_no_banco_ignora_indices_das_particoes(etl_stage):
+    """a partição do ano ganha índices filhos (ex: fato_despesas_2099_pkey); a segunda carga não pode ler isso como período"""
+    loader = etl_stage("4_loader.py")
+    try:
+        conn = loader.get_engine().connect()
+    except Exception as e:
+        pytest.skip(f"banco indisponível: {e}")
+
+    with conn:
+        tx = conn.begin()
+        try:
+            if not loader.is_partitioned(conn):
+                pytest.skip("fato_despesas não particionada (rode sql/migration_003_particiona_fato.sql)")
+            conn.execute(text("INSERT INTO dim_operadoras (registro_ans) VALUES ('123456'), ('789') ON CONFLICT DO NOTHING"))
+            antes = loader.periodos_no_banco(conn)
+            df = fato_frame().assign(Ano=2099, Trimestre=['1T', '2T'])
+
+            loader.load_fato_periodos(conn, [df], [(2099, '1T'), (2099, '2T')])
+            assert loader.periodos_no_banco(conn) == antes | {(2099, '1T'), (2099, '2T')}
+
+            # segunda carga por cima da primeira (é aí que o pkey da partição do ano aparecia como período)
+            loader.load_fato_periodos(conn, [df.iloc[1:]], [(2099, '2T')])
+            assert loader.periodos_no_banco(conn) == antes | {(2099, '1T'), (2099, '2T')}
+        finally:
+            tx.rollback()
+
+
+def test_serie_trimestral_descarta_valor_negativo(etl_stage):
+    """lançamento negativo sai antes da regra de duplicidade, como no clean_data (a /serie bate com o agregado)"""
+    aggregator = etl_stage("3_aggregator.py")
+    loader = etl_stage("4_loader.py")
+    # 1: o '4' negativo não conta, ficam '41' + '46'; 2: só o '411' negativo sai
+    linhas = [('1', '4', -5.0), ('1', '41', 6.0), ('1', '46', 4.0), ('2', '41', 7.0), ('2', '411', -2.0)]
+    df = pd.DataFrame({
+        'REG_ANS': [r for r, _, _ in linhas], 'CNPJ': 'A', 'Ano': 2099, 'Trimestre': '1T',
+        'CONTA': [c for _, c, _ in linhas], 'VALOR': [v for _, _, v in linhas],
+    })
+    esperado = aggregator.remove_accounting_duplication(aggregator.clean_data(df)).groupby('REG_ANS')['VALOR'].sum().to_dict()
+    assert esperado == {'1': 10.0, '2': 7.0}
+
+    try:
+        conn = loader.get_engine().connect()
+    except Exception as e:
+        pytest.skip(f"banco indisponível: {e}")
+
+    with conn:
+        tx = conn.begin()
+        try:
+            conn.execute(text("CREATE TEMP TABLE fato_negativos (registro_ans VARCHAR, ano INT, trimestre VARCHAR, conta VARCHAR, valor NUMERIC)"))
+            for reg, conta, valor in linhas:
+                conn.execute(text("INSERT INTO fato_negativos VALUES (:r, 2099, '1T', :c, :v)"), {'r': reg, 'c': conta, 'v': valor})
+            loader.refresh_serie_trimestral(conn, source='fato_negativos', periodos=[(2099, '1T')])
+            totais = conn.execute(text("SELECT registro_ans, total FROM serie_trimestral WHERE ano = 2099")).all()
+            assert {reg: float(total) for reg, total in totais} == esperado
+        finally:
+            tx.rollback()
+
+
+def test_cadastro_alterado_recarrega_todos_os_trimestres(etl_stage, monkeypatch):
+    import state
+    loader = etl_stage("4_loader.py")
+    monkeypatch.setattr(state, "save_state", lambda ledger: None)
+    ledger = {
+        'cadastro': 'novo',
+        'quarters': {
+            '2024_1T.zip': {'sha256': 'a', 'ano': '2024', 'trimestre': '1T'},
+            '2024_2T.zip': {'sha256': 'b', 'ano': '2024', 'trimestre': '2T'},
+        },
+        'loaded': {'2024_1T.zip': 'a', '2024_2T.zip': 'b'},
+        'loaded_periods': {'2024_1T.zip': [2024, '1T'], '2024_2T.zip': [2024, '2T']},
+        'loaded_with': {'cadastro': 'antigo'},
+    }
+
+    # mesmos zips, mas a dimensão (e a fato) precisam sair com o cadastro novo
+    assert loader.plan_fato_load(ledger) == ([(2024, '1T'), (2024, '2T')], [])
+    loader.record_load(ledger)
+    assert loader.plan_fato_load(ledger) == ([], [])
+
+
+def test_troca_de_particao_do_trimestre(etl_stage):
+    """na fato particionada, recarregar um trimestre troca só a partição dele (tudo desfeito no rollback)"""
+    loader = etl_stage("4_loader.py")
+    engine = loader.get_engine()
+    try:
+        conn = engine.connect()
+    except Exception as e:
+        pytest.skip(f"banco indisponível: {e}")
+
+    with conn:
+        tx = conn.begin()
+        try:
+            if not loader.is_partitioned(conn):
+                pytest.skip("fato_despesas não particionada (rode sql/migration_003_particiona_fato.sql)")
+            conn.execute(text("INSERT INTO dim_operadoras (registro_ans) VALUES ('123456'), ('789') ON CONFLICT DO NOTHING"))
+            df = fato_frame().assign(Ano=2099, Trimestre=['1T', '1T'], VALOR=[10.0, 5.0])
+
+            loader.load_fato_periodos(conn, [df], [(2099, '1T')])
+            loader.load_fato_periodos(conn, [df.iloc[:1]], [(2099, '1T')]) # recarga: substitui, não duplica
+            linhas = conn.execute(text("SELECT registro_ans, valor FROM fato_despesas WHERE ano = 2099")).all()
+            assert [(r, float(v)) for r, v in linhas] == [('123456', 10.0)]
+            assert conn.execute(text("SELECT to_regclass('fato_despesas_2099_1t')")).scalar() is not None
+
+            # consulta por período só lê a partição do período (partition pruning)
+            plano = conn.execute(text(
+                "EXPLAIN (FORMAT JSON) SELECT * FROM fato_despesas WHERE ano = 2099 AND trimestre = '1T'"
+            )).scalar()
+            assert 'fato_despesas_2024' not in str(plano)
+
+            loader.retire_periodos(conn, [(2099, '1T')])
+            assert conn.execute(text("SELECT to_regclass('fato_despesas_2099_1t')")).scalar() is None
+        finally:
+            tx.rollback()
+
+
+def test_nome_de_particao_rejeita_trimestre_estranho(etl_stage):
+    loader = etl_stage("4_loader.py")
+    assert loader.partition_names('2024', '1T') == ('fato_despesas_2024', 'fato_despesas_2024_1t')
+    with pytest.raises(ValueError):
+        loader.partition_names(2024, "1T'; DROP TABLE x; --")
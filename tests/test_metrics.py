@@ -0,0 +1,74 @@
+import json
+
+import pandas as pd
+
+import metrics
+
+
+def test_instrument_acumula_linhas_e_chamadas():
+    metrics.reset()
+
+    @metrics.instrument()
+    def filtra(df):
+        return df[df['v'] > 1]
+
+    @metrics.instrument(name='blocos')
+    def blocos(df):
+        for i in range(0, len(df), 2):
+            yield df.iloc[i:i + 2]
+
+    df = pd.DataFrame({'v': [1, 2, 3]})
+    filtra(df)
+    filtra(df)
+    assert sum(len(b) for b in blocos(df)) == 3
+
+    resumo = metrics.summary()
+    assert resumo['filtra']['calls'] == 2
+    assert resumo['filtra']['rows_in'] == 6 and resumo['filtra']['rows_out'] == 4
+    assert resumo['blocos']['rows_out'] == 3
+    assert resumo['filtra']['peak_rss_bytes'] > 0
+
+
+def test_run_stage_grava_json_e_prometheus(tmp_path, monkeypatch):
+    log = tmp_path / "metrics.jsonl"
+    monkeypatch.setattr(metrics, "METRICS_LOG", str(log))
+    monkeypatch.setattr(metrics, "PROM_DIR", str(tmp_path / "prom"))
+
+    @metrics.instrument()
+    def etapa(df):
+        return df
+
+    assert metrics.run_stage("9_teste", lambda: len(etapa(pd.DataFrame({'a': [1, 2]})))) == 2
+
+    eventos = [json.loads(line) for line in log.read_text(encoding="utf-8").splitlines()]
+    assert [e['event'] for e in eventos][0] == 'stage_start' and eventos[-1]['event'] == 'stage_end'
+    assert eventos[-1]['success'] is True and eventos[-1]['stage'] == '9_teste'
+    func = next(e for e in eventos if e.get('function') == 'etapa')
+    assert func['rows_in'] == 2 and func['calls'] == 1
+
+    prom = (tmp_path / "prom" / "ans_etl_9_teste.prom").read_text(encoding="utf-8")
+    assert 'ans_etl_function_rows_out_total{stage="9_teste",function="etapa"} 2' in prom
+    assert 'ans_etl_stage_success{stage="9_teste"} 1' in prom
+
+
+def test_profile_opt_in_da_etapa(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_LOG", "")
+    monkeypatch.setattr(metrics, "PROFILE_STAGE", "9_teste")
+    monkeypatch.setattr(metrics, "PROFILE_DIR", tmp_path)
+
+    metrics.run_stage("8_outra", lambda: None)
+    assert not (tmp_path / "8_outra.prof").exists()
+    metrics.run_stage("9_teste", lambda: sum(range(1000)))
+    assert (tmp_path / "9_teste.prof").exists()
+
+
+def test_rss_sem_proc_nem_resource(monkeypatch):
+    """no Windows não há /proc nem o módulo resource: a medição de memória vira 0 em vez de quebrar o import"""
+    import sys
+
+    def sem_proc(*args, **kwargs):
+        raise OSError("sem /proc")
+
+    monkeypatch.setattr(metrics, "open", sem_proc, raising=False)
+    monkeypatch.setitem(sys.modules, "resource", None) # import resource -> ImportError
+    assert metrics.current_rss() == 0
@@ -0,0 +1,209 @@
+import pytest
+import pandas as pd
+
+import cadastro
+
+
+def cadop_raw():
+    return pd.DataFrame({
+        'Registro_ANS': ['123456', ' 000789', '123456'],
+        'CNPJ': ['111', '222', '333'],
+        'Razao_Social': ['OP A', 'OP B', 'OP A NOVA'],
+        'UF': ['SP', 'RJ', 'SP'],
+        'Modalidade': ['Cooperativa', 'Autogestão', 'Cooperativa'],
+    }, dtype=str)
+
+
+def test_enriquecimento_vetorizado(etl_stage):
+    processor = etl_stage("2_processor.py")
+    cadop_map = cadastro.build_cadop_frame(cadop_raw())
+    df = pd.DataFrame({'REG_ANS': ['123456', '789', '999999'], 'VALOR': ['1', '2', '3']})
+
+    out = processor.enrich_with_cadastro(df, cadop_map)
+
+    # registro duplicado no cadastro: vale o último
+    assert out.loc[0, 'CNPJ'] == '333'
+    assert out.loc[0, 'RazaoSocial'] == 'OP A NOVA'
+    # zeros à esquerda/espaços não impedem o match
+    assert out.loc[1, 'UF'] == 'RJ'
+    # fora do cadastro fica vazio (descartado depois no clean_data)
+    assert out[processor.CADOP_FIELDS].iloc[2].isna().all()
+    assert list(out['VALOR']) == ['1', '2', '3']
+
+
+def test_cadastro_sem_colunas_chave():
+    cadop_map = cadastro.build_cadop_frame(pd.DataFrame({'FOO': ['1']}))
+    assert cadop_map.empty
+
+
+def write_quarter_zip(path, rows):
+    import zipfile
+    header = "DATA;REG_ANS;CD_CONTA_CONTABIL;DESCRICAO;VL_SALDO_INICIAL;VL_SALDO_FINAL\n"
+    body = "".join(f"2024-01-01;{reg};{conta};Descrição;0;{valor}\n" for reg, conta, valor in rows)
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr(f"{path.stem}.csv", (header + body).encode('latin-1'))
+        z.writestr("Leia-me.txt", "nada aqui")
+
+
+def test_streaming_igual_ao_batch(etl_stage, tmp_path):
+    processor = etl_stage("2_processor.py")
+    processor.OUTPUT_FORMAT = 'csv'
+    cadop_map = cadastro.build_cadop_frame(cadop_raw())
+    rows = [('123456', '4', '1.234,56'), ('789', '31', '5,00'), ('789', '41', '10,50'), ('555', '46', '-3,00')] * 5
+    write_quarter_zip(tmp_path / "2024_1T.zip", rows)
+    write_quarter_zip(tmp_path / "2024_2T.zip", rows[:7])
+    zips = sorted(tmp_path.glob("*.zip"))
+
+    processor.OUTPUT_FILE = tmp_path / "batch.csv"
+    processor.run_batch(zips, cadop_map)
+    processor.OUTPUT_FILE = tmp_path / "stream.csv"
+    processor.run_streaming(zips, cadop_map, chunksize=3)
+
+    assert (tmp_path / "stream.csv").read_bytes() == (tmp_path / "batch.csv").read_bytes()
+    assert not (tmp_path / "stream.csv.tmp").exists()
+
+
+def test_paralelo_igual_ao_serial(etl_stage, tmp_path):
+    processor = etl_stage("2_processor.py")
+    processor.PROCESSED_DIR = tmp_path
+    processor.OUTPUT_FORMAT = 'csv'
+    cadop_map = cadastro.build_cadop_frame(cadop_raw())
+    rows = [('123456', '4', '1.234,56'), ('789', '41', '10,50'), ('555', '46', '-3,00')]
+    for i, tri in enumerate(['1T', '2T', '3T', '4T']):
+        write_quarter_zip(tmp_path / f"2023_{tri}.zip", rows * (i + 1))
+    zips = sorted(tmp_path.glob("*.zip"))
+
+    processor.OUTPUT_FILE = tmp_path / "serial.csv"
+    processor.run_streaming(zips, cadop_map, chunksize=4)
+    processor.OUTPUT_FILE = tmp_path / "paralelo.csv"
+    processor.run_parallel(zips, cadop_map, chunksize=4, workers=2)
+
+    assert (tmp_path / "paralelo.csv").read_bytes() == (tmp_path / "serial.csv").read_bytes()
+    assert not list(tmp_path.glob("parts_*"))
+
+
+def test_parquet_particionado(etl_stage, tmp_path):
+    processor = etl_stage("2_processor.py")
+    import storage
+    processor.PROCESSED_DIR = tmp_path
+    processor.OUTPUT_FORMAT = 'parquet'
+    processor.OUTPUT_DATASET = tmp_path / "consolidado"
+    cadop_map = cadastro.build_cadop_frame(cadop_raw())
+    rows = [('123456', '4', '1.234,56'), ('789', '41', '10,50')]
+    write_quarter_zip(tmp_path / "2023_4T.zip", rows)
+    write_quarter_zip(tmp_path / "2024_1T.zip", rows * 3)
+    zips = sorted(tmp_path.glob("*.zip"))
+
+    processor.run_parallel(zips, cadop_map, chunksize=2, workers=2)
+
+    assert (tmp_path / "consolidado" / "Ano=2024" / "Trimestre=1T").is_dir()
+    df = storage.read_consolidado(
+        columns=['REG_ANS', 'UF', 'VALOR', 'Ano', 'Trimestre'],
+        filters=[('Ano', '=', 2024)], fmt='parquet', path=tmp_path / "consolidado"
+    )
+    assert len(df) == 6
+    assert set(df['Ano']) == {2024}
+    assert df['UF'].dtype == 'category'
+    assert df['VALOR'].sum() == pytest.approx(3 * (1234.56 + 10.5))
+
+
+def test_streaming_com_falha_nao_deixa_staging(etl_stage, tmp_path, monkeypatch):
+    import storage
+    processor = etl_stage("2_processor.py")
+    processor.PROCESSED_DIR = tmp_path
+    processor.OUTPUT_FORMAT = 'parquet'
+    processor.OUTPUT_DATASET = tmp_path / "consolidado"
+    write_quarter_zip(tmp_path / "2024_1T.zip", [('123456', '4', '1,00')])
+
+    def disco_cheio(*args, **kwargs):
+        raise OSError("disco cheio")
+    monkeypatch.setattr(storage, "write_partition", disco_cheio)
+
+    with pytest.raises(OSError):
+        processor.run_streaming([tmp_path / "2024_1T.zip"], cadastro.build_cadop_frame(cadop_raw()), chunksize=2)
+    assert not list(tmp_path.glob("dataset_*"))
+
+    # batch em parquet: a falha é na gravação do consolidado
+    with pytest.raises(OSError):
+        processor.run_batch([tmp_path / "2024_1T.zip"], cadastro.build_cadop_frame(cadop_raw()))
+    assert not list(tmp_path.glob("dataset_*"))
+
+    # streaming em csv: a falha é no meio do trimestre
+    processor.OUTPUT_FORMAT = 'csv'
+    processor.OUTPUT_FILE = tmp_path / "consolidado.csv"
+    monkeypatch.setattr(processor, "transform_frame", disco_cheio)
+    with pytest.raises(OSError):
+        processor.run_streaming([tmp_path / "2024_1T.zip"], cadastro.build_cadop_frame(cadop_raw()), chunksize=2)
+    assert not list(tmp_path.glob("consolidado*"))
+
+
+def test_dialeto_decidido_pela_amostra(etl_stage):
+    processor = etl_stage("2_processor.py")
+    utf8 = "REG_ANS,CD_CONTA_CONTABIL,DESCRICAO,VL_SALDO_FINAL\n1,4,\"Descrição, com vírgula\",\"1.234,56\"\n".encode('utf-8')
+    d = processor.detect_dialect(utf8)
+    assert (d.encoding, d.sep, d.decimal) == ('utf-8', ',', ',')
+
+    # latin-1 com acento e linha cortada no fim da amostra
+    latin = "REG_ANS;CD_CONTA_CONTABIL;VL_SALDO_FINAL\n1;4;10.5\n2;41;Ação".encode('latin-1')
+    d = processor.detect_dialect(latin)
+    assert (d.encoding, d.sep, d.decimal) == ('latin-1', ';', '.')
+    assert d.columns == ('REG_ANS', 'CD_CONTA_CONTABIL', 'VL_SALDO_FINAL')
+
+
+def test_membro_lido_uma_vez_so_com_colunas_mapeadas(etl_stage):
+    import io
+    processor = etl_stage("2_processor.py")
+    data = "DATA;REG_ANS;CD_CONTA_CONTABIL;DESCRICAO;VL_SALDO_FINAL\n2024-01-01;1;4;Descrição;1,00\n".encode('latin-1')
+    stream = io.BytesIO(data)
+    df = processor.load_csv_robust(stream, '2024')
+    assert list(df.columns) == ['REG_ANS', 'CD_CONTA_CONTABIL', 'VL_SALDO_FINAL']
+    assert df.iloc[0].tolist() == ['1', '4', '1,00']
+    # mesmo layout/ano: dialeto vem do cache
+    assert ('2024', data.split(b'\n')[0]) in processor._dialect_cache
+
+
+def test_cache_de_dialeto_confere_decimal_e_encoding_do_membro(etl_stage, tmp_path):
+    import zipfile
+    processor = etl_stage("2_processor.py")
+    cadop_map = cadastro.build_cadop_frame(cadop_raw())
+    header = "DATA;REG_ANS;CD_CONTA_CONTABIL;DESCRICAO;VL_SALDO_FINAL\n"
+    # mesmo cabeçalho/ano: o primeiro com ponto decimal, o segundo com vírgula e em utf-8
+    with zipfile.ZipFile(tmp_path / "2024_1T.zip", 'w') as z:
+        z.writestr("a.csv", (header + "2024-01-01;123456;4;Receita;10.50\n").encode('latin-1'))
+        z.writestr("b.csv", (header + "2024-01-01;789;4;Ação;1234,56\n").encode('utf-8'))
+
+    df = processor.process_quarter_zip(tmp_path / "2024_1T.zip", cadop_map)
+    assert df['VALOR'].tolist() == [10.5, 1234.56]
+    with zipfile.ZipFile(tmp_path / "2024_1T.zip") as z, z.open("b.csv") as f:
+        assert processor.sniff_member(f, '2024').encoding == 'utf-8'
+
+
+def test_erro_de_parse_reportado(etl_stage, capsys):
+    import io
+    processor = etl_stage("2_processor.py")
+    processor.CSV_ENGINE = 'c'
+    data = b"REG_ANS;VL_SALDO_FINAL\n1;2\n" + b'3;"sem fechar aspas\n' * 3
+    assert processor.load_csv_robust(io.BytesIO(data)) is None
+    assert "[ERRO] Falha ao ler o csv" in capsys.readouterr().out
+
+
+def test_valor_convertido_na_leitura_com_falhas_contadas(etl_stage, tmp_path, capsys):
+    processor = etl_stage("2_processor.py")
+    cadop_map = cadastro.build_cadop_frame(cadop_raw())
+    rows = [('123456', '4', '1.234,56'), ('123456', '41', '-3,00'), ('789', '4', 'N/D'), ('789', '46', '')]
+    write_quarter_zip(tmp_path / "2024_1T.zip", rows)
+
+    df = processor.process_quarter_zip(tmp_path / "2024_1T.zip", cadop_map)
+    assert df['VALOR'].dtype == 'float64'
+    assert df['VALOR'].tolist()[:2] == [1234.56, -3.0]
+    assert df['VALOR'].isna().tolist()[2:] == [True, True]
+    # só o 'N/D' é falha; campo vazio é ausente
+    assert "1 valores de VALOR não numéricos" in capsys.readouterr().out
+
+
+def test_parse_valor_formatos(etl_stage):
+    processor = etl_stage("2_processor.py")
+    br = pd.Series(['1.234.567,89', ' 10,5 ', '-0,01', 'abc', None])
+    assert processor.parse_valor(br).tolist()[:3] == [1234567.89, 10.5, -0.01]
+    assert processor.parse_valor(br).isna().tolist()[3:] == [True, True]
+    assert processor.parse_valor(pd.Series(['1,234.5', '7']), decimal='.').tolist() == [1234.5, 7.0]
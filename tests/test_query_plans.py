@@ -0,0 +1,194 @@
+"""
+regressão de planos: cada consulta que as rotas da API mandam pro banco, num dataset semeado
+e com estatísticas atualizadas, não pode cair em Seq Scan nas tabelas principais
+
+as consultas não são copiadas aqui: as rotas são chamadas de verdade e o SQL é capturado
+no engine (evento before_cursor_execute), depois roda EXPLAIN de cada uma
+"""
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from fastapi.testclient import TestClient
+
+from backend import database, cache
+from backend.main import app, encode_cursor
+
+# o EXPLAIN reaproveita o SQL/parâmetros capturados no formato do psycopg2
+pytestmark = pytest.mark.skipif(
+    database.ASYNC_DB or database.DUCKDB, reason="regressão de planos roda no Postgres, modo sync"
+)
+
+TABELAS = {'dim_operadoras', 'fato_despesas', 'analise_agregada', 'serie_trimestral'}
+PREFIXO = 'PLN' # registro_ans das linhas semeadas (tudo desfeito no rollback)
+N_OPERADORAS = 3000
+ANOS = [2001, 2002, 2003]
+# índices das migrações 001/002 que as consultas da API precisam; o teste não aplica migração no banco
+INDICES = ['idx_despesas_registro_periodo', 'idx_operadoras_cnpj', 'idx_agregada_valor_total', 'idx_operadoras_razao_registro']
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    """
+    semeia o banco numa transação que é desfeita no fim (mesmo padrão do test_loader.py);
+    as rotas usam a sessão presa a essa conexão, então enxergam as linhas semeadas
+    """
+    try:
+        conn = database.engine.connect()
+    except OperationalError as e:
+        pytest.skip(f"banco indisponível: {e}")
+
+    with conn:
+        faltando = [i for i in INDICES if conn.execute(text("SELECT to_regclass(:i)"), {'i': i}).scalar() is None]
+        if faltando:
+            pytest.skip(f"índices ausentes {faltando} (rode sql/migration_001 e sql/migration_002)")
+        # sem a extensão, a busca ILIKE fica de fora do teste
+        trgm = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar() is not None
+
+        tx = conn.begin()
+        try:
+            particionada = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('fato_despesas')")).scalar() == 'p'
+            if particionada:
+                # mesmas partições que o 4_loader.py cria (anos 2001-2003 não existem nos dados de verdade)
+                for ano in ANOS:
+                    conn.execute(text(f"CREATE TABLE fato_despesas_{ano} PARTITION OF fato_despesas "
+                                      f"FOR VALUES FROM ({ano}) TO ({ano + 1}) PARTITION BY LIST (trimestre)"))
+                    for t in range(1, 5):
+                        conn.execute(text(f"CREATE TABLE fato_despesas_{ano}_{t}t PARTITION OF fato_despesas_{ano} FOR VALUES IN ('{t}T')"))
+            conn.execute(text("""
+                INSERT INTO dim_operadoras (registro_ans, cnpj, razao_social, uf, modalidade)
+                SELECT :p || lpad(i::text, 6, '0'), lpad((90000000000000 + i)::text, 14, '0'),
+                       'OPERADORA PLANO ' || i, 'SP', 'Medicina de Grupo'
+                FROM generate_series(1, :n) i
+            """), {'p': PREFIXO, 'n': N_OPERADORAS})
+            conn.execute(text("""
+                INSERT INTO fato_despesas (registro_ans, ano, trimestre, conta, valor)
+                SELECT :p || lpad(i::text, 6, '0'), 2000 + a, t || 'T', c, i * 1.5
+                FROM generate_series(1, :n) i, generate_series(1, 3) a, generate_series(1, 4) t, unnest(ARRAY['4', '41', '46']) c
+            """), {'p': PREFIXO, 'n': N_OPERADORAS})
+            conn.execute(text("""
+                INSERT INTO serie_trimestral (registro_ans, ano, trimestre, total, qtd_lancamentos)
+                SELECT :p || lpad(i::text, 6, '0'), 2000 + a, t || 'T', i * 1.5, 3
+                FROM generate_series(1, :n) i, generate_series(1, 3) a, generate_series(1, 4) t
+            """), {'p': PREFIXO, 'n': N_OPERADORAS})
+            conn.execute(text("""
+                INSERT INTO analise_agregada (razao_social, uf, valor_total, media_trimestral, desvio_padrao, qtd_trimestres)
+                SELECT 'OPERADORA PLANO ' || i, 'SP', i * 18, i * 1.5, 0, 12 FROM generate_series(1, :n) i
+            """), {'n': N_OPERADORAS})
+            for tabela in sorted(TABELAS):
+                conn.execute(text(f"ANALYZE {tabela}"))
+
+            def sessao_do_teste():
+                db = Session(bind=conn)
+                try:
+                    yield db
+                finally:
+                    db.close()
+
+            app.dependency_overrides[database.get_db] = sessao_do_teste
+            try:
+                yield {'trgm': trgm, 'conn': conn}
+            finally:
+                app.dependency_overrides.pop(database.get_db, None)
+        finally:
+            tx.rollback()
+
+
+def capture_queries(urls, monkeypatch):
+    """chama as rotas e devolve (sql, params) de cada SELECT que elas mandaram pro banco"""
+    capturadas = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'etl_versao' not in statement:
+            capturadas.append((statement, parameters))
+
+    # sem o cache de respostas: toda rota precisa ir no banco
+    monkeypatch.setattr(cache, 'CACHE_ENABLED', False)
+    engine = database.engine
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        with TestClient(app) as client:
+            for url in urls:
+                assert client.get(url).status_code == 200, url
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return capturadas
+
+
+def seq_scans(plan):
+    """tabelas lidas com Seq Scan em algum nó do plano"""
+    achadas = []
+    if plan.get('Node Type') == 'Seq Scan':
+        achadas.append(plan.get('Relation Name'))
+    for filho in plan.get('Plans', []):
+        achadas += seq_scans(filho)
+    return achadas
+
+
+def main_tables(tabelas, pequenas=()):
+    """
+    tabelas principais entre as lidas com Seq Scan (partição fato_despesas_<ano>_<t>t conta como o fato);
+    relação de uma página só fica de fora, ali o Seq Scan é o plano certo
+    """
+    tabelas = [t for t in tabelas if t not in pequenas]
+    return sorted({'fato_despesas' if t.startswith('fato_despesas') else t for t in tabelas} & TABELAS)
+
+
+def small_relations(conn):
+    # ex.: partições de outros trimestres já carregados no banco, com meia dúzia de linhas
+    return set(conn.execute(text("SELECT relname FROM pg_class WHERE relkind = 'r' AND relpages <= 1")).scalars())
+
+
+def keyset_filters(plan):
+    """condições do cursor keyset que ficaram como Filter (linha a linha) em vez de Index Cond"""
+    achadas = [plan['Filter']] if 'razao_social' in plan.get('Filter', '') else []
+    for filho in plan.get('Plans', []):
+        achadas += keyset_filters(filho)
+    return achadas
+
+
+def test_consultas_da_api_sem_seq_scan(dataset, monkeypatch):
+    reg = f"{PREFIXO}001234"
+    # cursor fundo na listagem: custo não pode crescer com a profundidade
+    cursor = encode_cursor({'razao_social': 'OPERADORA PLANO 2500', 'registro_ans': f"{PREFIXO}002500"})
+    urls = [
+        "/api/estatisticas",
+        f"/api/operadoras/{reg}",
+        "/api/operadoras/90000000001234", # busca por CNPJ
+        f"/api/operadoras/{reg}/despesas",
+        f"/api/operadoras/{reg}/serie",
+        "/api/operadoras?page=3&limit=10&count=estimated",
+        f"/api/operadoras?limit=10&count=none&cursor={cursor}",
+    ]
+    if dataset['trgm']:
+        urls.append("/api/operadoras?search=PLANO 12&limit=10&count=estimated")
+
+    consultas = capture_queries(urls, monkeypatch)
+    assert consultas
+
+    conn = dataset['conn']
+    pequenas = small_relations(conn)
+    cur = conn.connection.dbapi_connection.cursor()
+    for statement, parameters in consultas:
+        cur.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        plano = cur.fetchone()[0]
+        tabelas = main_tables(seq_scans(plano[0]['Plan']), pequenas)
+        assert not tabelas, f"Seq Scan em {tabelas}:\n{statement}"
+        filtros = keyset_filters(plano[0]['Plan'])
+        assert not filtros, f"keyset como Filter {filtros}:\n{statement}"
+
+
+def test_seq_scan_em_particao_do_fato_e_detectado(dataset):
+    # sem índices o plano lê as partições (fato_despesas_2002_1t...), nunca o pai pelo nome
+    conn = dataset['conn']
+    # savepoint: o rollback desfaz só os SET LOCAL, não as linhas semeadas
+    savepoint = conn.begin_nested()
+    cur = conn.connection.dbapi_connection.cursor()
+    for opcao in ('enable_indexscan', 'enable_indexonlyscan', 'enable_bitmapscan'):
+        cur.execute(f"SET LOCAL {opcao} = off")
+    cur.execute("EXPLAIN (FORMAT JSON) SELECT * FROM fato_despesas WHERE registro_ans = %s AND ano = 2002",
+                (f"{PREFIXO}001234",))
+    plano = cur.fetchone()[0]
+    savepoint.rollback()
+    pequenas = small_relations(conn)
+    assert main_tables(seq_scans(plano[0]['Plan']), pequenas) == ['fato_despesas']
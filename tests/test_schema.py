@@ -0,0 +1,58 @@
+import pandas as pd
+
+import cadastro
+import schema
+import storage
+
+
+def frame():
+    return pd.DataFrame({
+        'REG_ANS': ['012345', '012345', '789'],
+        'CNPJ': ['00000000000191', '00000000000191', None],
+        'RazaoSocial': ['OPERADORA A', 'OPERADORA A', 'OPERADORA B'],
+        'UF': ['SP', 'SP', 'RJ'],
+        'Modalidade': ['Autogestão'] * 3,
+        'VALOR': [0.1, 0.2, 1234.56],
+        'CONTA': ['4', '41', '4'],
+    })
+
+
+def test_consolidado_lido_com_tipos_compactos(tmp_path):
+    storage.write_partition([frame()], tmp_path, 2024, '1T')
+    df = storage.read_consolidado(fmt='parquet', path=tmp_path)
+
+    for col in schema.CATEGORICAL_COLUMNS:
+        assert isinstance(df[col].dtype, pd.CategoricalDtype), col
+    assert df['Ano'].dtype == 'int16' and df['VALOR'].dtype == 'float64'
+    # códigos de dicionário, não inteiro puro: zero à esquerda preservado
+    assert df['REG_ANS'].astype(str).tolist() == ['012345', '012345', '789']
+    assert df['CNPJ'].isna().tolist() == [False, False, True]
+
+    lotes = list(storage.iter_consolidado(fmt='parquet', path=tmp_path, batch_rows=2))
+    assert [len(l) for l in lotes] == [2, 1]
+    assert all(isinstance(l['CONTA'].dtype, pd.CategoricalDtype) for l in lotes)
+
+
+def test_centavos_somam_exato():
+    valores = pd.Series([0.1] * 10 + [0.2] * 10)
+    assert valores.sum() != 3.0 # float puro acumula erro
+    assert schema.from_cents([schema.to_cents(valores).sum()])[0] == 3.0
+    assert schema.to_cents(pd.Series([float('nan'), -12.34])).tolist() == [0, -1234]
+
+
+def test_processor_entrega_o_frame_tipado(etl_stage, tmp_path):
+    from tests.test_processor import cadop_raw, write_quarter_zip
+    processor = etl_stage("2_processor.py")
+    cadop_map = cadastro.build_cadop_frame(cadop_raw())
+    write_quarter_zip(tmp_path / "2024_1T.zip", [('123456', '4', '1,00'), ('999', '41', '2,00')])
+    write_quarter_zip(tmp_path / "2024_2T.zip", [('789', '46', '3,00')])
+
+    partes = [processor.process_quarter_zip(z, cadop_map) for z in sorted(tmp_path.glob("*.zip"))]
+    df = schema.concat(partes)
+
+    # dicionários diferentes por trimestre (REG_ANS/CONTA) continuam categóricos depois do concat
+    for col in schema.CATEGORICAL_COLUMNS:
+        assert isinstance(df[col].dtype, pd.CategoricalDtype), col
+    assert df['Ano'].dtype == 'int16'
+    assert df['CONTA'].astype(str).tolist() == ['4', '41', '46']
+    assert df['RazaoSocial'].tolist()[0] == 'OP A NOVA' and pd.isna(df['CNPJ'][1])
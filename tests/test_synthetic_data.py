@@ -0,0 +1,25 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+import synthetic_ans
+import cadastro
+
+
+def test_gerador_sintetico_passa_pelo_processor(etl_stage, tmp_path):
+    """os zips/cadastro sintéticos são lidos pelo processor como os arquivos reais da ANS"""
+    processor = etl_stage("2_processor.py")
+    cadastro_csv, zips = synthetic_ans.generate(tmp_path, n_operators=50, n_rows=2000, n_quarters=2)
+    assert [z.name for z in zips] == ["2021_1T.zip", "2021_2T.zip"]
+
+    cadop_map = cadastro.build_cadop_frame(pd.read_csv(cadastro_csv, sep=';', dtype=str))
+    assert len(cadop_map) == 50
+
+    df = processor.process_quarter_zip(zips[0], cadop_map)
+    # só contas de despesa (4x) passam; ~5% fora do cadastro ficam sem CNPJ
+    assert df['CONTA'].str.startswith('4').all()
+    assert 0 < df['CNPJ'].isna().mean() < 0.15
+    # VALOR já sai numérico da leitura
+    assert df['VALOR'].dtype == 'float64' and df['VALOR'].notna().all()